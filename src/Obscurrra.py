@@ -3,14 +3,40 @@ from tkinter import filedialog, messagebox, ttk, scrolledtext
 
 import os
 import logging
+import logging.handlers
 from PIL import Image, ImageTk
 import threading
 import sys
 import cv2
-import glob
+import numpy as np
+import inspect
 import time
+import argparse
+import multiprocessing
+import multiprocessing.util
+import signal
+import queue
+import shutil
+import json
+import hashlib
+import sqlite3
+import tempfile
+import itertools
+import fnmatch
+import collections
+import http.server
 from mtcnn.mtcnn import MTCNN
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 class ScrollableFrame(ttk.Frame):
@@ -46,11 +72,133 @@ class ScrollableFrame(ttk.Frame):
         self.bind_all("<Shift-MouseWheel>", _on_mouse_wheel)
 
 
+class VirtualListbox(ttk.Frame):
+    """
+    A multiple-selection list that only puts the visible rows into its Listbox.
+
+    The items and the selected indices are kept in Python, so the list can hold
+    hundreds of thousands of file names and grow while a folder is being scanned
+    without Tk having to lay them all out.
+    """
+    def __init__(self, container, height=10, width=50, **kwargs):
+        """
+        Initializes the VirtualListbox.
+
+        Args:
+            container (Widget): The parent widget.
+            height (int): The number of visible rows.
+            width (int): The width of the list in characters.
+        """
+        super().__init__(container, **kwargs)
+        self.items = []
+        self.selected = set()
+        self.first = 0
+        self.height = height
+
+        self.listbox = tk.Listbox(self, selectmode=tk.MULTIPLE, width=width, height=height, exportselection=False)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.listbox.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", self._on_mouse_wheel)
+        self.listbox.bind("<Button-4>", lambda event: self._scroll(-1))
+        self.listbox.bind("<Button-5>", lambda event: self._scroll(1))
+
+    def set_items(self, items):
+        """Replaces the items of the list and clears the selection."""
+        self.items = list(items)
+        self.selected.clear()
+        self.first = 0
+        self.render()
+
+    def extend(self, items):
+        """Appends items to the list, redrawing the rows only when the new items are visible."""
+        visible = len(self.items) < self.first + self.height
+        self.items.extend(items)
+        if visible:
+            self.render()
+        else:
+            self._update_scrollbar()
+
+    def size(self):
+        """Returns the number of items in the list."""
+        return len(self.items)
+
+    def get_selection(self):
+        """Returns the selected items in list order."""
+        return [self.items[index] for index in sorted(self.selected)]
+
+    def yview(self, *args):
+        """Scrolls the list, called by the scrollbar with 'moveto' or 'scroll' arguments."""
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.items))
+        elif args[0] == 'scroll':
+            step = self.height if args[2] == 'pages' else 1
+            self.first += int(args[1]) * step
+        self.render()
+
+    def render(self):
+        """Puts the visible items into the Listbox."""
+        self.first = max(0, min(self.first, len(self.items) - self.height))
+        self.listbox.delete(0, tk.END)
+        visible_items = self.items[self.first:self.first + self.height]
+        if visible_items:
+            self.listbox.insert(tk.END, *visible_items)
+        for row in range(len(visible_items)):
+            if self.first + row in self.selected:
+                self.listbox.selection_set(row)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        if self.items:
+            self.scrollbar.set(self.first / len(self.items), min(1.0, (self.first + self.height) / len(self.items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_select(self, event=None):
+        selected_rows = set(self.listbox.curselection())
+        for row in range(self.listbox.size()):
+            if row in selected_rows:
+                self.selected.add(self.first + row)
+            else:
+                self.selected.discard(self.first + row)
+
+    def _scroll(self, rows):
+        self.first += rows
+        self.render()
+        return "break"
+
+    def _on_mouse_wheel(self, event):
+        # Keeps the scrollable window from scrolling as well
+        return self._scroll(-1 * int(event.delta / 120) or (-1 if event.delta > 0 else 1))
+
+
 class ObscurrraGUI(tk.Tk):
     """
     This class represents the main GUI application for Obscurrra.
     It is built using Tkinter and tk.Tk for themed widgets.
+
+    Tk is not thread-safe, so the processing threads never touch a widget. They
+    post events with post_ui_event and the main loop applies them in
+    drain_ui_events every UI_REFRESH_MS milliseconds.
+
+    Log records go through a QueueHandler, so logging never waits for the widget.
+    Lines waiting to be shown are kept in a ring buffer of LOG_BUFFER_LINES, and the
+    log display keeps the last LOG_MAX_LINES lines.
+
+    Previews come from the thumbnails the ImageProcessor returns with each result
+    and show the latest image at most every PREVIEW_INTERVAL_MS milliseconds.
+
+    Input folders are scanned on a background thread that posts the image names in
+    chunks of SCAN_CHUNK_SIZE to the virtualised images list.
     """
+    UI_REFRESH_MS = 33
+    PREVIEW_INTERVAL_MS = 250
+    PREVIEW_SIZE = 200
+    SCAN_CHUNK_SIZE = 1000
+    LOG_BUFFER_LINES = 10000
+    LOG_MAX_LINES = 5000
 
     def __init__(self):
         """Initializes the Obscurrra GUI application."""
@@ -81,16 +229,25 @@ class ObscurrraGUI(tk.Tk):
         self.full_logo_photo = ImageTk.PhotoImage(self.full_logo_image)
         
         # Initialize main components
-        self.main_program = MainProgram()
         self.image_processor = ImageProcessor()
+        self.image_processor.preview_size = self.PREVIEW_SIZE
         self.cancel_flag = False
         self.zoom_factor = 1.0
         self.selected_files = []
+        self.ui_events = queue.Queue()
+        self.log_lines = collections.deque(maxlen=self.LOG_BUFFER_LINES)
+        self.pending_preview = None
+        self.last_preview_time = 0.0
+        self.scan_id = 0
 
         # Define the face detection model variables
         self.mtcnn_var = tk.BooleanVar()
         self.frontalface_var = tk.BooleanVar()
         self.profileface_var = tk.BooleanVar()
+        self.detection_cache_var = tk.BooleanVar()
+        self.force_full_run_var = tk.BooleanVar()
+        self.recursive_var = tk.BooleanVar()
+        self.summary_log_var = tk.BooleanVar(value=True)
 
         # Create a scrollable frame
         self.scrollable_frame = ScrollableFrame(self)
@@ -106,6 +263,12 @@ class ObscurrraGUI(tk.Tk):
         self.blur_intensity_slider.set(50)
         self.mtcnn_var.set(True)
 
+        # Start applying the events posted by the processing threads
+        self.ui_refresh_job = self.after(self.UI_REFRESH_MS, self.drain_ui_events)
+
+        # Load the default model in the background so the first image does not wait for it
+        ModelRegistry.warm_up(['mtcnn'], background=True)
+
 
     def create_label_entry_pair(self, parent, label_text, row, column, entry_width=50):
         """Creates a label and entry widget pair."""
@@ -115,9 +278,9 @@ class ObscurrraGUI(tk.Tk):
         entry.grid(row=row, column=column+1, padx=5, pady=5, sticky="ew")
         return label, entry
 
-    def create_checkbox(self, parent, text, variable, row, column, sticky="w"):
+    def create_checkbox(self, parent, text, variable, row, column, sticky="w", command=None):
         """Creates a checkbox widget."""
-        checkbox = ttk.Checkbutton(parent, text=text, variable=variable)
+        checkbox = ttk.Checkbutton(parent, text=text, variable=variable, command=command)
         checkbox.grid(row=row, column=column, padx=5, pady=5, sticky=sticky)
         return checkbox
     
@@ -131,12 +294,114 @@ class ObscurrraGUI(tk.Tk):
             logging.info(f"Log saved to {log_file}")
 
     def redirect_logging(self):
-        """Redirects logging output to the GUI's log display."""
-        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-        log_handler = LogHandler(self.log_display)
-        logging.getLogger().addHandler(log_handler)
-        logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+        """
+        Redirects logging output to the GUI's log display.
+
+        The root logger only puts records on a queue; a QueueListener thread formats
+        them for the console and the log display.
+        """
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        handlers = (console_handler, LogHandler(self.post_ui_event), logging.StreamHandler(sys.stdout))
+        log_queue = queue.SimpleQueue()
+        self.log_queue_handler = logging.handlers.QueueHandler(log_queue)
+        self.log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+        logging.getLogger().addHandler(self.log_queue_handler)
+        self.log_listener.start()
+        self.set_log_level()
+
+    def set_log_level(self):
+        """
+        Sets the logging level from the Summary Log checkbox.
+
+        The summary logs a line per image; the detailed log adds every processing
+        step, which costs noticeable time per image on small inputs.
+        """
+        logging.getLogger().setLevel(logging.INFO if self.summary_log_var.get() else logging.DEBUG)
     
+    def post_ui_event(self, kind, payload=None):
+        """
+        Queues a widget update to be applied on the Tk main loop. Safe to call from any thread.
+
+        Log lines go to the log_lines ring buffer, which drops the oldest lines
+        when the display falls more than LOG_BUFFER_LINES behind.
+
+        Args:
+            kind (str): 'log', 'progress', 'stats', 'preview', 'dialog', 'images' or 'scan_done'.
+            payload: The data of the event, see drain_ui_events.
+        """
+        if kind == 'log':
+            self.log_lines.append(payload)
+        else:
+            self.ui_events.put((kind, payload))
+
+    def drain_ui_events(self):
+        """
+        Applies the events posted since the last refresh to the widgets.
+
+        Events are coalesced: all log lines are inserted at once and only the latest
+        progress, counters and preview are drawn, so a tick costs the same whether one
+        or a thousand images finished in between.
+        """
+        log_lines = []
+        latest = {}
+        dialogs = []
+        image_chunks = []
+        try:
+            while self.log_lines:
+                log_lines.append(self.log_lines.popleft())
+            while True:
+                try:
+                    kind, payload = self.ui_events.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'dialog':
+                    dialogs.append(payload)
+                elif kind == 'images':
+                    image_chunks.append(payload)
+                else:
+                    latest[kind] = payload
+
+            if log_lines:
+                self.log_display.insert(tk.END, "\n".join(log_lines[-self.LOG_MAX_LINES:]) + "\n")
+                excess_lines = int(self.log_display.index('end-1c').split('.')[0]) - 1 - self.LOG_MAX_LINES
+                if excess_lines > 0:
+                    self.log_display.delete('1.0', f'{excess_lines + 1}.0')
+                self.log_display.yview(tk.END)
+            if 'progress' in latest:
+                value, maximum = latest['progress']
+                self.progress_bar.configure(value=value, maximum=maximum)
+            if 'stats' in latest:
+                total_images, total_faces, elapsed_time = latest['stats']
+                self.total_images_count.config(text=str(total_images))
+                self.total_faces_count.config(text=str(total_faces))
+                if elapsed_time is not None:
+                    self.time_taken_count.config(text=f"{elapsed_time:.2f} seconds")
+            for scan_id, image_names in image_chunks:
+                if scan_id == self.scan_id:
+                    self.images_listbox.extend(image_names)
+            if image_chunks and 'scan_done' not in latest:
+                self.images_count_label.config(text=f"Scanning... {self.images_listbox.size()} found")
+            if 'scan_done' in latest and latest['scan_done'] == self.scan_id:
+                count = self.images_listbox.size()
+                self.images_count_label.config(text=f"{count} images" if count else "No images found")
+            if 'preview' in latest:
+                self.pending_preview = latest['preview']
+            if self.pending_preview is not None and time.monotonic() - self.last_preview_time >= self.PREVIEW_INTERVAL_MS / 1000:
+                try:
+                    self.update_image_preview(*self.pending_preview)
+                except Exception as e:
+                    logging.error(f"Error updating image preview: {e}")
+                self.pending_preview = None
+                self.last_preview_time = time.monotonic()
+            for dialog, title, message in dialogs:
+                if dialog == 'error':
+                    messagebox.showerror(title, message)
+                else:
+                    messagebox.showinfo(title, message)
+        finally:
+            self.ui_refresh_job = self.after(self.UI_REFRESH_MS, self.drain_ui_events)
+
     def clear_log(self):
         """Clears the log display."""
         self.log_display.delete('1.0', tk.END)
@@ -147,7 +412,7 @@ class ObscurrraGUI(tk.Tk):
         script_dir = os.path.dirname(os.path.abspath(__file__))
         folder_selected = filedialog.askdirectory(initialdir=script_dir)
         if folder_selected:
-            if any([image.lower().endswith(('jpg', 'jpeg', 'png', 'webp')) for image in os.listdir(folder_selected)]):
+            if next(DirectoryManager.walk_image_files([folder_selected], recursive=self.recursive_var.get()), None) is not None:
                 self.input_folder_entry.delete(0, tk.END)
                 self.input_folder_entry.insert(0, folder_selected)
                 self.selected_files = []
@@ -157,6 +422,11 @@ class ObscurrraGUI(tk.Tk):
                 logging.error("The selected folder does not contain any valid images.")
                 messagebox.showerror("Error", "The selected folder does not contain any valid images.")
 
+    def toggle_recursive(self):
+        """Lists the images of the input folder again when Include Subfolders is toggled."""
+        if not self.selected_files and os.path.isdir(self.input_folder_entry.get()):
+            self.load_images()
+
     def browse_output_folder(self):
         """Opens a dialog to browse and select the output folder."""
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -181,27 +451,53 @@ class ObscurrraGUI(tk.Tk):
             logging.info(f"Selected individual images: {files_selected}")
 
     def load_images(self):
-        """Loads selected images into the images listbox."""
-        self.images_listbox.delete(0, tk.END)
+        """
+        Loads selected images into the images listbox.
+
+        Folders are scanned by scan_images on a background thread, so the list fills
+        in while the folder is read.
+        """
+        self.scan_id += 1
+        self.images_listbox.set_items([])
         if self.selected_files:
-            for image in self.selected_files:
-                self.images_listbox.insert(tk.END, os.path.basename(image))
+            self.images_listbox.set_items([os.path.basename(image) for image in self.selected_files])
+            self.images_count_label.config(text=f"{len(self.selected_files)} images")
             logging.info(f"Loaded selected images: {self.selected_files}")
         else:
             input_folder = self.input_folder_entry.get()
             if os.path.isdir(input_folder):
-                images_found = False
-                for image in os.listdir(input_folder):
-                    if image.lower().endswith(('jpg', 'jpeg', 'png', 'webp', 'bmp', 'gif', 'tiff', 'tif', 'ico')):
-                        self.images_listbox.insert(tk.END, image)
-                        images_found = True
-                if not images_found:
-                    self.images_listbox.insert(tk.END, "No images selected. Please browse and select images to process.")
-                logging.info(f"Loaded images from folder: {input_folder}")
+                self.images_count_label.config(text="Scanning...")
+                threading.Thread(target=self.scan_images, args=(input_folder, self.scan_id, self.recursive_var.get(),
+                                                                self.output_folder_entry.get()), daemon=True).start()
+                logging.info(f"Loading images from folder: {input_folder}")
             else:
                 logging.error("Invalid input folder")
                 messagebox.showerror("Error", "Invalid input folder")
 
+    def scan_images(self, input_folder, scan_id, recursive=False, output_folder=None):
+        """
+        Posts the image paths of a folder, relative to it, to the images list in chunks. Runs on a worker thread.
+
+        Args:
+            input_folder (str): The folder to scan.
+            scan_id (int): The scan this thread belongs to; it stops once a newer scan starts.
+            recursive (bool): Also list the images in subfolders.
+            output_folder (str): The output folder, not listed when it is inside the input folder.
+        """
+        prefix_length = len(os.path.join(input_folder, ''))
+        skip_dirs = [output_folder] if output_folder else []
+        chunk = []
+        for image_path in DirectoryManager.walk_image_files([input_folder], recursive=recursive, skip_dirs=skip_dirs):
+            if scan_id != self.scan_id:
+                return
+            chunk.append(image_path[prefix_length:])
+            if len(chunk) >= self.SCAN_CHUNK_SIZE:
+                self.post_ui_event('images', (scan_id, chunk))
+                chunk = []
+        if chunk:
+            self.post_ui_event('images', (scan_id, chunk))
+        self.post_ui_event('scan_done', scan_id)
+
     def create_widgets(self):
         """Creates all the widgets for the GUI."""
         self.style = ttk.Style(self)
@@ -222,6 +518,8 @@ class ObscurrraGUI(tk.Tk):
 
         self.select_images_button = ttk.Button(top_frame, text="Select Individual Images", command=self.browse_images)
         self.select_images_button.grid(row=2, column=0, columnspan=3, padx=5, pady=5)
+        self.recursive_checkbox = self.create_checkbox(top_frame, "Include Subfolders", self.recursive_var, 3, 0,
+                                                       command=self.toggle_recursive)
 
         # Image and Model Selection Frame
         middle_frame = ttk.LabelFrame(self.scrollable_frame.scrollable_frame, text="Image and Model Selection", padding="10")
@@ -232,7 +530,9 @@ class ObscurrraGUI(tk.Tk):
 
         self.images_label = ttk.Label(middle_frame, text="Images:")
         self.images_label.grid(row=0, column=0, padx=5, pady=5, sticky="nw")
-        self.images_listbox = tk.Listbox(middle_frame, selectmode=tk.MULTIPLE, width=50, height=10)
+        self.images_count_label = ttk.Label(middle_frame, text="")
+        self.images_count_label.grid(row=0, column=0, padx=5, pady=5, sticky="sw")
+        self.images_listbox = VirtualListbox(middle_frame, height=10, width=50)
         self.images_listbox.grid(row=0, column=1, columnspan=3, padx=5, pady=5, sticky="ew")
 
         self.models_label = ttk.Label(middle_frame, text="Face Detection Models:")
@@ -254,6 +554,9 @@ class ObscurrraGUI(tk.Tk):
         self.blur_intensity_slider.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
         self.blur_intensity_value_label = ttk.Label(settings_frame, text="50")
         self.blur_intensity_value_label.grid(row=1, column=2, padx=5, pady=5, sticky="w")
+        self.detection_cache_checkbox = self.create_checkbox(settings_frame, "Cache Detections", self.detection_cache_var, 2, 0,
+                                                             command=self.toggle_detection_cache)
+        self.force_full_run_checkbox = self.create_checkbox(settings_frame, "Force Full Run", self.force_full_run_var, 2, 1)
 
         # Processing Control and Log Frame
         bottom_frame = ttk.LabelFrame(self.scrollable_frame.scrollable_frame, text="Processing Control and Log", padding="10")
@@ -299,6 +602,8 @@ class ObscurrraGUI(tk.Tk):
         self.time_taken_count = ttk.Label(bottom_frame, text="0")
         self.time_taken_count.grid(row=7, column=1, padx=5, pady=5, sticky="ew")
 
+        self.summary_log_checkbox = self.create_checkbox(bottom_frame, "Summary Log", self.summary_log_var, 8, 0, command=self.set_log_level)
+
         # Image Preview Frame
         image_preview_frame = ttk.LabelFrame(self.scrollable_frame.scrollable_frame, text="Image Preview", padding="10")
         image_preview_frame.grid(row=4, column=0, padx=10, pady=5, sticky="ew")
@@ -365,15 +670,20 @@ class ObscurrraGUI(tk.Tk):
         self.blur_intensity_value_label.config(text=str(int(float(value))))
         logging.info(f"Blur intensity set to {value}")
 
+    def toggle_detection_cache(self):
+        """Turns the per-user detection cache on or off for the next runs."""
+        if self.detection_cache_var.get():
+            self.image_processor.detection_cache_path = DetectionCache.default_path()
+            logging.info(f"Caching detected faces in {self.image_processor.detection_cache_path}")
+        else:
+            self.image_processor.detection_cache_path = None
+            logging.info("Detection cache disabled")
+
     def start_processing(self):
         input_folder = self.input_folder_entry.get()
         output_folder = self.output_folder_entry.get()
         models = []
         if self.mtcnn_var.get():
-            if self.image_processor.face_detection.mtcnn_detector is None:
-                messagebox.showerror("Error", "MTCNN model is not initialized.")
-                logging.error("MTCNN model is not initialized.")
-                return
             models.append('mtcnn')
         if self.frontalface_var.get():
             models.append('frontalface')
@@ -381,6 +691,8 @@ class ObscurrraGUI(tk.Tk):
         if self.profileface_var.get():
             models.append('profileface')
             logging.info(f"Frontface model appended")
+        if not self.require_models(models):
+            return
 
         if not os.path.isdir(input_folder) and not self.selected_files:
             messagebox.showerror("Error", "Invalid input folder or no images selected")
@@ -399,7 +711,9 @@ class ObscurrraGUI(tk.Tk):
         self.log_display.delete('1.0', tk.END)
         
         logging.debug("Starting image processing thread.")
-        threading.Thread(target=self.process_images, args=(input_folder, output_folder, models)).start()
+        threading.Thread(target=self.process_images, args=(input_folder, output_folder, models, self.get_blur_effect(),
+                                                           self.force_full_run_var.get(), self.recursive_var.get(),
+                                                           self.images_listbox.size())).start()
 
     def cancel_processing(self):
         """Sets the cancel flag to stop processing."""
@@ -419,61 +733,130 @@ class ObscurrraGUI(tk.Tk):
         self.pause_button.config(state=tk.NORMAL)
         self.resume_button.config(state=tk.DISABLED)
         logging.info("Processing resumed by user.")
-        threading.Thread(target=self.process_images, args=(self.input_folder_entry.get(), self.output_folder_entry.get(), self.get_selected_models())).start()
+        threading.Thread(target=self.process_images, args=(self.input_folder_entry.get(), self.output_folder_entry.get(), self.get_selected_models(), self.get_blur_effect(), False, self.recursive_var.get(), self.images_listbox.size())).start()
+
+    def require_models(self, models):
+        """Loads the selected models, showing an error and returning False if one cannot be loaded."""
+        try:
+            ModelRegistry.require(models)
+        except IOError as e:
+            messagebox.showerror("Error", str(e))
+            logging.error(str(e))
+            return False
+        return True
+
+    def get_selected_models(self):
+        """Returns the face detection models selected in the GUI."""
+        models = []
+        if self.mtcnn_var.get():
+            models.append('mtcnn')
+        if self.frontalface_var.get():
+            models.append('frontalface')
+        if self.profileface_var.get():
+            models.append('profileface')
+        return models
+
+    def get_blur_effect(self):
+        """Returns the blur effect set with the intensity slider. Must be called on the Tk main loop."""
+        blur_intensity = int(self.blur_intensity_value_label.cget("text"))
+        return (blur_intensity, blur_intensity)
   
-    def process_images(self, input_folder, output_folder, models):
-        """Processes all images in the input folder using the selected models and blurs detected faces."""
+    def process_images(self, input_folder, output_folder, models, blur_effect, force=False, recursive=False, expected_images=0):
+        """
+        Processes all images in the input folder using the selected models and blurs detected faces.
+
+        With recursive, images in subfolders are processed too and their outputs keep
+        the subfolder inside the output folder. The folder is walked lazily, so processing
+        starts before a large tree has been read; expected_images, the number of images
+        in the images list, sizes the progress bar until the walk finds more.
+
+        Processed images are recorded in the manifest of the output folder, and images
+        it records as done with the same settings are skipped unless force is set.
+        Runs on a worker thread, so the widgets are only updated through post_ui_event.
+        """
         total_images = 0
         total_faces = 0
         no_faces = 0
-        image_files = self.selected_files if self.selected_files else [os.path.join(input_folder, f) for f in os.listdir(input_folder) if f.lower().endswith(('jpg', 'jpeg', 'png', 'webp', 'bmp', 'gif', 'tiff', 'tif', 'ico'))]
+        if self.selected_files:
+            image_files = self.selected_files
+            expected_images = len(image_files)
+            self.image_processor.input_root = None
+        else:
+            image_files = DirectoryManager.walk_image_files([input_folder], recursive=recursive, skip_dirs=[output_folder])
+            self.image_processor.input_root = os.path.abspath(input_folder)
 
-        blur_intensity = int(self.blur_intensity_value_label.cget("text"))
-        blur_effect = (blur_intensity, blur_intensity)
         start_time = time.time()
+        histogram = TimingHistogram()
+        manifest = self.open_manifest(output_folder, models, blur_effect)
+        if not force:
+            image_files = manifest.pending(image_files)
 
         try:
-            self.log_display.insert(tk.END, "Starting processing...\n")
-            self.progress_bar['value'] = 0
-            self.progress_bar['maximum'] = len(image_files)
+            self.post_ui_event('log', "Starting processing...")
+            self.post_ui_event('progress', (0, max(expected_images, 1)))
 
             for index, image_file in enumerate(image_files):
                 if self.cancel_flag:
                     break
+                image_count = max(expected_images - manifest.skipped, index + 1)
 
                 try:
                     result = self.image_processor.process_single_image(image_file, output_folder, models, blur_effect)
                 except Exception as e:
                     logging.error(f"Error processing image {image_file}: {e}")
-                    self.log_display.insert(tk.END, f"Error processing image {image_file}: {e}\n")
+                    self.post_ui_event('log', f"Error processing image {image_file}: {e}")
                     continue
 
+                manifest.record(image_file, result['output_path'])
                 total_images += 1
                 total_faces += result['faces']
                 if result['faces'] == 0:
                     no_faces += 1
-                self.progress_bar['value'] = total_images
-                self.log_display.insert(tk.END, f"Processed {index+1}/{len(image_files)}: {os.path.basename(image_file)}, found {result['faces']} faces.\n")
-                self.log_display.yview(tk.END)
-                self.update_image_preview(image_file, result['output_path'])
+                histogram.add(result['timings'])
+                self.post_ui_event('progress', (total_images, image_count))
+                self.post_ui_event('log', f"Processed {index+1}/{image_count}: {os.path.basename(image_file)}, found {result['faces']} faces.")
+                if 'preview' in result:
+                    self.post_ui_event('preview', result['preview'])
 
             elapsed_time = time.time() - start_time
-            self.time_taken_count.config(text=f"{elapsed_time:.2f} seconds")
+            self.post_ui_event('stats', (total_images, total_faces, elapsed_time))
+            if manifest.skipped:
+                self.post_ui_event('log', f"Skipped {manifest.skipped} images that were already processed.")
 
             if not self.cancel_flag:
-                self.log_display.insert(tk.END, f"Processing complete. Total images processed: {total_images}, Total faces detected: {total_faces}, Total images without faces: {no_faces}, Time taken: {elapsed_time:.2f} seconds.\n")
-                messagebox.showinfo("Success", "Processing complete")
+                self.post_ui_event('log', f"Processing complete. Total images processed: {total_images}, Total faces detected: {total_faces}, Total images without faces: {no_faces}, Time taken: {elapsed_time:.2f} seconds.")
+                self.log_stage_timings(histogram)
+                self.post_ui_event('dialog', ('info', "Success", "Processing complete"))
             else:
-                self.log_display.insert(tk.END, "Processing cancelled.\n")
-                messagebox.showinfo("Cancelled", "Processing cancelled")
+                self.post_ui_event('log', "Processing cancelled.")
+                self.post_ui_event('dialog', ('info', "Cancelled", "Processing cancelled"))
         except Exception as e:
             logging.error(f"Error processing images: {e}")
-            self.log_display.insert(tk.END, f"Error: {e}\n")
-            messagebox.showerror("Error", "An error occurred during processing")
+            self.post_ui_event('log', f"Error: {e}")
+            self.post_ui_event('dialog', ('error', "Error", "An error occurred during processing"))
+        finally:
+            manifest.close()
+            self.image_processor.close_detection_cache()
+
+        self.post_ui_event('stats', (total_images, total_faces, None))
+
+
+    def open_manifest(self, output_folder, models, blur_effect):
+        """Opens the processing manifest of the output folder for the current settings."""
+        settings = dict(ImageProcessor.output_settings(self.image_processor.get_settings()),
+                        models=sorted(models), blur_effect=list(blur_effect))
+        return ProcessingManifest(output_folder, settings)
 
-        self.total_images_count.config(text=str(total_images))
-        self.total_faces_count.config(text=str(total_faces))
+    def log_stage_timings(self, histogram):
+        """
+        Shows how long each processing stage took in the log display. Safe to call from any thread.
 
+        Args:
+            histogram (TimingHistogram): The stage timings of the run.
+        """
+        stage_timings = histogram.to_dict()
+        if stage_timings:
+            self.post_ui_event('log', "Time spent per stage:\n" + TimingHistogram.format_table(stage_timings))
 
     def zoom_in(self):
         """Zooms in on the image preview."""
@@ -488,18 +871,22 @@ class ObscurrraGUI(tk.Tk):
         logging.info("Zoomed out on image preview")
 
  
-    def update_image_preview(self, original_image_path=None, processed_image_path=None):
-        """Updates the image preview with the original and processed images."""
-        if original_image_path:
-            original_image = Image.open(original_image_path)
-            original_image.thumbnail((200, 200), Image.LANCZOS)
-            self.original_image = ImageTk.PhotoImage(original_image)
+    def update_image_preview(self, original_image=None, processed_image=None):
+        """
+        Updates the image preview with the original and processed images.
+
+        Args:
+            original_image (ndarray): BGR thumbnail of the original image.
+            processed_image (ndarray): BGR thumbnail of the processed image.
+        """
+        if original_image is not None:
+            self.original_image = ImageTk.PhotoImage(Image.fromarray(cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)))
+            self.original_image_canvas.delete("all")
             self.original_image_canvas.create_image(0, 0, anchor=tk.NW, image=self.original_image)
 
-        if processed_image_path:
-            processed_image = Image.open(processed_image_path)
-            processed_image.thumbnail((200, 200), Image.LANCZOS)
-            self.processed_image = ImageTk.PhotoImage(processed_image)
+        if processed_image is not None:
+            self.processed_image = ImageTk.PhotoImage(Image.fromarray(cv2.cvtColor(processed_image, cv2.COLOR_BGR2RGB)))
+            self.processed_image_canvas.delete("all")
             self.processed_image_canvas.create_image(0, 0, anchor=tk.NW, image=self.processed_image)
 
     def batch_process(self):
@@ -513,6 +900,8 @@ class ObscurrraGUI(tk.Tk):
             models.append('frontalface')
         if self.profileface_var.get():
             models.append('profileface')
+        if not self.require_models(models):
+            return
 
         if not os.path.isdir(input_folder) and not self.selected_files:
             messagebox.showerror("Error", "Invalid input folder or no images selected")
@@ -526,31 +915,41 @@ class ObscurrraGUI(tk.Tk):
             self.output_folder_entry.delete(0, tk.END)
             self.output_folder_entry.insert(0, output_folder)
 
-        selected_images = [self.images_listbox.get(idx) for idx in self.images_listbox.curselection()]
+        selected_images = self.images_listbox.get_selection()
         if not selected_images:
             messagebox.showerror("Error", "No images selected")
             logging.error("No images selected for batch processing")
             return
 
         self.cancel_flag = False
+        image_files = [os.path.join(input_folder, image) for image in selected_images]
+        self.image_processor.input_root = os.path.abspath(input_folder) if os.path.isdir(input_folder) else None
 
-        threading.Thread(target=self.process_batch_images, args=(output_folder, models, selected_images)).start()
+        threading.Thread(target=self.process_batch_images, args=(output_folder, models, image_files, self.get_blur_effect(),
+                                                                 self.force_full_run_var.get())).start()
 
-    def process_batch_images(self, output_folder, models, selected_images):
-        """Processes a batch of selected images."""
+    def process_batch_images(self, output_folder, models, image_files, blur_effect, force=False):
+        """
+        Processes a batch of selected images on a worker thread, updating the widgets through post_ui_event.
+
+        Images the manifest of the output folder records as done with the same
+        settings are skipped unless force is set.
+        """
         total_images = 0
         total_faces = 0
         no_faces = 0
-        image_files = [os.path.join(self.input_folder_entry.get(), image) for image in selected_images]
+        elapsed_time = 0.0
 
-        blur_intensity = int(self.blur_intensity_value_label.cget("text"))
-        blur_effect = (blur_intensity, blur_intensity)
         start_time = time.time()
+        histogram = TimingHistogram()
+        manifest = self.open_manifest(output_folder, models, blur_effect)
+        if not force:
+            image_files = list(manifest.pending(image_files))
+            logging.info(f"Skipping {manifest.skipped} images that were already processed")
 
         try:
-            self.log_display.insert(tk.END, "Starting batch processing...\n")
-            self.progress_bar['value'] = 0
-            self.progress_bar['maximum'] = len(image_files)
+            self.post_ui_event('log', "Starting batch processing...")
+            self.post_ui_event('progress', (0, len(image_files)))
 
             for image_file in image_files:
                 if self.cancel_flag:
@@ -560,36 +959,40 @@ class ObscurrraGUI(tk.Tk):
                     result = self.image_processor.process_single_image(image_file, output_folder, models, blur_effect)
                 except Exception as e:
                     logging.error(f"Error processing image {image_file}: {e}")
-                    self.log_display.insert(tk.END, f"Error processing image {image_file}: {e}\n")
+                    self.post_ui_event('log', f"Error processing image {image_file}: {e}")
                     continue
 
+                manifest.record(image_file, result['output_path'])
                 total_images += 1
                 total_faces += result['faces']
                 if result['faces'] == 0:
                     no_faces += 1
-                self.progress_bar['value'] = total_images
-                self.log_display.insert(tk.END, f"Processed {os.path.basename(image_file)}, found {result['faces']} faces.\n")
-                self.log_display.yview(tk.END)
-                self.update_image_preview(image_file, result['output_path'])
+                histogram.add(result['timings'])
+                self.post_ui_event('progress', (total_images, len(image_files)))
+                self.post_ui_event('log', f"Processed {os.path.basename(image_file)}, found {result['faces']} faces.")
+                if 'preview' in result:
+                    self.post_ui_event('preview', result['preview'])
 
             elapsed_time = time.time() - start_time
-            self.time_taken_count.config(text=f"{elapsed_time:.2f} seconds")
 
             if not self.cancel_flag:
-                self.log_display.insert(tk.END, f"Batch processing complete. Total images processed: {total_images}, Total faces detected: {total_faces}, Total images without faces: {no_faces}, Time taken: {elapsed_time:.2f} seconds.\n")
-                messagebox.showinfo("Success", "Batch processing complete")
+                self.post_ui_event('log', f"Batch processing complete. Total images processed: {total_images}, Total faces detected: {total_faces}, Total images without faces: {no_faces}, Time taken: {elapsed_time:.2f} seconds.")
+                self.log_stage_timings(histogram)
+                self.post_ui_event('dialog', ('info', "Success", "Batch processing complete"))
             else:
-                self.log_display.insert(tk.END, "Batch processing cancelled.\n")
-                messagebox.showinfo("Cancelled", "Batch processing cancelled")
+                self.post_ui_event('log', "Batch processing cancelled.")
+                self.post_ui_event('dialog', ('info', "Cancelled", "Batch processing cancelled"))
         except Exception as e:
             logging.error(f"Error during batch processing: {e}")
-            self.log_display.insert(tk.END, f"Error: {e}\n")
-            messagebox.showerror("Error", "An error occurred during batch processing")
+            self.post_ui_event('log', f"Error: {e}")
+            self.post_ui_event('dialog', ('error', "Error", "An error occurred during batch processing"))
+        finally:
+            manifest.close()
+            self.image_processor.close_detection_cache()
 
-        self.total_images_count.config(text=str(total_images))
-        self.total_faces_count.config(text=str(total_faces))
-        self.log_display.insert(tk.END, f"Total images processed: {total_images}, Total faces detected: {total_faces}, Total images without faces: {total_images - total_faces}\n")
-        self.log_display.insert(tk.END, f"Time taken: {elapsed_time:.2f} seconds\n")
+        self.post_ui_event('stats', (total_images, total_faces, elapsed_time))
+        self.post_ui_event('log', f"Total images processed: {total_images}, Total faces detected: {total_faces}, Total images without faces: {total_images - total_faces}")
+        self.post_ui_event('log', f"Time taken: {elapsed_time:.2f} seconds")
 
 
     def show_help(self):
@@ -607,6 +1010,8 @@ Quick and Simple:
 
 Advanced Options:
 - Prefferences: Adjust the max image size and blur effect intensity as needed.
+    - Images already processed into the output folder with the same settings are skipped.
+      Tick 'Force Full Run' to process every image again.
 - Image and Model Selection: Choose the face detection models to use.
 - Image Preview: Compare original and processed images.
 - Log: Check the log for real-time updates and progress.
@@ -631,22 +1036,28 @@ Please use responsibly and respect privacy and ethical considerations.
     def exit_application(self):
         """Exits the application."""
         logging.info("Exiting application")
+        self.after_cancel(self.ui_refresh_job)
+        logging.getLogger().removeHandler(self.log_queue_handler)
+        self.log_listener.stop()
         self.destroy()
         
 
 class LogHandler(logging.Handler):
     """
-    A custom logging handler that redirects log messages to a Tkinter ScrolledText widget.
+    A custom logging handler that redirects log messages to the GUI log display.
+
+    Records can be emitted from any thread, so they are posted as GUI events instead
+    of being inserted into the widget directly.
     """
-    def __init__(self, log_display):
+    def __init__(self, post_event):
         """
         Initializes the LogHandler.
 
         Args:
-            log_display (ScrolledText): The ScrolledText widget to display log messages.
+            post_event (callable): ObscurrraGUI.post_ui_event, called with ('log', message).
         """
         super().__init__()
-        self.log_display = log_display
+        self.post_event = post_event
 
     def emit(self, record):
         """
@@ -655,9 +1066,7 @@ class LogHandler(logging.Handler):
         Args:
             record (LogRecord): The log record to emit.
         """
-        log_entry = self.format(record)
-        self.log_display.insert(tk.END, log_entry + "\n")
-        self.log_display.yview(tk.END)
+        self.post_event('log', self.format(record))
 
 class MainProgram:
     """
@@ -665,12 +1074,15 @@ class MainProgram:
     """
     OUTPUT_FOLDER_NAME = 'blurred'
 
-    def __init__(self):
+    def __init__(self, image_processor=None):
         """
         Initializes the MainProgram.
+
+        Args:
+            image_processor (ImageProcessor): The processor to use; a new one is created when None.
         """
         self.directory_manager = DirectoryManager()
-        self.image_processor = ImageProcessor()
+        self.image_processor = image_processor or ImageProcessor()
 
     def run(self, models):
         """
@@ -695,6 +1107,8 @@ class DirectoryManager:
     Class for managing directory operations.
     """
     DIR_SUFFIX = 'obscuRRRed'
+    IMAGE_SUFFIXES = ('jpg', 'jpeg', 'png', 'webp', 'bmp', 'gif', 'tiff', 'tif', 'ico')
+    VIDEO_SUFFIXES = ('mp4', 'm4v', 'mov', 'avi', 'mkv', 'wmv')
 
     @staticmethod
     def get_current_directory():
@@ -728,11 +1142,134 @@ class DirectoryManager:
             logging.error(f"Error creating output directory {output_folder}: {e}")
             raise e
 
+    @staticmethod
+    def walk_image_files(input_paths, recursive=False, include=None, exclude=None, skip_dirs=(), suffixes=IMAGE_SUFFIXES):
+        """
+        Yields the image files found in the given files and folders as the folders are read.
+
+        Folders are read with os.scandir, so the first images are available before a
+        large tree has been walked. Files are yielded in directory order, each folder
+        before its subfolders. Symbolic links to folders are not followed.
+
+        Include and exclude patterns are shell globs matched against the path relative
+        to the input folder, using '/' as separator, or against the file name alone.
+        A subfolder matching an exclude pattern is not entered.
+
+        Args:
+            input_paths (list): Paths to image files or folders containing images.
+            recursive (bool): Also walk the subfolders of the input folders.
+            include (list): Only yield images matching one of these patterns, or None for all images.
+            exclude (list): Skip images and subfolders matching one of these patterns.
+            skip_dirs (iterable): Folders not to enter, such as an output folder inside the input tree.
+            suffixes (tuple): File name suffixes to accept.
+
+        Yields:
+            str: The path of an image file.
+        """
+        skip_dirs = {os.path.realpath(path) for path in skip_dirs}
+        for input_path in input_paths:
+            if os.path.isdir(input_path):
+                yield from DirectoryManager._walk_folder(input_path, recursive, include, exclude, skip_dirs, suffixes)
+            elif os.path.isfile(input_path):
+                if input_path.lower().endswith(suffixes):
+                    yield input_path
+            else:
+                logging.error(f"Input path not found: {input_path}")
+
+    @staticmethod
+    def _walk_folder(root, recursive, include, exclude, skip_dirs, suffixes):
+        """Yields the image files below one input folder, see walk_image_files."""
+        folders = [(root, '')]
+        while folders:
+            folder, relative_folder = folders.pop()
+            subfolders = []
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        relative_path = relative_folder + entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if (recursive and not DirectoryManager._matches(relative_path, entry.name, exclude)
+                                    and not (skip_dirs and os.path.realpath(entry.path) in skip_dirs)):
+                                subfolders.append((entry.path, relative_path + '/'))
+                        elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                            if include and not DirectoryManager._matches(relative_path, entry.name, include):
+                                continue
+                            if DirectoryManager._matches(relative_path, entry.name, exclude):
+                                continue
+                            yield entry.path
+            except OSError as e:
+                logging.error(f"Error reading folder {folder}: {e}")
+            # Reversed, so the subfolders are walked depth-first in directory order
+            folders.extend(reversed(subfolders))
+
+    @staticmethod
+    def _matches(relative_path, name, patterns):
+        """Returns whether a relative path or file name matches one of the glob patterns."""
+        return bool(patterns) and any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern)
+                                      for pattern in patterns)
+
+    @staticmethod
+    def list_image_files(input_paths, suffixes=IMAGE_SUFFIXES, **walk_options):
+        """
+        Lists the image files found in the given files and folders, sorted per input path.
+
+        Args:
+            input_paths (list): Paths to image files or folders containing images.
+            suffixes (tuple): File name suffixes to accept.
+            **walk_options: recursive, include, exclude and skip_dirs, see walk_image_files.
+
+        Returns:
+            list: Paths of the image files to process.
+        """
+        image_files = []
+        for input_path in input_paths:
+            image_files.extend(sorted(DirectoryManager.walk_image_files([input_path], suffixes=suffixes, **walk_options)))
+        return image_files
+
+    @staticmethod
+    def input_root(input_paths):
+        """
+        Returns the folder that output paths mirror, the deepest folder holding all input paths.
+
+        Args:
+            input_paths (list): Paths to image files or folders containing images.
+
+        Returns:
+            str: The common folder, or None if the inputs have no folder in common.
+        """
+        folders = [os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path) or os.curdir)
+                   for path in input_paths]
+        try:
+            return os.path.commonpath(folders) if folders else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def list_video_files(input_paths, **walk_options):
+        """
+        Lists the video files found in the given files and folders.
+
+        Args:
+            input_paths (list): Paths to video files or folders containing videos.
+            **walk_options: recursive, include, exclude and skip_dirs, see walk_image_files.
+
+        Returns:
+            list: Paths of the video files to process.
+        """
+        return DirectoryManager.list_image_files(input_paths, DirectoryManager.VIDEO_SUFFIXES, **walk_options)
+
 
 class Preprocessor:
     """
     Class for preprocessing images before face detection.
     """
+    REDUCED_DECODE_EXTENSIONS = ('.jpg', '.jpeg')
+    REDUCED_DECODE_FLAGS = (
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2),
+    )
+
     @staticmethod
     def read_image(image_path):
         """
@@ -750,6 +1287,41 @@ class Preprocessor:
             raise ValueError(f"Error reading image {image_path}.")
         return img
 
+    @staticmethod
+    def read_image_reduced(image_path, max_dimension):
+        """
+        Reads a JPEG image at a reduced resolution that is still at least max_dimension.
+
+        The JPEG decoder scales the image by 1/2, 1/4 or 1/8 while decoding, which
+        is much cheaper than decoding the full image and resizing it afterwards.
+
+        Args:
+            image_path (str): The path to the image file.
+            max_dimension (int): The smallest acceptable size of the longest side.
+
+        Returns:
+            tuple: The reduced image and the longest side of the full image, or None
+                if the image cannot be decoded at a reduced resolution.
+        """
+        if not image_path.lower().endswith(Preprocessor.REDUCED_DECODE_EXTENSIONS):
+            return None
+        try:
+            # Only the header is read here
+            with Image.open(image_path) as header:
+                original_dimension = max(header.size)
+        except Exception as e:
+            logging.warning(f"Could not read the size of {image_path}: {e}")
+            return None
+
+        for factor, flag in Preprocessor.REDUCED_DECODE_FLAGS:
+            if original_dimension / factor >= max_dimension:
+                img = cv2.imread(image_path, flag)
+                if img is None:
+                    return None
+                logging.debug("Decoded %s at 1/%d resolution", image_path, factor)
+                return img, original_dimension
+        return None
+
     @staticmethod
     def resize_image(image, max_dimension):
         """
@@ -767,10 +1339,58 @@ class Preprocessor:
             scale = max_dimension / max(height, width)
             new_size = (int(width * scale), int(height * scale))
             resized_image = cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
-            logging.info(f"Resized image to {new_size}")
+            logging.debug("Resized image to %s", new_size)
             return resized_image
         return image
 
+    @staticmethod
+    def tile_grid(shape, tile_size, overlap):
+        """
+        Splits an image into overlapping square tiles.
+
+        Tiles are spread evenly, so neighbouring tiles overlap by at least
+        overlap pixels and a face no larger than the overlap always lies
+        wholly inside one tile.
+
+        Args:
+            shape (tuple): The shape of the image.
+            tile_size (int): The side length of a tile in pixels.
+            overlap (int): The minimum overlap between neighbouring tiles in pixels.
+
+        Returns:
+            list: The tiles as (x, y, w, h) tuples.
+        """
+        if not 0 <= overlap < tile_size:
+            raise ValueError("Error, Tile overlap must be at least 0 and smaller than the tile size.")
+
+        def starts(length):
+            if length <= tile_size:
+                return [0]
+            count = int(np.ceil((length - tile_size) / (tile_size - overlap))) + 1
+            return np.linspace(0, length - tile_size, count).round().astype(int).tolist()
+
+        height, width = shape[:2]
+        return [(x, y, min(tile_size, width), min(tile_size, height))
+                for y in starts(height) for x in starts(width)]
+
+    @staticmethod
+    def thumbnail(image, size):
+        """
+        Downscales an image to fit within a square of the given size.
+
+        Args:
+            image (ndarray): The image to downscale.
+            size (int): The maximum width and height of the thumbnail.
+
+        Returns:
+            ndarray: The thumbnail, or a copy of the image if it already fits.
+        """
+        height, width = image.shape[:2]
+        scale = size / max(height, width)
+        if scale >= 1:
+            return image.copy()
+        return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
     @staticmethod
     def preprocess_image(image):
         """
@@ -784,346 +1404,3790 @@ class Preprocessor:
         """
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         gray = cv2.equalizeHist(gray)
-        logging.info("Preprocessed image to grayscale and equalized histogram")
+        logging.debug("Preprocessed image to grayscale and equalized histogram")
         return gray
 
 
-class FaceDetection:
+class ModelRegistry:
     """
-    Class for detecting faces in images using various models.
+    Process-wide registry of face detection models.
+
+    Each model is loaded the first time it is requested and then shared by
+    every FaceDetection instance in the process. Failed loads are not cached,
+    so a later request tries again.
     """
-    FRONT_FACE_CASCADE_PATH = 'haarcascade_frontalface_default.xml'
-    PROFILE_FACE_CASCADE_PATH = 'haarcascade_profileface.xml'
-    MTCNN_WEIGHTS_PATH = 'mtcnn_weights.npy'
+    MODELS = ('mtcnn', 'frontalface', 'profileface')
 
-    def __init__(self):
-        """
-        Initializes the FaceDetection class and loads face detection models.
+    _models = {}
+    _locks = {}
+    _registry_lock = threading.Lock()
+
+    @staticmethod
+    def _load(name):
         """
-        logging.info("Initializing FaceDetection")
-        self._front_face_cascade = self._load_face_detection_model(FaceDetection.FRONT_FACE_CASCADE_PATH)
-        self._profile_face_cascade = self._load_face_detection_model(FaceDetection.PROFILE_FACE_CASCADE_PATH)
-        self._mtcnn_detector = None
-        self._initialize_mtcnn()
+        Loads a face detection model.
 
-    def _initialize_mtcnn(self):
-        try:
-            logging.info("Initializing MTCNN model.")
-            self._mtcnn_detector = MTCNN()
-            logging.info("MTCNN model initialized successfully.")
-        except Exception as e:
-            logging.error(f"Error initializing MTCNN: {e}")
+        Args:
+            name (str): The model name, one of MODELS.
 
-    @staticmethod
-    def _load_face_detection_model(model_path):
+        Returns:
+            object: The loaded model, or None if it could not be loaded.
         """
-        Loads a face detection model from the specified path.
+        if name == 'mtcnn':
+            return FaceDetection._initialize_mtcnn()
+        if name == 'frontalface':
+            return FaceDetection._load_face_detection_model(FaceDetection.FRONT_FACE_CASCADE_PATH)
+        if name == 'profileface':
+            return FaceDetection._load_face_detection_model(FaceDetection.PROFILE_FACE_CASCADE_PATH)
+        raise ValueError(f"Unknown face detection model: {name}")
+
+    @classmethod
+    def get(cls, name):
+        """
+        Returns a face detection model, loading it on first use.
 
         Args:
-            model_path (str): The path to the model file.
+            name (str): The model name, one of MODELS.
 
         Returns:
-            CascadeClassifier: The loaded face detection model.
+            object: The loaded model, or None if it could not be loaded.
         """
-        try:
-            if not os.path.isfile(model_path):
-                raise FileNotFoundError(f"Model file not found: {model_path}")
-            model = cv2.CascadeClassifier(model_path)
-            if model.empty():
-                raise IOError(f"Failed to load model from: {model_path}")
-            logging.info(f"Loaded face detection model from {model_path}")
-            return model
-        except Exception as e:
-            logging.error(f"Error loading face detection model: {e}")
-            return None
+        if name in cls._models:
+            return cls._models[name]
+        with cls._registry_lock:
+            model_lock = cls._locks.setdefault(name, threading.Lock())
+        with model_lock:
+            if name not in cls._models:
+                model = cls._load(name)
+                if model is None:
+                    logging.warning(f"Face detection model {name} is not available")
+                    return None
+                cls._models[name] = model
+        return cls._models[name]
+
+    @classmethod
+    def require(cls, models):
+        """
+        Loads the given models and fails if any of them cannot be loaded.
 
-    @property
-    def front_face_cascade(self):
-        """Returns the front face cascade model."""
-        return self._front_face_cascade
+        Processing without a selected model would write images whose faces only
+        that model finds without blurring them, so a missing model is an error.
 
-    @property
-    def profile_face_cascade(self):
-        """Returns the profile face cascade model."""
-        return self._profile_face_cascade
+        Args:
+            models (list): Names of the models to load.
 
-    @property
-    def mtcnn_detector(self):
-        """Returns the MTCNN detector."""
-        return self._mtcnn_detector
+        Raises:
+            IOError: If a model could not be loaded.
+        """
+        for name in models:
+            if cls.get(name) is None:
+                raise IOError(f"Failed to load face detection model {name}.")
 
-    def choose_model(self, models, image, gray_image):
+    @classmethod
+    def is_loaded(cls, name):
+        """Returns True if the model has already been loaded."""
+        return name in cls._models
+
+    @classmethod
+    def warm_up(cls, models, background=False):
         """
-        Chooses and applies the specified face detection models to detect faces in an image.
+        Loads the given models ahead of their first use.
 
         Args:
-            models (list): List of face detection models to use.
-            image (ndarray): The original image.
-            gray_image (ndarray): The preprocessed grayscale image.
+            models (list): Names of the models to load.
+            background (bool): Load the models on a daemon thread instead of blocking.
 
         Returns:
-            list: List of detected faces as (x, y, w, h) tuples.
+            Thread: The loading thread when background is True, otherwise None.
         """
-        faces = []
-        if 'mtcnn' in models:
-            if self._mtcnn_detector is not None:
-                try:
-                    faces.extend(self.detect_faces_mtcnn(image))
-                except Exception as e:
-                    logging.error(f"Error detecting faces with MTCNN: {e}")
-            else:
-                logging.error("MTCNN detector is not initialized.")
-        if 'frontalface' in models and self.front_face_cascade:
-            faces.extend(self.filter_faces(self.detect_faces(gray_image, self.front_face_cascade), faces))
-        if 'profileface' in models and self.profile_face_cascade:
-            faces.extend(self.filter_faces(self.detect_faces(gray_image, self.profile_face_cascade), faces))
-        return faces
+        def load_models():
+            for name in models:
+                cls.get(name)
 
-    @staticmethod
-    def filter_faces(new_faces, existing_faces):
+        if not background:
+            load_models()
+            return None
+        thread = threading.Thread(target=load_models, name="obscurrra-model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+class StageTimer:
+    """
+    Context manager adding the time spent in a block to a timings dictionary.
+
+    Times are measured with the monotonic performance counter and added to
+    any time already recorded for the stage. With timings set to None the
+    time is not stored. While the Tracer is enabled, the block is also
+    recorded as a trace span.
+    """
+    def __init__(self, timings, stage, category='stage', args=None):
         """
-        Filters out overlapping faces to avoid duplicate detections.
+        Initializes the StageTimer.
 
         Args:
-            new_faces (list): List of newly detected faces.
-            existing_faces (list): List of already detected faces.
-
-        Returns:
-            list: Filtered list of faces.
+            timings (dict): Seconds per stage name, or None to store nothing.
+            stage (str): The name of the stage.
+            category (str): The trace category of the span.
+            args (dict): Extra values shown with the trace span.
         """
-        filtered_faces = []
-        for face in new_faces:
-            if not any(FaceDetection.is_same_face(face, existing_face) for existing_face in existing_faces):
-                filtered_faces.append(face)
-        return filtered_faces
+        self.timings = timings
+        self.stage = stage
+        self.category = category
+        self.args = args
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_time = time.perf_counter()
+        if self.timings is not None:
+            self.timings[self.stage] = self.timings.get(self.stage, 0.0) + end_time - self.start_time
+        if Tracer.enabled:
+            Tracer.record(self.stage, self.start_time, end_time, self.category, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Process-wide collector of Chrome trace events.
+
+    When enabled, every StageTimer block and every image is recorded as a
+    complete event tagged with the process and thread id. The events are
+    written as Chrome trace-event JSON, which opens in Perfetto and
+    chrome://tracing. Timestamps come from the monotonic clock, which is
+    shared by all processes on a machine, so events from worker processes
+    line up with those of the main process.
+    """
+    enabled = False
+    _events = []
+    _named_threads = set()
+    _lock = threading.Lock()
 
-    @staticmethod
-    def is_same_face(face1, face2):
+    @classmethod
+    def enable(cls, process_name='obscurrra'):
         """
-        Checks if two faces are the same based on their coordinates and sizes.
+        Starts recording trace events in this process.
 
         Args:
-            face1 (tuple): Coordinates and size of the first face (x, y, w, h).
-            face2 (tuple): Coordinates and size of the second face (x, y, w, h).
+            process_name (str): The name shown for this process in the trace.
+        """
+        cls.enabled = True
+        with cls._lock:
+            cls._events.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+                                'args': {'name': process_name}})
 
-        Returns:
-            bool: True if the faces are the same, False otherwise.
+    @classmethod
+    def disable(cls):
         """
-        x1, y1, w1, h1 = face1
-        x2, y2, w2, h2 = face2
-        return abs(x1 - x2) < w1 / 2 and abs(y1 - y2) < h1 / 2
+        Stops recording trace events and discards any that were not written.
+        """
+        cls.enabled = False
+        with cls._lock:
+            cls._events = []
+            cls._named_threads = set()
 
-    @staticmethod
-    def detect_faces(gray, face_cascade):
+    @classmethod
+    def record(cls, name, start_time, end_time, category='stage', args=None):
         """
-        Detects faces in a grayscale image using the specified face cascade.
+        Records a span as a complete trace event.
 
         Args:
-            gray (ndarray): The preprocessed grayscale image.
-            face_cascade (CascadeClassifier): The face cascade to use for detection.
+            name (str): The span name.
+            start_time (float): The start time from time.perf_counter.
+            end_time (float): The end time from time.perf_counter.
+            category (str): The trace category.
+            args (dict): Extra values shown with the span.
+        """
+        pid, tid = os.getpid(), threading.get_ident()
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                 'ts': start_time * 1e6, 'dur': (end_time - start_time) * 1e6}
+        if args:
+            event['args'] = args
+        with cls._lock:
+            if (pid, tid) not in cls._named_threads:
+                cls._named_threads.add((pid, tid))
+                cls._events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                    'args': {'name': threading.current_thread().name}})
+            cls._events.append(event)
+
+    @classmethod
+    def extend(cls, events):
+        """
+        Adds events recorded in another process.
+
+        Args:
+            events (list): The trace events.
+        """
+        with cls._lock:
+            cls._events.extend(events)
+
+    @classmethod
+    def drain(cls):
+        """
+        Returns the recorded events and clears them.
+
+        Returns:
+            list: The trace events.
+        """
+        with cls._lock:
+            events, cls._events = cls._events, []
+        return events
+
+    @classmethod
+    def write(cls, path):
+        """
+        Writes the recorded events to a Chrome trace-event JSON file and clears them.
+
+        Args:
+            path (str): The path of the trace file.
+        """
+        events = cls.drain()
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+        logging.info(f"Wrote {len(events)} trace events to {path}")
+
+
+class TimingHistogram:
+    """
+    Class for aggregating per-image stage timings of a run into histograms.
+
+    Each stage keeps its count, total, maximum and the number of images per
+    bucket, so memory does not grow with the number of images. Percentiles
+    are estimated by interpolating inside the bucket they fall in.
+    """
+    BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, float('inf'))
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        """
+        Initializes an empty TimingHistogram.
+        """
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, timings):
+        """
+        Adds the stage timings of one image.
+
+        Args:
+            timings (dict): Seconds per stage name.
+        """
+        with self._lock:
+            for stage, seconds in timings.items():
+                entry = self._stages.setdefault(stage, {'count': 0, 'total': 0.0, 'max': 0.0,
+                                                        'buckets': [0] * len(TimingHistogram.BUCKETS)})
+                entry['count'] += 1
+                entry['total'] += seconds
+                entry['max'] = max(entry['max'], seconds)
+                entry['buckets'][int(np.searchsorted(TimingHistogram.BUCKETS, seconds))] += 1
+
+    def percentile(self, stage, percentile):
+        """
+        Estimates a percentile of a stage's timings.
+
+        Args:
+            stage (str): The name of the stage.
+            percentile (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The estimate in seconds, interpolated linearly inside the bucket
+                holding the percentile.
+        """
+        entry = self._stages[stage]
+        threshold = entry['count'] * percentile / 100
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(TimingHistogram.BUCKETS, entry['buckets']):
+            upper = min(bound, entry['max'])
+            if count and cumulative + count >= threshold:
+                return lower + (upper - lower) * (threshold - cumulative) / count
+            cumulative += count
+            lower = upper
+        return entry['max']
+
+    def to_dict(self):
+        """
+        Returns the histograms as a JSON-serialisable dictionary.
+
+        Returns:
+            dict: Per stage the count, total, mean, maximum, percentile estimates and
+                bucket counts keyed by their upper bound in seconds.
+        """
+        with self._lock:
+            return {
+                stage: {
+                    'count': entry['count'],
+                    'total': entry['total'],
+                    'mean': entry['total'] / entry['count'],
+                    'max': entry['max'],
+                    **{f'p{p}': self.percentile(stage, p) for p in TimingHistogram.PERCENTILES},
+                    'buckets': {('+Inf' if bound == float('inf') else str(bound)): count
+                                for bound, count in zip(TimingHistogram.BUCKETS, entry['buckets'])},
+                }
+                for stage, entry in self._stages.items()
+            }
+
+    @staticmethod
+    def format_table(histograms):
+        """
+        Formats stage histograms as a plain-text table, slowest stage first.
+
+        Args:
+            histograms (dict): The histograms returned by to_dict.
+
+        Returns:
+            str: The table.
+        """
+        headers = ['stage', 'count', 'total s', 'share', 'mean ms'] + [f'p{p} ms' for p in TimingHistogram.PERCENTILES]
+        grand_total = sum(entry['total'] for entry in histograms.values()) or 1.0
+        rows = [[stage, str(entry['count']), f"{entry['total']:.2f}", f"{entry['total'] / grand_total:.0%}",
+                 f"{entry['mean'] * 1000:.1f}"] + [f"{entry[f'p{p}'] * 1000:.1f}" for p in TimingHistogram.PERCENTILES]
+                for stage, entry in sorted(histograms.items(), key=lambda item: -item[1]['total'])]
+        widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+        lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [headers] + rows]
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
+
+
+class Metrics:
+    """
+    Class for exposing processing metrics in the Prometheus text format.
+
+    Counters track images, faces and errors; histograms track the duration
+    of each stage and of whole images; gauges track in-flight images, queue
+    depths and the time of the last processed image, which allows alerting
+    on stuck jobs. The metrics can be served over HTTP for scraping and
+    written to a file for the node exporter's textfile collector.
+    """
+    PREFIX = 'obscurrra_'
+    COUNTERS = {
+        'images_total': 'Images processed successfully.',
+        'faces_total': 'Faces detected.',
+        'images_without_faces_total': 'Images processed without any detected face.',
+        'errors_total': 'Images that failed to process.',
+    }
+
+    def __init__(self):
+        """
+        Initializes the Metrics with all counters at zero.
+        """
+        self._counters = dict.fromkeys(Metrics.COUNTERS, 0)
+        self._gauges = {}
+        self._gauge_functions = {}
+        self._stage_histogram = TimingHistogram()
+        self._image_histogram = TimingHistogram()
+        self._lock = threading.Lock()
+        self._server = None
+        self._textfile_stop = None
+        self._textfile_path = None
+        self.set_gauge('start_time_seconds', time.time(), 'Unix time the process started processing.')
+
+    def observe(self, result):
+        """
+        Records a successfully processed image.
+
+        Args:
+            result (dict): The result returned by process_single_image or encode_stage.
+        """
+        with self._lock:
+            self._counters['images_total'] += 1
+            self._counters['faces_total'] += result['faces']
+            if result['faces'] == 0:
+                self._counters['images_without_faces_total'] += 1
+        self._stage_histogram.add(result.get('timings', {}))
+        if 'elapsed_time' in result:
+            self._image_histogram.add({'image': result['elapsed_time']})
+        self.set_gauge('last_image_time_seconds', time.time(), 'Unix time the last image finished processing.')
+
+    def observe_error(self):
+        """
+        Records an image that failed to process.
+        """
+        with self._lock:
+            self._counters['errors_total'] += 1
+
+    def set_gauge(self, name, value, help_text='', labels=None):
+        """
+        Sets the value of a gauge.
+
+        Args:
+            name (str): The gauge name without the prefix.
+            value (float): The new value.
+            help_text (str): The help text, used the first time the gauge is set.
+            labels (dict): Label names and values identifying the series.
+        """
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            gauge = self._gauges.setdefault(name, {'help': help_text, 'values': {}})
+            gauge['values'][key] = value
+
+    def set_gauge_function(self, name, func, help_text='', label=None):
+        """
+        Registers a gauge whose value is read when the metrics are rendered.
+
+        Args:
+            name (str): The gauge name without the prefix.
+            func (callable): Returns the value, or a dict of label value to value when label is set.
+            help_text (str): The help text.
+            label (str): The label name used for the keys of the returned dict.
+        """
+        with self._lock:
+            self._gauge_functions[name] = (func, help_text, label)
+
+    def remove_gauge_function(self, name):
+        """
+        Unregisters a gauge registered with set_gauge_function.
+
+        Args:
+            name (str): The gauge name without the prefix.
+        """
+        with self._lock:
+            self._gauge_functions.pop(name, None)
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = {name: {'help': gauge['help'], 'values': dict(gauge['values'])} for name, gauge in self._gauges.items()}
+            gauge_functions = dict(self._gauge_functions)
+
+        for name, value in counters.items():
+            lines += [f"# HELP {Metrics.PREFIX}{name} {Metrics.COUNTERS[name]}",
+                      f"# TYPE {Metrics.PREFIX}{name} counter",
+                      f"{Metrics.PREFIX}{name} {value}"]
+
+        for name, (func, help_text, label) in gauge_functions.items():
+            try:
+                value = func()
+            except Exception as e:
+                logging.warning(f"Error reading gauge {name}: {e}")
+                continue
+            values = {((label, str(key)),): item for key, item in value.items()} if label else {(): value}
+            gauges[name] = {'help': help_text, 'values': values}
+        for name, gauge in gauges.items():
+            lines += [f"# HELP {Metrics.PREFIX}{name} {gauge['help']}", f"# TYPE {Metrics.PREFIX}{name} gauge"]
+            lines += [f"{Metrics.PREFIX}{name}{self._labels(dict(key))} {value}" for key, value in gauge['values'].items()]
+
+        for name, histogram, label, help_text in (
+                ('stage_duration_seconds', self._stage_histogram, 'stage', 'Time spent in each processing stage per image.'),
+                ('image_duration_seconds', self._image_histogram, None, 'Time spent processing each image.')):
+            lines += [f"# HELP {Metrics.PREFIX}{name} {help_text}", f"# TYPE {Metrics.PREFIX}{name} histogram"]
+            for stage, entry in histogram.to_dict().items():
+                labels = {label: stage} if label else {}
+                cumulative = 0
+                for bound, count in entry['buckets'].items():
+                    cumulative += count
+                    lines.append(f"{Metrics.PREFIX}{name}_bucket{self._labels(dict(labels, le=bound))} {cumulative}")
+                lines += [f"{Metrics.PREFIX}{name}_sum{self._labels(labels)} {entry['total']}",
+                          f"{Metrics.PREFIX}{name}_count{self._labels(labels)} {entry['count']}"]
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(labels):
+        """Formats labels as a Prometheus label set, or an empty string without labels."""
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for value in labels.values())
+        return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+    def serve(self, port, address='127.0.0.1'):
+        """
+        Serves the metrics over HTTP from a background thread.
+
+        Args:
+            port (int): The port to listen on.
+            address (str): The address to bind to.
+        """
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics request: {format % args}")
+
+        self._server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="obscurrra-metrics-server", daemon=True).start()
+        logging.info(f"Serving metrics on http://{address}:{self._server.server_address[1]}/metrics")
+
+    def write_textfile(self, path):
+        """
+        Writes the metrics to a file for the node exporter's textfile collector.
+
+        The file is replaced atomically, so the collector never reads a partial file.
+
+        Args:
+            path (str): The path of the .prom file.
+        """
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+    def start_textfile_writer(self, path, interval=15.0):
+        """
+        Rewrites the textfile every interval seconds from a background thread.
+
+        Args:
+            path (str): The path of the .prom file.
+            interval (float): Seconds between writes.
+        """
+        self._textfile_stop = threading.Event()
+        self._textfile_path = path
+
+        def write_periodically(stop):
+            while not stop.wait(interval):
+                try:
+                    self.write_textfile(path)
+                except OSError as e:
+                    logging.error(f"Error writing metrics to {path}: {e}")
+
+        threading.Thread(target=write_periodically, args=(self._textfile_stop,),
+                         name="obscurrra-metrics-textfile", daemon=True).start()
+
+    def flush(self):
+        """
+        Rewrites the textfile now if a textfile writer is running, so end-of-run values are not left stale.
+        """
+        if self._textfile_stop is not None:
+            try:
+                self.write_textfile(self._textfile_path)
+            except OSError as e:
+                logging.error(f"Error writing metrics to {self._textfile_path}: {e}")
+
+    def close(self):
+        """
+        Stops the HTTP server and the textfile writer.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._textfile_stop is not None:
+            self._textfile_stop.set()
+            self._textfile_stop = None
+
+
+class BoxMerger:
+    """
+    Class for merging overlapping face boxes using vectorised IoU computations.
+    """
+    METHODS = ('nms', 'wbf')
+
+    @staticmethod
+    def to_array(boxes):
+        """
+        Converts boxes to a float array of shape (N, 4).
+
+        Args:
+            boxes (list): Boxes as (x, y, w, h) tuples or an ndarray.
+
+        Returns:
+            ndarray: The boxes as an (N, 4) float array.
+        """
+        return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+    @staticmethod
+    def to_tuples(boxes):
+        """
+        Converts an (N, 4) array of boxes back to (x, y, w, h) integer tuples.
+
+        Args:
+            boxes (ndarray): The boxes to convert.
+
+        Returns:
+            list: The boxes as (x, y, w, h) tuples.
+        """
+        return [tuple(int(round(value)) for value in box) for box in boxes]
+
+    @staticmethod
+    def iou_matrix(boxes_a, boxes_b):
+        """
+        Computes the intersection over union of every pair of boxes.
+
+        Args:
+            boxes_a (ndarray): An (N, 4) array of (x, y, w, h) boxes.
+            boxes_b (ndarray): An (M, 4) array of (x, y, w, h) boxes.
+
+        Returns:
+            ndarray: An (N, M) array of IoU values.
+        """
+        a = boxes_a[:, None, :]
+        b = boxes_b[None, :, :]
+        inter_w = np.clip(np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+        inter_h = np.clip(np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+        intersection = inter_w * inter_h
+        union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - intersection
+        return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    @staticmethod
+    def merge(boxes, scores=None, iou_threshold=0.3, method='nms'):
+        """
+        Merges duplicate detections of the same face.
+
+        Boxes are visited in order of decreasing score. With 'nms' every box
+        overlapping a kept box by at least iou_threshold is dropped; with 'wbf'
+        those boxes are fused into the kept box, weighted by their scores.
+
+        Args:
+            boxes (list): Boxes as (x, y, w, h) tuples, from any number of models.
+            scores (list): Confidence of each box. Defaults to the box area.
+            iou_threshold (float): Minimum IoU for two boxes to be the same face.
+            method (str): 'nms' for non-maximum suppression or 'wbf' for weighted box fusion.
+
+        Returns:
+            list: The merged boxes as (x, y, w, h) tuples.
+        """
+        if method not in BoxMerger.METHODS:
+            raise ValueError(f"Error, Box merge method must be one of {', '.join(BoxMerger.METHODS)}.")
+        boxes = BoxMerger.to_array(boxes)
+        if len(boxes) == 0:
+            return []
+        scores = boxes[:, 2] * boxes[:, 3] if scores is None else np.asarray(scores, dtype=np.float64)
+
+        order = np.argsort(-scores, kind='stable')
+        boxes = boxes[order]
+        scores = scores[order]
+        overlaps = BoxMerger.iou_matrix(boxes, boxes) >= iou_threshold
+
+        merged = []
+        assigned = np.zeros(len(boxes), dtype=bool)
+        for index in range(len(boxes)):
+            if assigned[index]:
+                continue
+            group = overlaps[index] & ~assigned
+            group[index] = True
+            assigned |= group
+            if method == 'nms':
+                merged.append(boxes[index])
+            else:
+                weights = scores[group][:, None]
+                corners = np.hstack([boxes[group][:, :2], boxes[group][:, :2] + boxes[group][:, 2:]])
+                fused = (corners * weights).sum(axis=0) / weights.sum()
+                merged.append(np.hstack([fused[:2], fused[2:] - fused[:2]]))
+        return BoxMerger.to_tuples(merged)
+
+    @staticmethod
+    def union_overlapping(boxes, image_shape=None):
+        """
+        Replaces every group of overlapping boxes with their bounding box.
+
+        The result has no overlapping boxes, so no pixel is redacted twice.
+
+        Args:
+            boxes (list): Boxes as (x, y, w, h) tuples.
+            image_shape (tuple): Shape of the image; when given, boxes are clipped to it.
+
+        Returns:
+            list: The non-overlapping boxes as (x, y, w, h) tuples.
+        """
+        boxes = BoxMerger.to_array(boxes)
+        corners = np.hstack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]])
+        if image_shape is not None:
+            corners = np.clip(corners, 0, [image_shape[1], image_shape[0], image_shape[1], image_shape[0]])
+        corners = corners[(corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1])]
+
+        while len(corners) > 1:
+            overlaps = ((corners[:, None, 0] < corners[None, :, 2]) & (corners[None, :, 0] < corners[:, None, 2]) &
+                        (corners[:, None, 1] < corners[None, :, 3]) & (corners[None, :, 1] < corners[:, None, 3]))
+            np.fill_diagonal(overlaps, False)
+            if not overlaps.any():
+                break
+            # Label connected groups of overlapping boxes, then take each group's bounding box
+            labels = np.arange(len(corners))
+            while True:
+                neighbour_labels = np.where(overlaps, labels[None, :], len(corners)).min(axis=1)
+                new_labels = np.minimum(labels, neighbour_labels)
+                if np.array_equal(new_labels, labels):
+                    break
+                labels = new_labels
+            unique_labels, labels = np.unique(labels, return_inverse=True)
+            merged = np.empty((len(unique_labels), 4))
+            merged[:, :2] = np.inf
+            merged[:, 2:] = -np.inf
+            np.minimum.at(merged[:, :2], labels, corners[:, :2])
+            np.maximum.at(merged[:, 2:], labels, corners[:, 2:])
+            corners = merged
+
+        return BoxMerger.to_tuples(np.hstack([corners[:, :2], corners[:, 2:] - corners[:, :2]]))
+
+
+class FaceDetection:
+    """
+    Class for detecting faces in images using various models.
+    """
+    # Model files ship next to this module, also inside a PyInstaller bundle
+    MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+    FRONT_FACE_CASCADE_PATH = 'haarcascade_frontalface_default.xml'
+    PROFILE_FACE_CASCADE_PATH = 'haarcascade_profileface.xml'
+    MTCNN_WEIGHTS_PATH = 'mtcnn_weights.npy'
+    CASCADE_PARAMETERS = {'scaleFactor': 1.1, 'minNeighbors': 5, 'minSize': (30, 30)}
+    # Models listed first win when boxes of several models are merged
+    MODEL_PRIORITIES = {'mtcnn': 3, 'frontalface': 2, 'profileface': 1}
+
+    def __init__(self):
+        """
+        Initializes the FaceDetection class.
+
+        Models are not loaded here; each one is loaded through the ModelRegistry
+        the first time it is used and then shared with every other instance.
+        """
+        logging.info("Initializing FaceDetection")
+        self.merge_method = 'nms'
+        self.merge_threshold = 0.3
+
+    @staticmethod
+    def _initialize_mtcnn():
+        """
+        Creates the MTCNN detector.
+
+        Returns:
+            MTCNN: The MTCNN detector, or None if it could not be created.
+        """
+        try:
+            logging.info("Initializing MTCNN model.")
+            detector = MTCNN()
+            logging.info("MTCNN model initialized successfully.")
+            return detector
+        except Exception as e:
+            logging.error(f"Error initializing MTCNN: {e}")
+            return None
+
+    @staticmethod
+    def _load_face_detection_model(model_path):
+        """
+        Loads a face detection model from the specified path.
+
+        Args:
+            model_path (str): The path to the model file, relative paths being resolved against MODEL_DIR.
+
+        Returns:
+            CascadeClassifier: The loaded face detection model, or None if it could not be loaded.
+        """
+        model_path = os.path.join(FaceDetection.MODEL_DIR, model_path)
+        try:
+            if not os.path.isfile(model_path):
+                raise FileNotFoundError(f"Model file not found: {model_path}")
+            model = cv2.CascadeClassifier(model_path)
+            if model.empty():
+                raise IOError(f"Failed to load model from: {model_path}")
+            logging.info(f"Loaded face detection model from {model_path}")
+            return model
+        except Exception as e:
+            logging.error(f"Error loading face detection model: {e}")
+            return None
+
+    @property
+    def front_face_cascade(self):
+        """Returns the front face cascade model."""
+        return ModelRegistry.get('frontalface')
+
+    @property
+    def profile_face_cascade(self):
+        """Returns the profile face cascade model."""
+        return ModelRegistry.get('profileface')
+
+    @property
+    def mtcnn_detector(self):
+        """Returns the MTCNN detector."""
+        return ModelRegistry.get('mtcnn')
+
+    def choose_model(self, models, image, gray_image, mtcnn_faces=None, timings=None):
+        """
+        Chooses and applies the specified face detection models to detect faces in an image.
+
+        The detections of all models are merged in one pass with BoxMerger, using
+        merge_method and merge_threshold.
+
+        Args:
+            models (list): List of face detection models to use.
+            image (ndarray): The original image.
+            gray_image (ndarray): The preprocessed grayscale image.
+            mtcnn_faces (list): Faces already detected by MTCNN, e.g. by detect_faces_mtcnn_batch.
+            timings (dict): When given, the seconds spent in each detector and in merging
+                are added under 'detect_<model>' and 'merge'.
+
+        Returns:
+            list: List of detected faces as (x, y, w, h) tuples.
+
+        Raises:
+            IOError: If one of the models could not be loaded.
+        """
+        ModelRegistry.require(models)
+        faces = []
+        priorities = []
+        if 'mtcnn' in models:
+            if mtcnn_faces is None:
+                try:
+                    with StageTimer(timings, 'detect_mtcnn'):
+                        mtcnn_faces = self.detect_faces_mtcnn(image)
+                except Exception as e:
+                    logging.error(f"Error detecting faces with MTCNN: {e}")
+                    mtcnn_faces = []
+            faces.extend(mtcnn_faces)
+            priorities.extend([FaceDetection.MODEL_PRIORITIES['mtcnn']] * len(mtcnn_faces))
+        for model, cascade in (('frontalface', 'front_face_cascade'), ('profileface', 'profile_face_cascade')):
+            if model in models:
+                with StageTimer(timings, f'detect_{model}'):
+                    cascade_faces = self.detect_faces(gray_image, getattr(self, cascade))
+                faces.extend(cascade_faces)
+                priorities.extend([FaceDetection.MODEL_PRIORITIES[model]] * len(cascade_faces))
+        if not faces:
+            return []
+        with StageTimer(timings, 'merge'):
+            # Break ties between boxes of the same model by their area
+            areas = BoxMerger.to_array(faces)[:, 2:].prod(axis=1)
+            scores = np.asarray(priorities, dtype=np.float64) + areas / (areas.max() + 1)
+            return BoxMerger.merge(faces, scores, self.merge_threshold, self.merge_method)
+
+    @staticmethod
+    def detect_faces(gray, face_cascade):
+        """
+        Detects faces in a grayscale image using the specified face cascade.
+
+        Args:
+            gray (ndarray): The preprocessed grayscale image.
+            face_cascade (CascadeClassifier): The face cascade to use for detection.
+
+        Returns:
+            list: List of detected faces as (x, y, w, h) tuples.
+        """
+        try:
+            faces = face_cascade.detectMultiScale(gray, **FaceDetection.CASCADE_PARAMETERS)
+            logging.debug("Detected %d faces using %s model", len(faces), face_cascade)
+            return faces
+        except Exception as e:
+            logging.error(f"Error detecting faces: {e}")
+            return []
+
+    def detect_faces_mtcnn(self, image):
+        """
+        Detects faces in an image using the MTCNN detector.
+
+        Args:
+            image (ndarray): The original image.
+
+        Returns:
+            list: List of detected faces as (x, y, w, h) tuples.
+        """
+        try:
+            if self.mtcnn_detector is None:
+                logging.error("MTCNN detector is not initialized.")
+                return []
+
+            results = self.mtcnn_detector.detect_faces(image)
+            faces = [(result['box'][0], result['box'][1], result['box'][2], result['box'][3]) for result in results]
+            logging.debug("Detected %d faces using MTCNN", len(faces))
+            return faces
+        except Exception as e:
+            logging.error(f"Error detecting faces with MTCNN: {e}")
+            return []
+
+    @property
+    def supports_mtcnn_batches(self):
+        """Returns True if the MTCNN detector accepts a stacked batch of images."""
+        if self.mtcnn_detector is None:
+            return False
+        try:
+            parameters = inspect.signature(self.mtcnn_detector.detect_faces).parameters
+        except (TypeError, ValueError):
+            return False
+        return 'batch_stack_justification' in parameters
+
+    def detect_faces_mtcnn_batch(self, images, batch_size=16):
+        """
+        Detects faces in several images using batched MTCNN inference.
+
+        Images are grouped by shape and each group is stacked into one tensor,
+        so the P-Net, R-Net and O-Net stages run once per batch instead of once
+        per image. MTCNN releases without batch support fall back to one call
+        per image.
+
+        Args:
+            images (list): The images to search, as ndarrays.
+            batch_size (int): Maximum number of images stacked into one batch.
+
+        Returns:
+            list: One list of detected faces as (x, y, w, h) tuples per image.
+
+        Raises:
+            IOError: If the MTCNN detector could not be loaded.
+        """
+        ModelRegistry.require(['mtcnn'])
+        if not self.supports_mtcnn_batches:
+            return [self.detect_faces_mtcnn(image) for image in images]
+
+        faces = [[] for _ in images]
+        groups = {}
+        for index, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(index)
+
+        for indexes in groups.values():
+            for start in range(0, len(indexes), batch_size):
+                chunk = indexes[start:start + batch_size]
+                try:
+                    if len(chunk) == 1:
+                        faces[chunk[0]] = self.detect_faces_mtcnn(images[chunk[0]])
+                        continue
+                    results = self.mtcnn_detector.detect_faces(np.stack([images[index] for index in chunk]))
+                    for index, image_results in zip(chunk, results):
+                        faces[index] = [(result['box'][0], result['box'][1], result['box'][2], result['box'][3]) for result in image_results]
+                    logging.debug("Detected faces in a batch of %d images using MTCNN", len(chunk))
+                except Exception as e:
+                    logging.error(f"Error detecting faces with batched MTCNN: {e}")
+                    for index in chunk:
+                        faces[index] = self.detect_faces_mtcnn(images[index])
+        return faces
+
+
+class FaceBlurrer:
+    """
+    Class for blurring detected faces in images.
+
+    The redaction engine is selectable: 'box', 'gaussian' and 'stack' blur the
+    face, 'pixelate' replaces it with coarse blocks and 'fill' paints it with a
+    solid colour. With blur_scale set, the kernel grows with the face, so large
+    faces are hidden as well as small ones. With downscale enabled, the blur
+    engines work on a shrunken copy of the face and scale the result back up,
+    so the cost per face stays roughly constant whatever its size.
+
+    With a mask shape set, all faces are redacted in one pass: the engine runs
+    once over the bounding region of the faces and the result is copied back
+    through a combined rectangular or elliptical mask.
+    """
+    ENGINES = ('box', 'gaussian', 'stack', 'pixelate', 'fill')
+    MASK_SHAPES = ('rect', 'ellipse')
+    DOWNSCALE_KERNEL = 8
+    MASK_MIN_COVERAGE = 0.25
+
+    def __init__(self, engine='box', blur_scale=None, downscale=False, fill_color=(0, 0, 0), mask_shape=None):
+        """
+        Initializes the FaceBlurrer.
+
+        Args:
+            engine (str): The redaction engine, one of ENGINES.
+            blur_scale (float): Kernel size as a fraction of the shorter face side,
+                or None for a fixed kernel of blur_effect pixels.
+            downscale (bool): Blur a downscaled copy of each face and scale it back up.
+            fill_color (tuple): The BGR colour used by the 'fill' engine.
+            mask_shape (str): 'rect' or 'ellipse' to redact all faces in one masked pass,
+                or None to redact each face rectangle separately.
+        """
+        self.engine = engine
+        self.blur_scale = blur_scale
+        self.downscale = downscale
+        self.fill_color = fill_color
+        self.mask_shape = mask_shape
+
+    @property
+    def mask_shape(self):
+        """Returns the shape of the combined redaction mask, or None for per-face redaction."""
+        return self._mask_shape
+
+    @mask_shape.setter
+    def mask_shape(self, value):
+        """
+        Sets the shape of the combined redaction mask.
+
+        Args:
+            value (str): One of MASK_SHAPES, or None for per-face redaction.
+        """
+        if value is not None and value not in FaceBlurrer.MASK_SHAPES:
+            raise ValueError(f"Error, Blur mask must be one of {', '.join(FaceBlurrer.MASK_SHAPES)}.")
+        self._mask_shape = value
+
+    @property
+    def engine(self):
+        """Returns the redaction engine."""
+        return self._engine
+
+    @engine.setter
+    def engine(self, value):
+        """
+        Sets the redaction engine.
+
+        Args:
+            value (str): One of ENGINES.
+        """
+        if value not in FaceBlurrer.ENGINES:
+            raise ValueError(f"Error, Blur engine must be one of {', '.join(FaceBlurrer.ENGINES)}.")
+        if value == 'stack' and not hasattr(cv2, 'stackBlur'):
+            raise ValueError("Error, The stack blur engine requires OpenCV 4.7 or newer.")
+        self._engine = value
+
+    @property
+    def blur_scale(self):
+        """Returns the kernel size as a fraction of the face size, or None for a fixed kernel."""
+        return self._blur_scale
+
+    @blur_scale.setter
+    def blur_scale(self, value):
+        """
+        Sets the kernel size as a fraction of the face size.
+
+        Args:
+            value (float): The fraction, greater than 0, or None for a fixed kernel.
+        """
+        if value is not None and value <= 0:
+            raise ValueError("Error, Blur scale must be greater than 0.")
+        self._blur_scale = value
+
+    def kernel_size(self, w, h, blur_effect):
+        """
+        Returns the kernel size used for a face.
+
+        Args:
+            w (int): The face width.
+            h (int): The face height.
+            blur_effect (tuple): The minimum kernel size as (width, height).
+
+        Returns:
+            tuple: The kernel size as (width, height).
+        """
+        kernel_w, kernel_h = int(blur_effect[0]), int(blur_effect[1])
+        if self.blur_scale is not None:
+            scaled = int(round(min(w, h) * self.blur_scale))
+            kernel_w, kernel_h = max(kernel_w, scaled), max(kernel_h, scaled)
+        return max(kernel_w, 1), max(kernel_h, 1)
+
+    def blur_faces(self, img, faces, blur_effect):
+        """
+        Applies a blur effect to the detected faces in an image.
+
+        Args:
+            img (ndarray): The image containing faces.
+            faces (list): List of detected faces as (x, y, w, h) tuples.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+
+        Returns:
+            ndarray: The image with blurred faces.
+        """
+        try:
+            redact = getattr(self, f'_redact_{self.engine}')
+            if self.mask_shape is not None:
+                self._redact_masked(img, faces, blur_effect, redact)
+            else:
+                for (x, y, w, h) in faces:
+                    roi = img[y:y+h, x:x+w]
+                    if roi.size:
+                        roi[...] = redact(roi, self.kernel_size(roi.shape[1], roi.shape[0], blur_effect))
+            logging.debug("Applied %s blur effect to faces: %s", self.engine, faces)
+            return img
+        except Exception as e:
+            logging.error(f"Error blurring faces: {e}")
+            raise e
+
+    def _redact_masked(self, img, faces, blur_effect, redact):
+        """
+        Redacts all faces through one combined mask.
+
+        The engine runs once over the bounding region of all faces. When the
+        faces cover only a small part of that region, e.g. a few faces far
+        apart, each group of overlapping faces gets its own region instead.
+
+        Args:
+            img (ndarray): The image containing faces.
+            faces (list): List of detected faces as (x, y, w, h) tuples.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+            redact (callable): The redaction engine.
+        """
+        height, width = img.shape[:2]
+        boxes = BoxMerger.to_array(faces)
+        corners = np.hstack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]])
+        corners = np.clip(corners, 0, [width, height, width, height]).astype(int)
+        corners = corners[(corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1])]
+        if not len(corners):
+            return
+
+        bounds = np.concatenate([corners[:, :2].min(axis=0), corners[:, 2:].max(axis=0)])
+        covered = (corners[:, 2:] - corners[:, :2]).prod(axis=1).sum()
+        if covered >= FaceBlurrer.MASK_MIN_COVERAGE * (bounds[2:] - bounds[:2]).prod():
+            regions = [bounds]
+        else:
+            groups = BoxMerger.to_array(BoxMerger.union_overlapping(faces, img.shape)).astype(int)
+            regions = np.hstack([groups[:, :2], groups[:, :2] + groups[:, 2:]])
+
+        centers = (corners[:, :2] + corners[:, 2:]) / 2
+        for x0, y0, x1, y1 in regions:
+            members = corners[(centers[:, 0] >= x0) & (centers[:, 0] <= x1) &
+                              (centers[:, 1] >= y0) & (centers[:, 1] <= y1)]
+            roi = img[y0:y1, x0:x1]
+            mask = np.zeros(roi.shape[:2], dtype=np.uint8)
+            for bx0, by0, bx1, by1 in (members - [x0, y0, x0, y0]).tolist():
+                if self.mask_shape == 'ellipse':
+                    cv2.ellipse(mask, (((bx0 + bx1) / 2, (by0 + by1) / 2), (bx1 - bx0, by1 - by0), 0), 255, -1)
+                else:
+                    mask[by0:by1, bx0:bx1] = 255
+            # The kernel of the largest face, so no face is redacted more weakly than on its own
+            sizes = members[:, 2:] - members[:, :2]
+            kernel = self.kernel_size(sizes[:, 0].max(), sizes[:, 1].max(), blur_effect)
+            redacted = np.broadcast_to(np.asarray(redact(roi, kernel), dtype=roi.dtype), roi.shape)
+            np.copyto(roi, redacted, where=(mask > 0).reshape(mask.shape + (1,) * (roi.ndim - 2)))
+
+    def _blur(self, roi, kernel, blur):
+        """
+        Applies a blur function to a face, on a downscaled copy if downscale is enabled.
+
+        Args:
+            roi (ndarray): The face region.
+            kernel (tuple): The kernel size as (width, height).
+            blur (callable): Called with an image and a kernel size; returns the blurred image.
+
+        Returns:
+            ndarray: The blurred face region.
+        """
+        factor = min(kernel) / FaceBlurrer.DOWNSCALE_KERNEL
+        if not self.downscale or factor <= 1:
+            return blur(roi, kernel)
+        height, width = roi.shape[:2]
+        small_size = (max(int(width / factor), 1), max(int(height / factor), 1))
+        small = cv2.resize(roi, small_size, interpolation=cv2.INTER_AREA)
+        small_kernel = (max(int(round(kernel[0] / factor)), 1), max(int(round(kernel[1] / factor)), 1))
+        return cv2.resize(blur(small, small_kernel), (width, height), interpolation=cv2.INTER_LINEAR)
+
+    @staticmethod
+    def _odd(kernel):
+        """Returns the kernel size rounded up to odd values, as Gaussian and stack blur require."""
+        return kernel[0] | 1, kernel[1] | 1
+
+    def _redact_box(self, roi, kernel):
+        """Blurs a face with a box filter."""
+        return self._blur(roi, kernel, cv2.blur)
+
+    def _redact_gaussian(self, roi, kernel):
+        """Blurs a face with a Gaussian filter."""
+        return self._blur(roi, kernel, lambda image, size: cv2.GaussianBlur(image, self._odd(size), 0))
+
+    def _redact_stack(self, roi, kernel):
+        """Blurs a face with OpenCV's stack blur, a fast approximation of a Gaussian blur."""
+        return self._blur(roi, kernel, lambda image, size: cv2.stackBlur(image, self._odd(size)))
+
+    @staticmethod
+    def _redact_pixelate(roi, kernel):
+        """Replaces a face with blocks of kernel size."""
+        height, width = roi.shape[:2]
+        blocks = (max(width // kernel[0], 1), max(height // kernel[1], 1))
+        small = cv2.resize(roi, blocks, interpolation=cv2.INTER_AREA)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+    def _redact_fill(self, roi, kernel):
+        """Paints a face with the fill colour."""
+        return self.fill_color[:roi.shape[2]] if roi.ndim == 3 else self.fill_color[0]
+
+
+class DetectionCache:
+    """
+    Class for caching detected faces on disk.
+
+    Faces are stored in an SQLite database keyed by the image content hash and
+    the detector configuration, so images can be re-blurred with new settings
+    without running face detection again. The least recently used entries are
+    evicted once the cache holds more than max_entries images.
+    """
+    FILE_NAME = 'detections.sqlite'
+    _EVICTION_INTERVAL = 100
+
+    def __init__(self, path, max_entries=100000):
+        """
+        Initializes the DetectionCache and creates the database if needed.
+
+        Args:
+            path (str): The path to the SQLite database file.
+            max_entries (int): The maximum number of cached images.
+        """
+        if max_entries < 1:
+            raise ValueError("Error, Detection cache size must be greater than 0.")
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS detections "
+                "(key TEXT PRIMARY KEY, faces TEXT NOT NULL, last_used REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used)")
+
+    @staticmethod
+    def default_path():
+        """
+        Returns the per-user path of the detection cache database.
+
+        Entries are keyed by image content, so one cache serves every output folder
+        and nothing is written next to the processed images.
+
+        Returns:
+            str: The path under LOCALAPPDATA on Windows, or XDG_CACHE_HOME (~/.cache by default) elsewhere.
+        """
+        cache_home = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or
+                      os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(cache_home, 'Obscurrra', DetectionCache.FILE_NAME)
+
+    @staticmethod
+    def make_key(content_hash, models, parameters):
+        """
+        Builds the cache key for an image and detector configuration.
+
+        Args:
+            content_hash (str): The hash of the image file content.
+            models (list): List of face detection models used.
+            parameters (dict): Detector parameters and the detection resolution.
+
+        Returns:
+            str: The cache key.
+        """
+        encoded = json.dumps([content_hash, sorted(models), parameters], sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached faces for a key and marks the entry as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            list: The cached faces as (x, y, w, h) tuples, or None on a cache miss.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT faces FROM detections WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE detections SET last_used = ? WHERE key = ?", (time.time(), key))
+        return [tuple(face) for face in json.loads(row[0])]
+
+    def put(self, key, faces):
+        """
+        Stores the faces detected for a key.
+
+        Args:
+            key (str): The cache key.
+            faces (list): The detected faces as (x, y, w, h) tuples.
+        """
+        encoded = json.dumps([[int(value) for value in face] for face in faces])
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO detections (key, faces, last_used) VALUES (?, ?, ?)",
+                                     (key, encoded, time.time()))
+            self._writes += 1
+            if self._writes % DetectionCache._EVICTION_INTERVAL == 0:
+                self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used entries above max_entries."""
+        # One statement, so worker processes evicting at the same time cannot delete more than the surplus
+        evicted = self._connection.execute(
+            "DELETE FROM detections WHERE key IN "
+            "(SELECT key FROM detections ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        if evicted > 0:
+            logging.info(f"Evicted {evicted} entries from the detection cache")
+
+    def close(self):
+        """Evicts surplus entries and closes the database."""
+        with self._lock, self._connection:
+            self._evict()
+        self._connection.close()
+
+
+class OutputEncoder:
+    """
+    Class for writing processed images with configurable encoder options.
+
+    Options left unset use OpenCV's defaults. WebP images with a compression
+    method are written with Pillow, because OpenCV does not expose the WebP
+    method.
+    """
+    FORMATS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp'}
+    FORMAT_EXTENSIONS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+    PNG_STRATEGIES = {
+        'default': cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+        'filtered': cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+        'huffman': cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+        'rle': cv2.IMWRITE_PNG_STRATEGY_RLE,
+        'fixed': cv2.IMWRITE_PNG_STRATEGY_FIXED,
+    }
+    OPTIONS = ('jpeg_quality', 'jpeg_progressive', 'jpeg_optimize', 'png_compression', 'png_strategy',
+               'webp_quality', 'webp_method')
+    PRESETS = {
+        'fast': {'jpeg_quality': 90, 'jpeg_progressive': False, 'jpeg_optimize': False,
+                 'png_compression': 1, 'png_strategy': 'rle', 'webp_quality': 80, 'webp_method': 0},
+        'balanced': {'jpeg_quality': 95, 'jpeg_progressive': False, 'jpeg_optimize': True,
+                     'png_compression': 3, 'png_strategy': 'filtered', 'webp_quality': 90, 'webp_method': 4},
+        'archive': {'jpeg_quality': 98, 'jpeg_progressive': True, 'jpeg_optimize': True,
+                    'png_compression': 9, 'png_strategy': 'default', 'webp_quality': 100, 'webp_method': 6},
+    }
+
+    def __init__(self, output_format=None, options=None):
+        """
+        Initializes the OutputEncoder.
+
+        Args:
+            output_format (str): 'jpeg', 'png' or 'webp' to convert every image, or None to keep the input format.
+            options (dict): Encoder options, see OPTIONS.
+        """
+        self.output_format = output_format
+        self.options = options or {}
+
+    @property
+    def output_format(self):
+        """Returns the output format, or None if images keep their input format."""
+        return self._output_format
+
+    @output_format.setter
+    def output_format(self, value):
+        """
+        Sets the output format.
+
+        Args:
+            value (str): One of FORMATS, or None to keep the input format.
+        """
+        if value is not None and value not in OutputEncoder.FORMATS:
+            raise ValueError(f"Error, Output format must be one of {', '.join(OutputEncoder.FORMATS)}.")
+        self._output_format = value
+
+    @property
+    def options(self):
+        """Returns a copy of the encoder options."""
+        return dict(self._options)
+
+    @options.setter
+    def options(self, value):
+        """
+        Validates and sets the encoder options.
+
+        Args:
+            value (dict): Encoder options, see OPTIONS; options set to None are left at their defaults.
+        """
+        options = {name: option for name, option in value.items() if option is not None}
+        unknown = set(options) - set(OutputEncoder.OPTIONS)
+        if unknown:
+            raise ValueError(f"Error, Unknown encoder option: {', '.join(sorted(unknown))}")
+        for name, low, high in (('jpeg_quality', 0, 100), ('png_compression', 0, 9),
+                                ('webp_quality', 1, 100), ('webp_method', 0, 6)):
+            if name in options and not low <= options[name] <= high:
+                raise ValueError(f"Error, Encoder option {name} must be between {low} and {high}.")
+        if 'png_strategy' in options and options['png_strategy'] not in OutputEncoder.PNG_STRATEGIES:
+            raise ValueError(f"Error, PNG strategy must be one of {', '.join(OutputEncoder.PNG_STRATEGIES)}.")
+        self._options = options
+
+    @staticmethod
+    def preset(name, **overrides):
+        """
+        Returns the encoder options of a named preset.
+
+        Args:
+            name (str): One of PRESETS.
+            **overrides: Options that replace those of the preset; None values are ignored.
+
+        Returns:
+            dict: The encoder options.
+        """
+        if name not in OutputEncoder.PRESETS:
+            raise ValueError(f"Error, Encoder preset must be one of {', '.join(OutputEncoder.PRESETS)}.")
+        options = dict(OutputEncoder.PRESETS[name])
+        options.update({option: value for option, value in overrides.items() if value is not None})
+        return options
+
+    def output_path(self, path):
+        """
+        Returns the output path with the extension of the output format.
+
+        Args:
+            path (str): The output path with the input extension.
+
+        Returns:
+            str: The output path to write to.
+        """
+        if self.output_format is None:
+            return path
+        name, ext = os.path.splitext(path)
+        if OutputEncoder.FORMAT_EXTENSIONS.get(ext.lower()) == self.output_format:
+            return path
+        return name + OutputEncoder.FORMATS[self.output_format]
+
+    def encode(self, image, output_path):
+        """
+        Writes an image to disk with the encoder options of its format.
+
+        The image is written to a temporary file next to the output and moved over
+        it, so an existing output that is a hard link to the input (see
+        ImageProcessor.copy_original) is replaced rather than written through.
+
+        Args:
+            image (ndarray): The image to write.
+            output_path (str): The path to write to; its extension selects the format.
+
+        Returns:
+            bool: True if the image was written.
+        """
+        folder, name = os.path.split(output_path)
+        base_name, ext = os.path.splitext(name)
+        temp_path = os.path.join(folder, f".{base_name}.{os.getpid()}.{threading.get_ident()}.tmp{ext}")
+        try:
+            success = self._write(image, temp_path)
+            if success:
+                os.replace(temp_path, output_path)
+            return success
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _write(self, image, output_path):
+        """Writes an image to the given path with the encoder options of its format."""
+        image_format = OutputEncoder.FORMAT_EXTENSIONS.get(os.path.splitext(output_path)[1].lower())
+        options = self._options
+        if image_format == 'webp' and 'webp_method' in options:
+            return self._encode_webp_pillow(image, output_path)
+
+        params = []
+        if image_format == 'jpeg':
+            for name, flag in (('jpeg_quality', cv2.IMWRITE_JPEG_QUALITY),
+                               ('jpeg_progressive', cv2.IMWRITE_JPEG_PROGRESSIVE),
+                               ('jpeg_optimize', cv2.IMWRITE_JPEG_OPTIMIZE)):
+                if name in options:
+                    params += [flag, int(options[name])]
+        elif image_format == 'png':
+            if 'png_compression' in options:
+                params += [cv2.IMWRITE_PNG_COMPRESSION, options['png_compression']]
+            if 'png_strategy' in options:
+                params += [cv2.IMWRITE_PNG_STRATEGY, OutputEncoder.PNG_STRATEGIES[options['png_strategy']]]
+        elif image_format == 'webp' and 'webp_quality' in options:
+            params += [cv2.IMWRITE_WEBP_QUALITY, options['webp_quality']]
+        return cv2.imwrite(output_path, image, params)
+
+    def _encode_webp_pillow(self, image, output_path):
+        """
+        Writes a WebP image with Pillow, which supports the WebP compression method.
+
+        Args:
+            image (ndarray): The BGR or BGRA image to write.
+            output_path (str): The path to write to.
+
+        Returns:
+            bool: True if the image was written.
+        """
+        if image.ndim == 2:
+            pil_image = Image.fromarray(image)
+        elif image.shape[2] == 4:
+            pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA))
+        else:
+            pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        quality = self._options.get('webp_quality', 80)
+        try:
+            pil_image.save(output_path, 'WEBP', quality=quality, lossless=quality >= 100,
+                           method=self._options['webp_method'])
+        except (OSError, ValueError) as e:
+            logging.error(f"Error writing WebP image {output_path}: {e}")
+            return False
+        return True
+
+
+class ImageProcessor:
+    """
+    Class for processing images including resizing, face detection, and face blurring.
+    """
+    SETTINGS = ('max_image_size', 'reduced_decode', 'zero_face_output', 'detection_cache_path', 'detection_cache_size',
+                'merge_method', 'merge_threshold', 'tile_size', 'tile_overlap', 'tile_workers',
+                'blur_engine', 'blur_scale', 'blur_downscale', 'blur_mask', 'output_format', 'encoder_options',
+                'input_root')
+    # The settings that change the written images, used to fingerprint the processing manifest
+    OUTPUT_SETTINGS = ('max_image_size', 'reduced_decode', 'zero_face_output', 'merge_method', 'merge_threshold',
+                       'tile_size', 'tile_overlap', 'blur_engine', 'blur_scale', 'blur_downscale', 'blur_mask',
+                       'output_format', 'encoder_options')
+    ZERO_FACE_OUTPUTS = ('encode', 'copy', 'link')
+    _FICLONE = 0x40049409
+    _MAX_IMAGE_SIZE = 1000
+
+    def __init__(self):
+        """
+        Initializes the ImageProcessor.
+        """
+        self.preprocessor = Preprocessor()
+        self.face_detection = FaceDetection()
+        self.face_blurrer = FaceBlurrer()
+        self.output_encoder = OutputEncoder()
+        self.metrics = None
+        # Size of the preview thumbnails returned with each result, None to skip them
+        self.preview_size = None
+        # Output paths mirror the folders below input_root; None writes every output to the output folder itself
+        self.input_root = None
+        self._output_dirs = set()
+        self.reduced_decode = True
+        self._zero_face_output = 'encode'
+        self.detection_cache_path = None
+        self.detection_cache_size = 100000
+        self._detection_cache = None
+        self._detection_cache_lock = threading.Lock()
+        self._tile_size = None
+        self.tile_overlap = 200
+        self.tile_workers = 2
+
+    def apply_settings(self, settings):
+        """
+        Applies processing settings such as max_image_size to this processor.
+
+        Args:
+            settings (dict): Attribute names and the values to set.
+        """
+        for name, value in settings.items():
+            if name not in self.SETTINGS:
+                raise ValueError(f"Error, Unknown processing setting: {name}")
+            setattr(self, name, value)
+
+    def get_settings(self):
+        """
+        Returns the processing settings of this processor.
+
+        Returns:
+            dict: The processing settings, as accepted by apply_settings.
+        """
+        return {name: getattr(self, name) for name in self.SETTINGS}
+
+    @staticmethod
+    def output_settings(settings):
+        """
+        Returns the settings that change the written images.
+
+        Cache, worker and input-root settings are left out, so changing them does not
+        make the processing manifest treat finished images as changed.
+
+        Args:
+            settings (dict): Processing settings as returned by get_settings.
+
+        Returns:
+            dict: The settings named in OUTPUT_SETTINGS.
+        """
+        return {name: settings[name] for name in ImageProcessor.OUTPUT_SETTINGS if name in settings}
+
+    @property
+    def max_image_size(self):
+        """Returns the maximum image size."""
+        return self._MAX_IMAGE_SIZE
+
+    @max_image_size.setter
+    def max_image_size(self, value):
+        """
+        Sets the maximum image size.
+
+        Args:
+            value (int): The new maximum image size.
+        """
+        if value > 0:
+            self._MAX_IMAGE_SIZE = value
+        else:
+            raise ValueError("Error, Maximum image size must be greater than 0.")
+
+    @property
+    def merge_method(self):
+        """Returns how overlapping detections are merged: 'nms' or 'wbf'."""
+        return self.face_detection.merge_method
+
+    @merge_method.setter
+    def merge_method(self, value):
+        """
+        Sets how overlapping detections are merged.
+
+        Args:
+            value (str): 'nms' for non-maximum suppression or 'wbf' for weighted box fusion.
+        """
+        if value not in BoxMerger.METHODS:
+            raise ValueError(f"Error, Box merge method must be one of {', '.join(BoxMerger.METHODS)}.")
+        self.face_detection.merge_method = value
+
+    @property
+    def merge_threshold(self):
+        """Returns the IoU above which two detections are merged."""
+        return self.face_detection.merge_threshold
+
+    @merge_threshold.setter
+    def merge_threshold(self, value):
+        """
+        Sets the IoU above which two detections are merged.
+
+        Args:
+            value (float): The IoU threshold, between 0 and 1.
+        """
+        if 0 < value <= 1:
+            self.face_detection.merge_threshold = value
+        else:
+            raise ValueError("Error, Merge threshold must be greater than 0 and at most 1.")
+
+    @property
+    def blur_engine(self):
+        """Returns the redaction engine of the face blurrer."""
+        return self.face_blurrer.engine
+
+    @blur_engine.setter
+    def blur_engine(self, value):
+        """
+        Sets the redaction engine of the face blurrer.
+
+        Args:
+            value (str): One of FaceBlurrer.ENGINES.
+        """
+        self.face_blurrer.engine = value
+
+    @property
+    def blur_scale(self):
+        """Returns the blur kernel size as a fraction of the face size, or None for a fixed kernel."""
+        return self.face_blurrer.blur_scale
+
+    @blur_scale.setter
+    def blur_scale(self, value):
+        """
+        Sets the blur kernel size as a fraction of the face size.
+
+        Args:
+            value (float): The fraction, or None for a fixed kernel.
+        """
+        self.face_blurrer.blur_scale = value
+
+    @property
+    def blur_downscale(self):
+        """Returns whether faces are blurred on a downscaled copy."""
+        return self.face_blurrer.downscale
+
+    @blur_downscale.setter
+    def blur_downscale(self, value):
+        """
+        Sets whether faces are blurred on a downscaled copy.
+
+        Args:
+            value (bool): True to blur a downscaled copy and scale it back up.
+        """
+        self.face_blurrer.downscale = value
+
+    @property
+    def blur_mask(self):
+        """Returns the shape of the combined redaction mask, or None for per-face redaction."""
+        return self.face_blurrer.mask_shape
+
+    @blur_mask.setter
+    def blur_mask(self, value):
+        """
+        Sets the shape of the combined redaction mask.
+
+        Args:
+            value (str): 'rect' or 'ellipse', or None for per-face redaction.
+        """
+        self.face_blurrer.mask_shape = value
+
+    @property
+    def output_format(self):
+        """Returns the output format, or None if images keep their input format."""
+        return self.output_encoder.output_format
+
+    @output_format.setter
+    def output_format(self, value):
+        """
+        Sets the output format.
+
+        Args:
+            value (str): One of OutputEncoder.FORMATS, or None to keep the input format.
+        """
+        self.output_encoder.output_format = value
+
+    @property
+    def encoder_options(self):
+        """Returns the options of the output encoder."""
+        return self.output_encoder.options
+
+    @encoder_options.setter
+    def encoder_options(self, value):
+        """
+        Sets the options of the output encoder.
+
+        Args:
+            value (dict): Encoder options, see OutputEncoder.OPTIONS.
+        """
+        self.output_encoder.options = value
+
+    @property
+    def tile_size(self):
+        """Returns the side length of detection tiles, or None if tiled detection is disabled."""
+        return self._tile_size
+
+    @tile_size.setter
+    def tile_size(self, value):
+        """
+        Sets the side length of detection tiles.
+
+        Images larger than the tile size are additionally searched tile by tile
+        at full resolution, so small faces in very large images are not lost
+        when the image is resized to max_image_size.
+
+        Args:
+            value (int): The tile size in pixels, or None to disable tiled detection.
+        """
+        if value is not None and value <= 0:
+            raise ValueError("Error, Tile size must be greater than 0.")
+        self._tile_size = value
+
+    @property
+    def detection_cache(self):
+        """Returns the DetectionCache at detection_cache_path, or None if caching is disabled."""
+        if self.detection_cache_path is None:
+            return None
+        # Threads of process_all_images share this processor, so only one of them may open the cache
+        with self._detection_cache_lock:
+            if self._detection_cache is None or self._detection_cache.path != self.detection_cache_path:
+                if self._detection_cache is not None:
+                    self._detection_cache.close()
+                self._detection_cache = DetectionCache(self.detection_cache_path, self.detection_cache_size)
+            return self._detection_cache
+
+    def close_detection_cache(self):
+        """Closes the detection cache, if one is open. It is opened again when next used."""
+        with self._detection_cache_lock:
+            if self._detection_cache is not None:
+                self._detection_cache.close()
+                self._detection_cache = None
+
+    def _detection_cache_key(self, image_path, models):
+        """
+        Builds the detection cache key for an image and the current detector configuration.
+
+        Args:
+            image_path (str): The path to the image file.
+            models (list): List of face detection models to use.
+
+        Returns:
+            str: The cache key.
+        """
+        parameters = {
+            'max_image_size': self.max_image_size,
+            'reduced_decode': self.reduced_decode,
+            'cascade': FaceDetection.CASCADE_PARAMETERS,
+            'merge_method': self.merge_method,
+            'merge_threshold': self.merge_threshold,
+            'tile_size': self.tile_size,
+            'tile_overlap': self.tile_overlap,
+        }
+        return DetectionCache.make_key(ProcessingManifest.hash_file(image_path), models, parameters)
+
+    @property
+    def zero_face_output(self):
+        """Returns how images without faces are written: 'encode', 'copy' or 'link'."""
+        return self._zero_face_output
+
+    @zero_face_output.setter
+    def zero_face_output(self, value):
+        """
+        Sets how images without faces are written.
+
+        Args:
+            value (str): 'encode' re-encodes the image, 'copy' copies the original file
+                and 'link' reflinks or hard-links it, falling back to a copy.
+        """
+        if value not in self.ZERO_FACE_OUTPUTS:
+            raise ValueError(f"Error, Zero-face output must be one of {', '.join(self.ZERO_FACE_OUTPUTS)}.")
+        self._zero_face_output = value
+
+    @staticmethod
+    def copy_original(image_path, output_path, link=False):
+        """
+        Copies the original image file to the output path without re-encoding it.
+
+        Args:
+            image_path (str): The path to the original image.
+            output_path (str): The path to write to.
+            link (bool): Try a reflink, then a hard link, before copying the bytes.
+
+        Returns:
+            str: How the file was written: 'reflink', 'hardlink' or 'copy'.
+        """
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        if link:
+            if ImageProcessor._reflink(image_path, output_path):
+                return 'reflink'
+            try:
+                os.link(image_path, output_path)
+                return 'hardlink'
+            except OSError as e:
+                logging.info(f"Could not hard-link {image_path}, copying instead: {e}")
+        shutil.copyfile(image_path, output_path)
+        return 'copy'
+
+    @staticmethod
+    def _reflink(image_path, output_path):
+        """
+        Clones a file with a copy-on-write reflink where the filesystem supports it.
+
+        Returns:
+            bool: True if the file was cloned.
+        """
+        if fcntl is None:
+            return False
+        try:
+            with open(image_path, 'rb') as source, open(output_path, 'wb') as target:
+                fcntl.ioctl(target.fileno(), ImageProcessor._FICLONE, source.fileno())
+            return True
+        except OSError:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return False
+
+    @staticmethod
+    def get_output_path(image_path, output_folder, input_root=None):
+        """
+        Gets the output path for a processed image.
+
+        Args:
+            image_path (str): The path to the original image.
+            output_folder (str): The folder to save the processed image.
+            input_root (str): When given, images below this folder keep their relative
+                folder inside the output folder, so same-named files do not collide.
+
+        Returns:
+            str: The output path for the processed image.
+        """
+        base_name = os.path.basename(image_path)
+        name, ext = os.path.splitext(base_name)
+        logging.debug("Received output path")
+
+        if input_root is not None:
+            try:
+                relative_folder = os.path.relpath(os.path.dirname(os.path.abspath(image_path)), input_root)
+            except ValueError:
+                relative_folder = os.curdir
+            outside_root = relative_folder == os.pardir or relative_folder.startswith(os.pardir + os.sep)
+            if relative_folder != os.curdir and not outside_root:
+                output_folder = os.path.join(output_folder, relative_folder)
+        return os.path.join(output_folder, f"{name}_obs{ext}")
+
+    def make_output_dir(self, output_path):
+        """
+        Creates the folder of an output path when outputs mirror the input tree.
+
+        Args:
+            output_path (str): The path of the output file.
+        """
+        output_dir = os.path.dirname(output_path)
+        if self.input_root is not None and output_dir not in self._output_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            self._output_dirs.add(output_dir)
+
+    def decode_stage(self, image_path, output_folder, models=None):
+        """
+        Reads an image from disk and starts a processing job for it.
+
+        When reduced_decode is enabled, large JPEGs are only decoded at a reduced
+        resolution for detection; the full image is decoded later by
+        load_full_image, when it is actually needed. When the detection cache
+        already holds the faces of the image, nothing is decoded here.
+
+        Args:
+            image_path (str): The path to the image file.
+            output_folder (str): The folder to save the processed image.
+            models (list): List of face detection models to use, for the detection cache.
+
+        Returns:
+            dict: The processing job holding the decoded image.
+        """
+        logging.debug("Processing %s", image_path)
+        job = {'image_path': image_path, 'output_folder': output_folder, 'image': None, 'faces': [], 'timings': {}}
+        cache = self.detection_cache
+        if cache is not None and models is not None:
+            with StageTimer(job['timings'], 'cache'):
+                job['cache_key'] = self._detection_cache_key(image_path, models)
+                cached_faces = cache.get(job['cache_key'])
+            if cached_faces is not None:
+                logging.debug("Using %d cached face(s) for %s", len(cached_faces), image_path)
+                job['faces'] = cached_faces
+                job['cached'] = True
+                return job
+
+        # One span for the decode, whether the reduced decode applies or the full image is read
+        with StageTimer(job['timings'], 'read'):
+            reduced = self.preprocessor.read_image_reduced(image_path, self.max_image_size) if self.reduced_decode else None
+            original_img = self.preprocessor.read_image(image_path) if reduced is None else None
+        if reduced is not None:
+            job['detection_source'], job['original_dimension'] = reduced
+            return job
+
+        if original_img is None:
+            raise ValueError(f"Failed to load image {image_path}")
+        job['image'] = original_img
+        job['detection_source'] = original_img
+        job['original_dimension'] = max(original_img.shape[:2])
+        return job
+
+    def load_full_image(self, job):
+        """
+        Decodes the full-resolution image of a processing job if it is not loaded yet.
+
+        Args:
+            job (dict): The processing job.
+
+        Returns:
+            ndarray: The full-resolution image.
+        """
+        if job['image'] is None:
+            logging.debug("Decoding full-resolution image %s", job['image_path'])
+            with StageTimer(job.get('timings'), 'read'):
+                job['image'] = self.preprocessor.read_image(job['image_path'])
+        return job['image']
+
+    def detect_stage(self, job, models):
+        """
+        Detects faces in the image of a processing job.
+
+        The image is resized and preprocessed for detection and the detected
+        faces are scaled back to the coordinates of the original image.
+
+        Args:
+            job (dict): The processing job returned by decode_stage.
+            models (list): List of face detection models to use.
+
+        Returns:
+            dict: The processing job with the detected faces.
+        """
+        if job.get('cached'):
+            return job
+        tile_faces = self.detect_tiles(job, models)
+        self._prepare_detection(job)
+        logging.debug("Choosing face detection model")
+        faces = self.face_detection.choose_model(models, job['detection_image'], job['gray'], timings=job.get('timings'))
+        return self._finish_detection(job, faces, tile_faces)
+
+    def detect_batch_stage(self, jobs, models, batch_size=16):
+        """
+        Detects faces in the images of several processing jobs at once.
+
+        MTCNN runs batched across the jobs, the cascade models run per image.
+
+        Args:
+            jobs (list): Processing jobs returned by decode_stage.
+            models (list): List of face detection models to use.
+            batch_size (int): Maximum number of images stacked into one MTCNN batch.
+
+        Returns:
+            list: The processing jobs with the detected faces.
+        """
+        pending_jobs = [job for job in jobs if not job.get('cached')]
+        tile_faces = [self.detect_tiles(job, models) for job in pending_jobs]
+        for job in pending_jobs:
+            self._prepare_detection(job)
+        if 'mtcnn' in models and pending_jobs:
+            start_time = time.perf_counter()
+            mtcnn_faces = self.face_detection.detect_faces_mtcnn_batch([job['detection_image'] for job in pending_jobs], batch_size)
+            # Each job is charged an equal share of the batch
+            batch_share = (time.perf_counter() - start_time) / len(pending_jobs)
+            for job in pending_jobs:
+                if job.get('timings') is not None:
+                    job['timings']['detect_mtcnn'] = job['timings'].get('detect_mtcnn', 0.0) + batch_share
+        else:
+            mtcnn_faces = [None] * len(pending_jobs)
+        for job, job_mtcnn_faces, job_tile_faces in zip(pending_jobs, mtcnn_faces, tile_faces):
+            faces = self.face_detection.choose_model(models, job['detection_image'], job['gray'], job_mtcnn_faces,
+                                                     timings=job.get('timings'))
+            self._finish_detection(job, faces, job_tile_faces)
+        return jobs
+
+    def detect_tiles(self, job, models):
+        """
+        Detects faces tile by tile in the full-resolution image of a processing job.
+
+        Only images larger than tile_size are tiled. Tiles are processed by up
+        to tile_workers threads, and each tile is copied out of the image only
+        while it is processed, so the detectors' working memory depends on the
+        tile size. The image itself is decoded once at full resolution by
+        load_full_image and kept for the blur stage, because OpenCV cannot
+        decode part of an image. Peak memory therefore still grows with the
+        image size. The downscaled detection pass keeps using the reduced
+        decode of decode_stage.
+
+        Args:
+            job (dict): The processing job returned by decode_stage.
+            models (list): List of face detection models to use.
+
+        Returns:
+            list: Faces in the coordinates of the full image, or None if the image is not tiled.
+        """
+        if self.tile_size is None or job['original_dimension'] <= self.tile_size:
+            return None
+        image = self.load_full_image(job)
+        tiles = self.preprocessor.tile_grid(image.shape, self.tile_size, self.tile_overlap)
+        logging.debug("Detecting faces in %d tiles of %s", len(tiles), job['image_path'])
+
+        def detect_tile(tile):
+            x, y, w, h = tile
+            tile_image = np.ascontiguousarray(image[y:y + h, x:x + w])
+            faces = self.face_detection.choose_model(models, tile_image, self.preprocessor.preprocess_image(tile_image))
+            return [(fx + x, fy + y, fw, fh) for (fx, fy, fw, fh) in faces]
+
+        with StageTimer(job.get('timings'), 'detect_tiles'), ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            return [face for faces in executor.map(detect_tile, tiles) for face in faces]
+
+    def _prepare_detection(self, job):
+        """
+        Resizes and preprocesses the image of a processing job for detection.
+
+        Args:
+            job (dict): The processing job returned by decode_stage.
+        """
+        logging.debug("Resizing image")
+        with StageTimer(job.get('timings'), 'resize'):
+            job['detection_image'] = self.preprocessor.resize_image(job.pop('detection_source'), self.max_image_size)
+
+        logging.debug("Preprocessing image")
+        with StageTimer(job.get('timings'), 'preprocess'):
+            job['gray'] = self.preprocessor.preprocess_image(job['detection_image'])
+
+    def _finish_detection(self, job, faces, tile_faces=None):
+        """
+        Scales detected faces back to the original image and stores them on the job.
+
+        Faces found by detect_tiles are merged with them, which also merges
+        duplicate detections of a face on the seam between two tiles.
+
+        Args:
+            job (dict): The processing job prepared by _prepare_detection.
+            faces (list): Faces detected in the resized image.
+            tile_faces (list): Faces detected by detect_tiles, in full image coordinates.
+
+        Returns:
+            dict: The processing job with the detected faces.
+        """
+        logging.debug("Faces detected: %s", faces)
+        if self.preview_size is not None:
+            job['preview'] = self.preprocessor.thumbnail(job['detection_image'], self.preview_size)
+        scale_factor = job['original_dimension'] / max(job.pop('detection_image').shape[:2])
+        job.pop('gray')
+        if faces:
+            faces = [(int(x*scale_factor), int(y*scale_factor), int(w*scale_factor), int(h*scale_factor)) for (x, y, w, h) in faces]
+        if tile_faces:
+            faces = list(faces) + tile_faces
+            # Larger boxes win, so a face seen whole in one tile replaces its fragments
+            areas = BoxMerger.to_array(faces)[:, 2:].prod(axis=1)
+            faces = BoxMerger.merge(faces, areas, self.merge_threshold, self.merge_method)
+        if faces:
+            logging.debug("Detected %d face(s) in %s.", len(faces), job['image_path'])
+        else:
+            logging.debug("No faces detected in %s.", job['image_path'])
+        job['faces'] = faces
+        if 'cache_key' in job:
+            self.detection_cache.put(job['cache_key'], faces)
+        return job
+
+    def blur_stage(self, job, blur_effect):
+        """
+        Blurs the detected faces in the image of a processing job.
+
+        Args:
+            job (dict): The processing job returned by detect_stage.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+
+        Returns:
+            dict: The processing job with the blurred image.
+        """
+        if job['faces']:
+            logging.debug("Blurring faces")
+            image = self.load_full_image(job)
+            if self.preview_size is not None and 'preview' not in job:
+                job['preview'] = self.preprocessor.thumbnail(image, self.preview_size)
+            if self.face_blurrer.mask_shape is None:
+                # Overlapping faces are blurred as one region so no pixel is blurred twice
+                regions = BoxMerger.union_overlapping(job['faces'], image.shape)
+            else:
+                # The combined mask already redacts every pixel once and keeps the face shapes
+                regions = job['faces']
+            with StageTimer(job.get('timings'), 'blur'):
+                self.face_blurrer.blur_faces(image, regions, blur_effect)
+        return job
+
+    def encode_stage(self, job):
+        """
+        Writes the processed image of a processing job to the output folder.
+
+        Args:
+            job (dict): The processing job returned by blur_stage.
+
+        Returns:
+            dict: A dictionary with the number of faces detected, the output path and
+                the seconds spent in each stage.
+        """
+        timings = job.get('timings', {})
+        output_path = self.output_encoder.output_path(self.get_output_path(job['image_path'], job['output_folder'], self.input_root))
+        self.make_output_dir(output_path)
+        same_format = os.path.splitext(output_path)[1] == os.path.splitext(job['image_path'])[1]
+        if not job['faces'] and self.zero_face_output != 'encode' and same_format:
+            with StageTimer(timings, 'write'):
+                method = self.copy_original(job['image_path'], output_path, link=self.zero_face_output == 'link')
+            logging.info("No faces to blur, saved original to %s (%s)", output_path, method)
+            return self._add_preview(job, {'faces': 0, 'output_path': output_path, 'timings': timings})
+
+        logging.debug("Saving processed image to %s", output_path)
+        image = self.load_full_image(job)
+        with StageTimer(timings, 'write'):
+            success = self.output_encoder.encode(image, output_path)
+        if not success:
+            raise IOError(f"Failed to write image to {output_path}")
+
+        logging.info("Processed and saved %s", output_path)
+        return self._add_preview(job, {'faces': len(job['faces']), 'output_path': output_path, 'timings': timings})
+
+    def _add_preview(self, job, result):
+        """
+        Adds the preview thumbnails of a processing job to its result.
+
+        The original thumbnail is taken from the image already held for detection
+        and the processed one is downscaled once from the blurred image, so nothing
+        is read back from disk. Images served from the detection cache without
+        faces are never decoded and get no preview.
+
+        Args:
+            job (dict): The processing job returned by blur_stage.
+            result (dict): The result of encode_stage.
+
+        Returns:
+            dict: The result, with 'preview' as (original, processed) BGR thumbnails when available.
+        """
+        original = job.get('preview')
+        if original is None:
+            return result
+        if not job['faces']:
+            result['preview'] = (original, original)
+            return result
+        with StageTimer(result['timings'], 'preview'):
+            result['preview'] = (original, self.preprocessor.thumbnail(job['image'], self.preview_size))
+        return result
+
+    def process_single_image(self, image_path, output_folder, models, blur_effect):
+        """
+        Processes a single image including resizing, face detection, and face blurring.
+
+        Args:
+            image_path (str): The path to the image file.
+            output_folder (str): The folder to save the processed image.
+            models (list): List of face detection models to use.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+
+        Returns:
+            dict: A dictionary with the number of faces detected, the output path, the
+                seconds spent in each stage and the elapsed time.
+        """
+        try:
+            with StageTimer(None, 'image', 'image', {'image': image_path}) as timer:
+                job = self.decode_stage(image_path, output_folder, models)
+                job = self.detect_stage(job, models)
+                job = self.blur_stage(job, blur_effect)
+                result = self.encode_stage(job)
+            result['elapsed_time'] = time.perf_counter() - timer.start_time
+            if self.metrics is not None:
+                self.metrics.observe(result)
+            return result
+        except Exception as e:
+            logging.error(f"Error processing {image_path}: {e}")
+            if self.metrics is not None:
+                self.metrics.observe_error()
+            raise e
+
+    def process_all_images(self, input_folder, output_folder, models, blur_effect=(50, 50), use_processes=False, workers=None,
+                           trace_path=None, recursive=False, include=None, exclude=None):
+        """
+        Processes all images in the input folder using the specified face detection models.
+
+        Images are processed while the folder is still being walked. Outputs mirror
+        the subfolders of the input folder.
+
+        Args:
+            input_folder (str): The folder containing the images to process.
+            output_folder (str): The folder to save the processed images.
+            models (list): List of face detection models to use.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+            use_processes (bool): Process images in worker processes, each with its own
+                face detection models, instead of threads sharing this instance.
+            workers (int): Number of worker threads or processes.
+            trace_path (str): When given, write a Chrome trace-event file of the run to this path.
+            recursive (bool): Also process the images in the subfolders of the input folder.
+            include (list): Only process images matching one of these glob patterns.
+            exclude (list): Skip images and subfolders matching one of these glob patterns.
+        """
+        if trace_path:
+            Tracer.enable()
+        try:
+            start_time = time.time()
+            total_faces = 0
+            total_images = 0
+            self.input_root = os.path.abspath(input_folder)
+            image_files = DirectoryManager.walk_image_files([input_folder], recursive=recursive, include=include,
+                                                            exclude=exclude, skip_dirs=[output_folder])
+            if use_processes:
+                batch_processor = BatchProcessor(workers=workers, max_image_size=self.max_image_size,
+                                                 settings=self.get_settings())
+                summary = batch_processor.run(image_files, output_folder, models, blur_effect)
+                total_faces = summary['faces']
+                total_images = summary['images']
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    # A bounded window of futures, so a walk of millions of files is not queued up front
+                    futures = collections.deque()
+                    max_in_flight = (workers or os.cpu_count() or 1) * 4
+                    for filename in image_files:
+                        futures.append(executor.submit(self.process_single_image, filename, output_folder, models, blur_effect))
+                        while len(futures) >= max_in_flight or (futures and futures[0].done()):
+                            total_faces += futures.popleft().result()['faces']
+                            total_images += 1
+                    for future in futures:
+                        total_faces += future.result()['faces']
+                        total_images += 1
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            logging.info(f"Face blurring complete. Time taken: {elapsed_time} seconds.")
+            logging.info(f"Total images processed: {total_images}")
+            logging.info(f"Total faces found: {total_faces}")
+            logging.info(f"Total images without faces: {total_images - total_faces}")
+        except Exception as e:
+            logging.error(f"Error processing all images: {e}")
+            raise e
+        finally:
+            self.close_detection_cache()
+            if trace_path:
+                try:
+                    Tracer.write(trace_path)
+                finally:
+                    Tracer.disable()
+
+
+class FaceTracker:
+    """
+    Class for following faces between detector keyframes in a video.
+
+    The detector only runs every keyframe_interval frames or when the scene
+    changes. In between, each box is moved by the median Lucas-Kanade optical
+    flow of the feature points inside it. Keyframe detections are matched to
+    existing tracks by IoU, and a track the detector misses is kept for
+    max_misses keyframes so a face is not left unblurred by one bad detection.
+    Returned boxes are dilated to cover small tracking errors.
+    """
+    FLOW_PARAMETERS = {'winSize': (15, 15), 'maxLevel': 2,
+                       'criteria': (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)}
+    FEATURE_PARAMETERS = {'maxCorners': 20, 'qualityLevel': 0.01, 'minDistance': 3}
+    THUMBNAIL_SIZE = (64, 36)
+    MIN_TRACKED_POINTS = 3
+
+    def __init__(self, keyframe_interval=10, scene_change_threshold=0.25, dilation=0.15,
+                 match_threshold=0.3, max_misses=1):
+        """
+        Initializes the FaceTracker.
+
+        Args:
+            keyframe_interval (int): Number of frames between detector runs.
+            scene_change_threshold (float): Mean absolute difference (0-1) between
+                frame thumbnails that counts as a scene change.
+            dilation (float): Fraction of the box size added on every side of a returned box.
+            match_threshold (float): Minimum IoU for a detection to continue an existing track.
+            max_misses (int): Number of keyframes a track is kept without a matching detection.
+        """
+        if keyframe_interval < 1:
+            raise ValueError("Error, Keyframe interval must be greater than 0.")
+        if dilation < 0:
+            raise ValueError("Error, Box dilation must not be negative.")
+        self.keyframe_interval = keyframe_interval
+        self.scene_change_threshold = scene_change_threshold
+        self.dilation = dilation
+        self.match_threshold = match_threshold
+        self.max_misses = max_misses
+        self.detector_calls = 0
+        self.frames = 0
+        self.reset()
+
+    def reset(self):
+        """Forgets all tracks so the next frame is a keyframe."""
+        self._tracks = np.empty((0, 4))
+        self._misses = np.empty(0, dtype=int)
+        self._previous_gray = None
+        self._previous_thumbnail = None
+        self._frames_since_keyframe = 0
+        self._force_keyframe = True
+
+    def update(self, frame, detect):
+        """
+        Returns the face boxes for the next frame of the video.
+
+        Args:
+            frame (ndarray): The decoded BGR frame.
+            detect (callable): Called with the frame on keyframes; returns (x, y, w, h) boxes.
+
+        Returns:
+            list: The dilated face boxes as (x, y, w, h) tuples, clipped to the frame.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, FaceTracker.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        self.frames += 1
+
+        if self._is_keyframe(thumbnail):
+            self.detector_calls += 1
+            self._associate(BoxMerger.to_array(detect(frame)))
+            self._frames_since_keyframe = 0
+            self._force_keyframe = False
+        else:
+            self._propagate(self._previous_gray, gray)
+            self._frames_since_keyframe += 1
+
+        self._previous_gray = gray
+        self._previous_thumbnail = thumbnail
+        return self._dilated_boxes(frame.shape)
+
+    def _is_keyframe(self, thumbnail):
+        """Returns True when the detector has to run on the current frame."""
+        if self._force_keyframe or self._frames_since_keyframe + 1 >= self.keyframe_interval:
+            return True
+        difference = cv2.absdiff(thumbnail, self._previous_thumbnail).mean() / 255.0
+        if difference > self.scene_change_threshold:
+            logging.info(f"Scene change detected at frame {self.frames}")
+            return True
+        return False
+
+    def _associate(self, detections):
+        """Replaces tracks with keyframe detections, keeping recently missed tracks."""
+        if len(self._tracks) and len(detections):
+            matched = (BoxMerger.iou_matrix(self._tracks, detections) >= self.match_threshold).any(axis=1)
+        else:
+            matched = np.zeros(len(self._tracks), dtype=bool)
+        misses = self._misses[~matched] + 1
+        kept = misses <= self.max_misses
+        self._tracks = np.vstack([detections, self._tracks[~matched][kept]])
+        self._misses = np.concatenate([np.zeros(len(detections), dtype=int), misses[kept]])
+
+    def _propagate(self, previous_gray, gray):
+        """Moves every track by the optical flow of the feature points inside it."""
+        if not len(self._tracks):
+            return
+        points = []
+        owners = []
+        for index, (x, y, w, h) in enumerate(self._tracks.astype(int)):
+            x0, y0 = max(x, 0), max(y, 0)
+            roi = previous_gray[y0:y + h, x0:x + w]
+            corners = None
+            if roi.size:
+                corners = cv2.goodFeaturesToTrack(roi, **FaceTracker.FEATURE_PARAMETERS)
+            if corners is None:
+                # Textureless box: fall back to a coarse grid of points
+                grid_x, grid_y = np.meshgrid(np.linspace(0.25, 0.75, 3) * w, np.linspace(0.25, 0.75, 3) * h)
+                corners = np.stack([grid_x.ravel() + x - x0, grid_y.ravel() + y - y0], axis=1)
+            corners = corners.reshape(-1, 2) + (x0, y0)
+            points.append(corners)
+            owners.append(np.full(len(corners), index))
+        points = np.vstack(points).astype(np.float32).reshape(-1, 1, 2)
+        owners = np.concatenate(owners)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, gray, points, None, **FaceTracker.FLOW_PARAMETERS)
+        status = status.ravel().astype(bool)
+        points = points.reshape(-1, 2)
+        moved = moved.reshape(-1, 2)
+        for index in range(len(self._tracks)):
+            tracked = status & (owners == index)
+            if tracked.sum() < FaceTracker.MIN_TRACKED_POINTS:
+                # Lost the face; detect again on the next frame instead of guessing
+                self._force_keyframe = True
+                continue
+            before, after = points[tracked], moved[tracked]
+            shift = np.median(after - before, axis=0)
+            spread_before = np.median(np.linalg.norm(before - before.mean(axis=0), axis=1))
+            spread_after = np.median(np.linalg.norm(after - after.mean(axis=0), axis=1))
+            scale = np.clip(spread_after / spread_before, 0.8, 1.25) if spread_before > 0 else 1.0
+            x, y, w, h = self._tracks[index]
+            center = np.array([x + w / 2, y + h / 2]) + shift
+            w, h = w * scale, h * scale
+            self._tracks[index] = (center[0] - w / 2, center[1] - h / 2, w, h)
+
+    def _dilated_boxes(self, frame_shape):
+        """Returns the tracks grown by the dilation fraction and clipped to the frame."""
+        boxes = self._tracks.copy()
+        boxes[:, :2] -= boxes[:, 2:] * self.dilation
+        boxes[:, 2:] *= 1 + 2 * self.dilation
+        corners = np.hstack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]])
+        corners = np.clip(corners, 0, [frame_shape[1], frame_shape[0], frame_shape[1], frame_shape[0]])
+        corners = corners[(corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1])]
+        return BoxMerger.to_tuples(np.hstack([corners[:, :2], corners[:, 2:] - corners[:, :2]]))
+
+
+class VideoProcessor:
+    """
+    Class for detecting and blurring faces in video files.
+
+    Frames are streamed from cv2.VideoCapture to cv2.VideoWriter; a reader
+    thread decodes ahead into a small bounded queue, so only a few frames are
+    held in memory at any time. With a keyframe interval above 1, a FaceTracker
+    follows faces between detector runs. The audio track is not copied.
+    """
+    FOURCC_CODES = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.avi': 'XVID', '.mkv': 'XVID', '.wmv': 'WMV2'}
+    DEFAULT_FOURCC = 'mp4v'
+    _END = object()
+
+    def __init__(self, image_processor=None, window=8, keyframe_interval=10, tracker_dilation=0.15):
+        """
+        Initializes the VideoProcessor.
+
+        Args:
+            image_processor (ImageProcessor): The processor used to detect and blur faces in each frame.
+            window (int): Maximum number of decoded frames waiting to be processed.
+            keyframe_interval (int): Number of frames between detector runs; 1 detects on every frame.
+            tracker_dilation (float): Fraction of the box size added on every side of tracked boxes.
+        """
+        if window < 1:
+            raise ValueError("Error, Frame window must be greater than 0.")
+        if keyframe_interval < 1:
+            raise ValueError("Error, Keyframe interval must be greater than 0.")
+        self.image_processor = image_processor or ImageProcessor()
+        self.window = window
+        self.keyframe_interval = keyframe_interval
+        self.tracker_dilation = tracker_dilation
+        self.cancel_flag = False
+
+    def process_video(self, video_path, output_folder, models, blur_effect, progress_callback=None):
+        """
+        Detects and blurs faces in every frame of a video.
+
+        Setting cancel_flag from another thread or a signal handler stops the video
+        after the current frame; the frames written so far are kept.
+
+        Args:
+            video_path (str): The path to the video file.
+            output_folder (str): The folder to save the processed video.
+            models (list): List of face detection models to use.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+            progress_callback (callable): Called with (frame_index, frame_count) after each frame.
+
+        Returns:
+            dict: The number of frames, faces and detector calls, the output path, frames per second
+                and whether the video was cancelled.
+        """
+        tracker = None
+        if self.keyframe_interval > 1:
+            tracker = FaceTracker(self.keyframe_interval, dilation=self.tracker_dilation)
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise ValueError(f"Error reading video {video_path}.")
+
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        output_path = self.image_processor.get_output_path(video_path, output_folder, self.image_processor.input_root)
+        self.image_processor.make_output_dir(output_path)
+        extension = os.path.splitext(output_path)[1].lower()
+        fourcc = cv2.VideoWriter_fourcc(*VideoProcessor.FOURCC_CODES.get(extension, VideoProcessor.DEFAULT_FOURCC))
+        writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        if not writer.isOpened():
+            capture.release()
+            raise IOError(f"Failed to open video writer for {output_path}")
+
+        frames = queue.Queue(maxsize=self.window)
+        stop_reading = threading.Event()
+
+        def read_frames():
+            try:
+                while not stop_reading.is_set():
+                    success, frame = capture.read()
+                    if not success:
+                        break
+                    frames.put(frame)
+            finally:
+                frames.put(VideoProcessor._END)
+
+        reader = threading.Thread(target=read_frames, name="obscurrra-video-reader", daemon=True)
+        total_frames = 0
+        total_faces = 0
+        start_time = time.time()
+        logging.info(f"Processing video {video_path}")
+        reader.start()
+        try:
+            while True:
+                frame = frames.get()
+                if frame is VideoProcessor._END:
+                    break
+                if self.cancel_flag:
+                    break
+                faces = self.process_frame(frame, video_path, models, blur_effect, tracker)
+                writer.write(frame)
+                total_frames += 1
+                total_faces += len(faces)
+                if progress_callback:
+                    progress_callback(total_frames, frame_count)
+        finally:
+            stop_reading.set()
+            # Unblock the reader if it is waiting for space in the queue
+            while reader.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            capture.release()
+            writer.release()
+
+        elapsed_time = time.time() - start_time
+        frames_per_second = total_frames / elapsed_time if elapsed_time > 0 else 0.0
+        detector_calls = tracker.detector_calls if tracker else total_frames
+        logging.info(f"Processed {total_frames} frames of {video_path} at {frames_per_second:.2f} frames/sec "
+                     f"with {detector_calls} detector calls")
+        return {
+            'frames': total_frames,
+            'faces': total_faces,
+            'detector_calls': detector_calls,
+            'output_path': output_path,
+            'elapsed_time': elapsed_time,
+            'frames_per_second': frames_per_second,
+            'cancelled': self.cancel_flag,
+        }
+
+    def process_frame(self, frame, video_path, models, blur_effect, tracker=None):
+        """
+        Detects and blurs faces in a single video frame, in place.
+
+        Args:
+            frame (ndarray): The decoded frame.
+            video_path (str): The path to the video, used for logging.
+            models (list): List of face detection models to use.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+            tracker (FaceTracker): When given, the detector only runs on the tracker's keyframes.
+
+        Returns:
+            list: The detected or tracked faces as (x, y, w, h) tuples.
+        """
+        def detect(image):
+            job = {
+                'image_path': video_path,
+                'image': image,
+                'detection_source': image,
+                'original_dimension': max(image.shape[:2]),
+                'faces': [],
+            }
+            return self.image_processor.detect_stage(job, models)['faces']
+
+        faces = tracker.update(frame, detect) if tracker else detect(frame)
+        self.image_processor.blur_stage({'image': frame, 'faces': faces}, blur_effect)
+        return faces
+
+
+class ProcessingManifest:
+    """
+    Class for recording processed images so interrupted runs can resume.
+
+    The manifest is a JSON-lines file in the output folder with one entry per
+    processed input. An entry stays valid while the input file and the
+    processing settings are unchanged and the output file still exists.
+    """
+    FILE_NAME = '.obscurrra_manifest.jsonl'
+
+    def __init__(self, output_folder, settings, use_content_hash=False):
+        """
+        Initializes the ProcessingManifest and loads any existing entries.
+
+        Args:
+            output_folder (str): The folder holding the manifest and processed images.
+            settings (dict): The settings that affect the output, e.g. models and blur effect.
+            use_content_hash (bool): Identify unchanged inputs by a hash of their content
+                when their size or modification time has changed.
+        """
+        self.path = os.path.join(output_folder, ProcessingManifest.FILE_NAME)
+        self.fingerprint = self.settings_fingerprint(settings)
+        self.use_content_hash = use_content_hash
+        self.skipped = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        """
+        Loads the entries of an existing manifest file, later entries winning.
+
+        Every run appends an entry per processed image, so a manifest holding
+        superseded or invalid lines is compacted to one line per input.
+        """
+        if not os.path.isfile(self.path):
+            return
+        lines = 0
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry['input']] = entry
+                except (ValueError, KeyError):
+                    logging.warning(f"Skipping invalid manifest line in {self.path}")
+        logging.info(f"Loaded {len(self._entries)} manifest entries from {self.path}")
+        if lines > len(self._entries):
+            self._compact()
+
+    def _compact(self):
+        """Rewrites the manifest file with the loaded entries only, replacing it atomically."""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                for entry in self._entries.values():
+                    file.write(json.dumps(entry) + "\n")
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Error compacting manifest {self.path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def settings_fingerprint(settings):
+        """
+        Returns a short, stable fingerprint of the processing settings.
+
+        Args:
+            settings (dict): The settings that affect the output.
+
+        Returns:
+            str: The fingerprint.
+        """
+        encoded = json.dumps(settings, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    @staticmethod
+    def hash_file(path, chunk_size=1 << 20):
+        """
+        Returns the SHA-256 hash of a file's content.
+
+        Args:
+            path (str): The path to the file.
+            chunk_size (int): The number of bytes read at a time.
 
         Returns:
-            list: List of detected faces as (x, y, w, h) tuples.
+            str: The hexadecimal hash.
         """
-        try:
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-            logging.info(f"Detected {len(faces)} faces using {face_cascade} model")
-            return faces
-        except Exception as e:
-            logging.error(f"Error detecting faces: {e}")
-            return []
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
 
-    def detect_faces_mtcnn(self, image):
+    def is_done(self, image_path):
         """
-        Detects faces in an image using the MTCNN detector.
+        Checks whether an image was already processed with the current settings.
 
         Args:
-            image (ndarray): The original image.
+            image_path (str): The path to the image file.
 
         Returns:
-            list: List of detected faces as (x, y, w, h) tuples.
+            bool: True if the image can be skipped.
         """
+        entry = self._entries.get(os.path.abspath(image_path))
+        if entry is None or entry['settings'] != self.fingerprint or not os.path.exists(entry['output']):
+            return False
         try:
-            if self._mtcnn_detector is None:
-                logging.error("MTCNN detector is not initialized.")
-                return []
+            stat = os.stat(image_path)
+        except OSError:
+            return False
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        if self.use_content_hash and entry.get('hash') and stat.st_size == entry['size']:
+            return self.hash_file(image_path) == entry['hash']
+        return False
+
+    def pending(self, image_files):
+        """
+        Yields the images that still need processing and counts the skipped ones.
 
-            results = self._mtcnn_detector.detect_faces(image)
-            faces = [(result['box'][0], result['box'][1], result['box'][2], result['box'][3]) for result in results]
-            logging.info(f"Detected {len(faces)} faces using MTCNN")
-            return faces
-        except Exception as e:
-            logging.error(f"Error detecting faces with MTCNN: {e}")
-            return []
+        Args:
+            image_files (iterable): Paths of the images to check.
 
+        Yields:
+            str: Paths of the images that are new or changed.
+        """
+        for image_file in image_files:
+            if self.is_done(image_file):
+                self.skipped += 1
+                continue
+            yield image_file
 
-class FaceBlurrer:
+    def record(self, image_path, output_path):
+        """
+        Records a processed image in the manifest.
+
+        Args:
+            image_path (str): The path to the original image.
+            output_path (str): The path of the processed image.
+        """
+        stat = os.stat(image_path)
+        entry = {
+            'input': os.path.abspath(image_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'settings': self.fingerprint,
+            'output': os.path.abspath(output_path),
+        }
+        if self.use_content_hash:
+            entry['hash'] = self.hash_file(image_path)
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._entries[entry['input']] = entry
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        """Closes the manifest file."""
+        with self._lock:
+            self._file.close()
+
+
+_worker_image_processor = None
+
+
+def _initialize_worker(settings, log_level, models, trace=False):
     """
-    Class for blurring detected faces in images.
+    Initializes a worker process of the batch process pool.
+
+    Each worker builds its own ImageProcessor, and with it its own
+    FaceDetection models, once and keeps it for the life of the process.
+
+    Args:
+        settings (dict): Processing settings applied to the worker's ImageProcessor.
+        log_level (int): The logging level to use inside the worker.
+        models (list): The face detection models to load up front.
+        trace (bool): Record trace events and return them with each result.
     """
-    @staticmethod
-    def blur_faces(img, faces, blur_effect):
+    global _worker_image_processor
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+    if trace:
+        Tracer.enable(f'obscurrra-worker-{os.getpid()}')
+    _worker_image_processor = ImageProcessor()
+    _worker_image_processor.apply_settings(settings)
+    # Closes the worker's detection cache when the pool shuts the worker down at the end of BatchProcessor.run
+    multiprocessing.util.Finalize(_worker_image_processor, _worker_image_processor.close_detection_cache, exitpriority=10)
+    ModelRegistry.require(models)
+
+
+def _process_image_in_worker(image_path, output_folder, models, blur_effect):
+    """
+    Processes a single image with the ImageProcessor of the current worker process.
+
+    While tracing, the events recorded in the worker so far are returned with the result.
+    """
+    result = _worker_image_processor.process_single_image(image_path, output_folder, models, blur_effect)
+    if Tracer.enabled:
+        result['trace_events'] = Tracer.drain()
+    return result
+
+
+class BatchProcessor:
+    """
+    Class for processing many images in parallel across worker processes.
+    """
+    def __init__(self, workers=None, max_image_size=ImageProcessor._MAX_IMAGE_SIZE, settings=None, metrics=None):
         """
-        Applies a blur effect to the detected faces in an image.
+        Initializes the BatchProcessor.
 
         Args:
-            img (ndarray): The image containing faces.
-            faces (list): List of detected faces as (x, y, w, h) tuples.
+            workers (int): Number of worker processes. Defaults to the CPU count.
+            max_image_size (int): The maximum image size used for face detection.
+            settings (dict): Further processing settings applied to each worker's ImageProcessor.
+            metrics (Metrics): Updated with every result and the number of images in flight.
+        """
+        if workers is not None and workers < 1:
+            raise ValueError("Error, Number of workers must be greater than 0.")
+        self.workers = workers or os.cpu_count() or 1
+        self.settings = dict(settings or {}, max_image_size=max_image_size)
+        self.metrics = metrics
+        self.cancel_flag = False
+
+    def run(self, image_files, output_folder, models, blur_effect, progress_callback=None):
+        """
+        Processes the given images using a pool of worker processes.
+
+        Args:
+            image_files (iterable): Paths of the images to process.
+            output_folder (str): The folder to save the processed images.
+            models (list): List of face detection models to use.
             blur_effect (tuple): The blur effect to apply as (width, height).
+            progress_callback (callable): Called with (image_path, result, error) after each image.
 
         Returns:
-            ndarray: The image with blurred faces.
+            dict: Totals for the run including images per second.
         """
-        try:
-            # Ensure blur_effect is a tuple of integers
-            blur_effect = (int(blur_effect[0]), int(blur_effect[1]))
-            for (x, y, w, h) in faces:
-                img[y:y+h, x:x+w] = cv2.blur(img[y:y+h, x:x+w], blur_effect)
-            logging.info(f"Applied blur effect to faces: {faces}")
-            return img
-        except Exception as e:
-            logging.error(f"Error blurring faces: {e}")
-            raise e
+        total_images = 0
+        total_faces = 0
+        no_faces = 0
+        errors = 0
+        histogram = TimingHistogram()
+        max_in_flight = self.workers * 4
+        start_time = time.time()
 
+        # Spawned workers start from a clean interpreter, which keeps TensorFlow fork-safe.
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_initialize_worker,
+                                 initargs=(self.settings, logging.getLogger().getEffectiveLevel(), models,
+                                           Tracer.enabled)) as executor:
+            pending = {}
+            image_iter = iter(image_files)
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and not self.cancel_flag and len(pending) < max_in_flight:
+                    image_file = next(image_iter, None)
+                    if image_file is None:
+                        exhausted = True
+                        break
+                    future = executor.submit(_process_image_in_worker, image_file, output_folder,
+                                             models, blur_effect)
+                    pending[future] = image_file
+                if self.cancel_flag:
+                    exhausted = True
+                if self.metrics is not None:
+                    self.metrics.set_gauge('in_flight_images', len(pending), 'Images submitted and not yet finished.')
+                if not pending:
+                    break
 
-class ImageProcessor:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_file = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors += 1
+                        logging.error(f"Error processing image {image_file}: {e}")
+                        if self.metrics is not None:
+                            self.metrics.observe_error()
+                        if progress_callback:
+                            progress_callback(image_file, None, e)
+                        continue
+
+                    total_images += 1
+                    total_faces += result['faces']
+                    if result['faces'] == 0:
+                        no_faces += 1
+                    histogram.add(result['timings'])
+                    if 'trace_events' in result:
+                        Tracer.extend(result.pop('trace_events'))
+                    if self.metrics is not None:
+                        self.metrics.observe(result)
+                    if progress_callback:
+                        progress_callback(image_file, result, None)
+
+        if self.metrics is not None:
+            self.metrics.set_gauge('in_flight_images', 0, 'Images submitted and not yet finished.')
+            self.metrics.flush()
+        elapsed_time = time.time() - start_time
+        images_per_second = total_images / elapsed_time if elapsed_time > 0 else 0.0
+        return {
+            'images': total_images,
+            'faces': total_faces,
+            'no_faces': no_faces,
+            'errors': errors,
+            'elapsed_time': elapsed_time,
+            'images_per_second': images_per_second,
+            'stage_timings': histogram.to_dict(),
+        }
+
+
+class StreamingPipeline:
     """
-    Class for processing images including resizing, face detection, and face blurring.
+    Class for processing images through decode, detect, blur and encode stages.
+
+    Every stage has its own worker threads and a bounded input queue, so disk
+    reads and writes overlap with face detection. The number of decoded images
+    held in memory at any time is capped by max_frames.
     """
-    IMAGE_EXTENSIONS = ['*.jpg', '*.jpeg', '*.png', '*.webp']
-    _MAX_IMAGE_SIZE = 1000
+    _STOP = object()
 
-    def __init__(self):
+    def __init__(self, image_processor=None, decode_workers=2, detect_workers=1, blur_workers=1,
+                 encode_workers=2, queue_size=8, max_frames=None, detect_batch_size=1, metrics=None):
         """
-        Initializes the ImageProcessor.
+        Initializes the StreamingPipeline.
+
+        Args:
+            image_processor (ImageProcessor): The processor whose stages are run.
+            decode_workers (int): Number of threads reading images.
+            detect_workers (int): Number of threads detecting faces.
+            blur_workers (int): Number of threads blurring faces.
+            encode_workers (int): Number of threads writing images.
+            queue_size (int): Maximum number of jobs waiting in front of each stage.
+            max_frames (int): Maximum number of decoded images held in memory.
+                Defaults to the total number of queue slots and workers.
+            detect_batch_size (int): Maximum number of images a detection thread takes from
+                its queue at once, so MTCNN can run on a batch of images.
+            metrics (Metrics): Updated with every result, the queue depths and the number of images in flight.
         """
-        self.preprocessor = Preprocessor()
-        self.face_detection = FaceDetection()
-        self.face_blurrer = FaceBlurrer()
+        self.image_processor = image_processor or ImageProcessor()
+        self.workers = {
+            'decode': decode_workers,
+            'detect': detect_workers,
+            'blur': blur_workers,
+            'encode': encode_workers,
+        }
+        if min(self.workers.values()) < 1:
+            raise ValueError("Error, Number of workers must be greater than 0.")
+        if queue_size < 1:
+            raise ValueError("Error, Queue size must be greater than 0.")
+        if detect_batch_size < 1:
+            raise ValueError("Error, Detection batch size must be greater than 0.")
+        self.queue_size = queue_size
+        self.detect_batch_size = detect_batch_size
+        self.max_frames = max_frames or queue_size * 3 + sum(self.workers.values())
+        self.metrics = metrics
+        self.cancel_flag = False
 
-    @property
-    def max_image_size(self):
-        """Returns the maximum image size."""
-        return self._MAX_IMAGE_SIZE
+    def run(self, image_files, output_folder, models, blur_effect, progress_callback=None):
+        """
+        Processes the given images through the pipeline stages.
 
-    @max_image_size.setter
-    def max_image_size(self, value):
+        Args:
+            image_files (iterable): Paths of the images to process.
+            output_folder (str): The folder to save the processed images.
+            models (list): List of face detection models to use.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+            progress_callback (callable): Called with (image_path, result, error) after each image.
+
+        Returns:
+            dict: Totals for the run including images per second.
         """
-        Sets the maximum image size.
+        totals = {'images': 0, 'faces': 0, 'no_faces': 0, 'errors': 0, 'in_flight': 0}
+        totals_lock = threading.Lock()
+        histogram = TimingHistogram()
+        frame_slots = threading.BoundedSemaphore(self.max_frames)
+        start_time = time.time()
+
+        def finish(image_file, result, error):
+            frame_slots.release()
+            if self.metrics is not None:
+                if error is not None:
+                    self.metrics.observe_error()
+                else:
+                    self.metrics.observe(result)
+            with totals_lock:
+                totals['in_flight'] -= 1
+                if error is not None:
+                    totals['errors'] += 1
+                    logging.error(f"Error processing image {image_file}: {error}")
+                else:
+                    totals['images'] += 1
+                    totals['faces'] += result['faces']
+                    if result['faces'] == 0:
+                        totals['no_faces'] += 1
+                    histogram.add(result['timings'])
+                if progress_callback:
+                    progress_callback(image_file, result, error)
+
+        def decode(image_file):
+            # The slot is released by finish() once the job leaves the pipeline.
+            frame_slots.acquire()
+            with totals_lock:
+                totals['in_flight'] += 1
+            start = time.perf_counter()
+            job = self.image_processor.decode_stage(image_file, output_folder, models)
+            job['start_time'] = start
+            return job
+
+        def encode(job):
+            result = self.image_processor.encode_stage(job)
+            # End-to-end time of the image, including the time spent waiting in the queues
+            result['elapsed_time'] = time.perf_counter() - job['start_time']
+            return result
+
+        stages = [
+            ('decode', decode),
+            ('detect', lambda jobs: self.image_processor.detect_batch_stage(jobs, models, self.detect_batch_size)),
+            ('blur', lambda job: self.image_processor.blur_stage(job, blur_effect)),
+            ('encode', encode),
+        ]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        if self.metrics is not None:
+            self.metrics.set_gauge_function('queue_depth', lambda: {name: stage_queue.qsize() for (name, _), stage_queue
+                                                                    in zip(stages, queues)},
+                                            'Jobs waiting in front of each pipeline stage.', label='stage')
+            self.metrics.set_gauge_function('in_flight_images', lambda: totals['in_flight'],
+                                            'Images decoded and not yet finished.')
+        threads = []
+        for index, (name, func) in enumerate(stages):
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+            batch_size = self.detect_batch_size if name == 'detect' else None
+            stage_threads = [
+                threading.Thread(target=self._run_stage, args=(name, func, queues[index], out_queue, finish, batch_size),
+                                 name=f"obscurrra-{name}-{number}", daemon=True)
+                for number in range(self.workers[name])
+            ]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+
+        for image_file in image_files:
+            if self.cancel_flag:
+                break
+            queues[0].put(image_file)
+
+        # Stop each stage once the stage in front of it has drained.
+        for index, (name, _) in enumerate(stages):
+            for _ in range(self.workers[name]):
+                queues[index].put(StreamingPipeline._STOP)
+            for thread in threads[index]:
+                thread.join()
+        self.image_processor.close_detection_cache()
+
+        if self.metrics is not None:
+            self.metrics.remove_gauge_function('queue_depth')
+            self.metrics.remove_gauge_function('in_flight_images')
+            self.metrics.set_gauge('in_flight_images', 0, 'Images decoded and not yet finished.')
+            self.metrics.flush()
+        del totals['in_flight']
+        elapsed_time = time.time() - start_time
+        images_per_second = totals['images'] / elapsed_time if elapsed_time > 0 else 0.0
+        return dict(totals, elapsed_time=elapsed_time, images_per_second=images_per_second,
+                    stage_timings=histogram.to_dict())
+
+    @staticmethod
+    def _run_stage(name, func, in_queue, out_queue, finish, batch_size=None):
+        """
+        Runs one worker of a pipeline stage until it receives the stop marker.
 
         Args:
-            value (int): The new maximum image size.
+            name (str): The stage name.
+            func (callable): The stage function applied to each item, or to a list of
+                items when batch_size is set.
+            in_queue (Queue): The queue the stage reads from.
+            out_queue (Queue): The queue of the next stage, or None for the last stage.
+            finish (callable): Called with (image_path, result, error) when a job leaves the pipeline.
+            batch_size (int): Maximum number of queued items handed to func at once.
         """
-        if value > 0:
-            self._MAX_IMAGE_SIZE = value
-        else:
-            raise ValueError("Error, Maximum image size must be greater than 0.")
+        stopping = False
+        while not stopping:
+            item = in_queue.get()
+            if item is StreamingPipeline._STOP:
+                return
+            items = [item]
+            # Only take items that are already waiting, so a batch never delays the pipeline.
+            while batch_size and len(items) < batch_size:
+                try:
+                    item = in_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is StreamingPipeline._STOP:
+                    stopping = True
+                    break
+                items.append(item)
+
+            image_files = [item if name == 'decode' else item['image_path'] for item in items]
+            try:
+                with StageTimer(None, name, 'pipeline', {'images': image_files}):
+                    outputs = func(items) if batch_size else [func(items[0])]
+            except Exception as e:
+                for image_file in image_files:
+                    finish(image_file, None, e)
+                continue
+            for image_file, output in zip(image_files, outputs):
+                if out_queue is None:
+                    finish(image_file, output, None)
+                else:
+                    out_queue.put(output)
+
+
+def _run_benchmark_case(image_files, models, workers, blur_effect, settings, connection):
+    """
+    Runs one benchmark case in a fresh process and sends its measurements back.
+
+    Running every case in its own process keeps the peak memory of one case
+    from leaking into the next.
+
+    Args:
+        image_files (list): Paths of the images to process.
+        models (list): List of face detection models to use.
+        workers (int): Number of worker processes.
+        blur_effect (tuple): The blur effect to apply as (width, height).
+        settings (dict): Processing settings for the workers' ImageProcessors.
+        connection (Connection): The pipe end to send the measurements to.
+    """
+    try:
+        latencies = []
+
+        def record_latency(image_file, result, error):
+            if result is not None:
+                latencies.append(result['elapsed_time'])
+
+        with tempfile.TemporaryDirectory(prefix='obscurrra-benchmark-') as output_folder:
+            batch_processor = BatchProcessor(workers=workers,
+                                             max_image_size=settings.get('max_image_size', ImageProcessor._MAX_IMAGE_SIZE),
+                                             settings=settings)
+            summary = batch_processor.run(image_files, output_folder, models, blur_effect,
+                                          progress_callback=record_latency)
+        connection.send({'summary': summary, 'latencies': latencies,
+                         'peak_rss_mb': Benchmark.peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+                         'peak_worker_rss_mb': Benchmark.peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None})
+    except Exception as e:
+        connection.send({'error': str(e)})
+    finally:
+        connection.close()
+
+
+class Benchmark:
+    """
+    Class for measuring end-to-end throughput of the batch processor.
+
+    Every combination of face detection models and worker count is run over
+    the same images. Throughput includes starting the worker pool and loading
+    the models, as in a real batch run.
+    """
+    DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tests', '00000')
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, image_files, model_sets=None, worker_counts=(1,), blur_effect=(50, 50), settings=None):
+        """
+        Initializes the Benchmark.
+
+        Args:
+            image_files (list): Paths of the images to process in every case.
+            model_sets (list): Lists of models to benchmark. Defaults to every combination of models.
+            worker_counts (list): Numbers of worker processes to benchmark.
+            blur_effect (tuple): The blur effect to apply as (width, height).
+            settings (dict): Processing settings for the workers' ImageProcessors.
+        """
+        if not image_files:
+            raise ValueError("Error, No images to benchmark.")
+        self.image_files = list(image_files)
+        self.model_sets = model_sets or self.model_combinations()
+        self.worker_counts = list(worker_counts)
+        self.blur_effect = blur_effect
+        self.settings = dict(settings or {}, detection_cache_path=None)
 
     @staticmethod
-    def get_output_path(image_path, output_folder):
+    def model_combinations(models=ModelRegistry.MODELS):
         """
-        Gets the output path for a processed image.
+        Returns every non-empty combination of the given models.
 
         Args:
-            image_path (str): The path to the original image.
-            output_folder (str): The folder to save the processed image.
+            models (tuple): The models to combine.
 
         Returns:
-            str: The output path for the processed image.
+            list: The combinations as lists of model names.
         """
-        base_name = os.path.basename(image_path)
-        name, ext = os.path.splitext(base_name)
-        logging.info(f"Received output path")
-        
-        return os.path.join(output_folder, f"{name}_obs{ext}")
+        return [list(combination) for size in range(1, len(models) + 1)
+                for combination in itertools.combinations(models, size)]
 
-    def process_single_image(self, image_path, output_folder, models, blur_effect):
+    @staticmethod
+    def peak_rss_mb(who):
         """
-        Processes a single image including resizing, face detection, and face blurring.
+        Returns the peak resident set size reported by getrusage.
+
+        Args:
+            who (int): resource.RUSAGE_SELF, or resource.RUSAGE_CHILDREN for the largest child process.
+
+        Returns:
+            float: The peak resident set size in MiB.
+        """
+        peak = resource.getrusage(who).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+    def run(self, progress_callback=None):
+        """
+        Runs every benchmark case.
+
+        Args:
+            progress_callback (callable): Called with each case result as it finishes.
+
+        Returns:
+            dict: The environment and the results of all cases.
+        """
+        cases = []
+        for models in self.model_sets:
+            for workers in self.worker_counts:
+                case = self.run_case(models, workers)
+                cases.append(case)
+                if progress_callback:
+                    progress_callback(case)
+        return {
+            'images': len(self.image_files),
+            'cpu_count': os.cpu_count(),
+            'python': sys.version.split()[0],
+            'opencv': cv2.__version__,
+            'settings': self.settings,
+            'cases': cases,
+        }
+
+    def run_case(self, models, workers):
+        """
+        Runs one benchmark case in a separate process.
 
         Args:
-            image_path (str): The path to the image file.
-            output_folder (str): The folder to save the processed image.
             models (list): List of face detection models to use.
-            blur_effect (tuple): The blur effect to apply as (width, height).
+            workers (int): Number of worker processes.
 
         Returns:
-            dict: A dictionary with the number of faces detected and the output path.
+            dict: Throughput, latency percentiles in milliseconds and peak memory of the case.
         """
+        logging.info(f"Benchmarking {'+'.join(models)} with {workers} worker(s)")
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_benchmark_case,
+                                  args=(self.image_files, models, workers, self.blur_effect, self.settings, sender))
+        process.start()
+        sender.close()
         try:
-            logging.info(f"Processing {image_path}")
-            original_img = self.preprocessor.read_image(image_path)
-            if original_img is None:
-                raise ValueError(f"Failed to load image {image_path}")
-            
-            logging.info("Resizing image")
-            resized_img = self.preprocessor.resize_image(original_img.copy(), self.max_image_size)
-            
-            logging.info("Preprocessing image")
-            gray = self.preprocessor.preprocess_image(resized_img)
-            
-            logging.info("Choosing face detection model")
-            faces = self.face_detection.choose_model(models, resized_img, gray)
-            logging.info(f"Faces detected: {faces}")
-
-            scale_factor = max(original_img.shape[:2]) / max(resized_img.shape[:2])
-
-            if faces:
-                logging.info(f"Detected {len(faces)} face(s) in {image_path}.")
-                faces = [(int(x*scale_factor), int(y*scale_factor), int(w*scale_factor), int(h*scale_factor)) for (x, y, w, h) in faces]
-                logging.info("Blurring faces")
-                self.face_blurrer.blur_faces(original_img, faces, blur_effect)
-            else:
-                logging.info(f"No faces detected in {image_path}.")
-            
-            output_path = self.get_output_path(image_path, output_folder)
-            logging.info(f"Saving processed image to {output_path}")
-            success = cv2.imwrite(output_path, original_img)
-            if not success:
-                raise IOError(f"Failed to write image to {output_path}")
-            
-            logging.info(f"Processed and saved {output_path}")
-            return {'faces': len(faces), 'output_path': output_path}
-        except Exception as e:
-            logging.error(f"Error processing {image_path}: {e}")
-            raise e
+            measurements = receiver.recv()
+        except EOFError:
+            measurements = {'error': f"Benchmark process exited with code {process.exitcode}"}
+        process.join()
+
+        case = {'models': list(models), 'workers': workers}
+        if 'error' in measurements:
+            logging.error(f"Benchmark of {'+'.join(models)} with {workers} worker(s) failed: {measurements['error']}")
+            case['error'] = measurements['error']
+            return case
+        summary = measurements['summary']
+        latencies = np.asarray(measurements['latencies']) * 1000
+        case.update({
+            'images': summary['images'],
+            'errors': summary['errors'],
+            'faces': summary['faces'],
+            'elapsed_time': summary['elapsed_time'],
+            'images_per_second': summary['images_per_second'],
+            'stage_timings': summary['stage_timings'],
+            'latency_ms': {f'p{percentile}': float(np.percentile(latencies, percentile)) if len(latencies) else None
+                           for percentile in Benchmark.PERCENTILES},
+            'peak_rss_mb': measurements['peak_rss_mb'],
+            'peak_worker_rss_mb': measurements['peak_worker_rss_mb'],
+        })
+        return case
+
+    @staticmethod
+    def format_table(results):
+        """
+        Formats benchmark results as a plain-text table.
+
+        Args:
+            results (dict): The results returned by run.
 
+        Returns:
+            str: The table.
+        """
+        headers = ['models', 'workers', 'images/s'] + [f'p{p} ms' for p in Benchmark.PERCENTILES] + \
+                  ['rss MiB', 'worker MiB', 'errors']
+
+        def number(value, digits=1):
+            return '-' if value is None else f'{value:.{digits}f}'
+
+        rows = []
+        for case in results['cases']:
+            if 'error' in case:
+                rows.append(['+'.join(case['models']), str(case['workers']), 'failed: ' + case['error']])
+                continue
+            rows.append(['+'.join(case['models']), str(case['workers']), number(case['images_per_second'], 2)] +
+                        [number(case['latency_ms'][f'p{p}']) for p in Benchmark.PERCENTILES] +
+                        [number(case['peak_rss_mb'], 0), number(case['peak_worker_rss_mb'], 0), str(case['errors'])])
+        widths = [max(len(row[i]) for row in [headers] + rows if i < len(row)) for i in range(len(headers))]
+        lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in [headers] + rows]
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
+
+
+class CommandLineInterface:
+    """
+    Headless command-line entry point for processing images without the GUI.
+    """
+    MODELS = ModelRegistry.MODELS
+    OUTPUT_FOLDER_NAME = 'Obscurrred'
 
-    def process_all_images(self, input_folder, output_folder, models):
+    @staticmethod
+    def build_parser():
         """
-        Processes all images in the input folder using the specified face detection models.
+        Builds the argument parser for the command line.
+
+        Returns:
+            ArgumentParser: The configured parser.
+        """
+        parser = argparse.ArgumentParser(
+            prog='obscurrra',
+            description='Detect and blur faces in images and videos without starting the GUI.')
+        parser.add_argument('inputs', nargs='+',
+                            help='Image or video files, or folders containing them, to process.')
+        parser.add_argument('-o', '--output',
+                            help='Output folder. Defaults to an "Obscurrred" folder inside the first input folder. '
+                                 'Outputs keep their folder relative to the folder holding all inputs.')
+        parser.add_argument('-r', '--recursive', action='store_true',
+                            help='Also process the images and videos in subfolders of the input folders.')
+        parser.add_argument('--include', action='append', metavar='PATTERN',
+                            help='Only process files whose name or path relative to the input folder matches this '
+                                 'glob, e.g. "2023/*/*.jpg". Can be given several times.')
+        parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                            help='Skip files and subfolders whose name or relative path matches this glob, '
+                                 'e.g. "thumbnails". Can be given several times.')
+        parser.add_argument('-m', '--models', nargs='+', choices=CommandLineInterface.MODELS, default=['mtcnn'],
+                            help='Face detection models to use (default: mtcnn).')
+        parser.add_argument('-b', '--blur', type=int, default=50,
+                            help='Blur effect intensity (default: 50).')
+        parser.add_argument('--blur-engine', choices=FaceBlurrer.ENGINES, default='box',
+                            help='How faces are redacted: box, gaussian or stack blur, pixelate, '
+                                 'or fill with a solid colour (default: box).')
+        parser.add_argument('--blur-scale', type=float,
+                            help='Grow the blur kernel to this fraction of the shorter face side, '
+                                 'so large faces are hidden as well as small ones (default: off).')
+        parser.add_argument('--blur-downscale', action='store_true',
+                            help='Blur a downscaled copy of each face and scale it back up; '
+                                 'much faster for large faces.')
+        parser.add_argument('--blur-mask', choices=FaceBlurrer.MASK_SHAPES,
+                            help='Redact all faces of an image in one pass through a combined rectangular '
+                                 'or elliptical mask (default: redact each face rectangle separately).')
+        parser.add_argument('-s', '--max-size', type=int, default=ImageProcessor._MAX_IMAGE_SIZE,
+                            help=f'Maximum image size in pixels used for detection (default: {ImageProcessor._MAX_IMAGE_SIZE}).')
+        parser.add_argument('--tile-size', type=int,
+                            help='Also search images larger than this many pixels tile by tile at full resolution, '
+                                 'to find small faces in panoramas and other very large images (default: off).')
+        parser.add_argument('--tile-overlap', type=int, default=200,
+                            help='Minimum overlap between neighbouring tiles in pixels; faces up to this size '
+                                 'always lie wholly inside a tile (default: 200).')
+        parser.add_argument('--tile-workers', type=int, default=2,
+                            help='Number of threads detecting faces in the tiles of one image (default: 2).')
+        parser.add_argument('--merge-method', choices=BoxMerger.METHODS, default='nms',
+                            help='How duplicate detections from the models are merged: non-maximum suppression '
+                                 'or weighted box fusion (default: nms).')
+        parser.add_argument('--merge-threshold', type=float, default=0.3,
+                            help='IoU above which two detections are the same face (default: 0.3).')
+        parser.add_argument('--zero-face-output', choices=ImageProcessor.ZERO_FACE_OUTPUTS, default='encode',
+                            help='How to write images without faces: re-encode them, copy the original file, '
+                                 'or reflink/hard-link it when on the same filesystem (default: encode).')
+        parser.add_argument('--output-format', choices=OutputEncoder.FORMATS,
+                            help='Write every image in this format (default: keep the input format).')
+        parser.add_argument('--encoder-preset', choices=OutputEncoder.PRESETS,
+                            help='Encoder options for speed or size: fast, balanced or archive '
+                                 '(default: OpenCV defaults). The options below override the preset.')
+        parser.add_argument('--jpeg-quality', type=int,
+                            help='JPEG quality from 0 to 100.')
+        parser.add_argument('--jpeg-progressive', action='store_true', default=None,
+                            help='Write progressive JPEGs.')
+        parser.add_argument('--jpeg-optimize', action='store_true', default=None,
+                            help='Optimise JPEG Huffman tables for smaller files.')
+        parser.add_argument('--png-compression', type=int,
+                            help='PNG compression level from 0 (fastest) to 9 (smallest).')
+        parser.add_argument('--png-strategy', choices=OutputEncoder.PNG_STRATEGIES,
+                            help='PNG compression strategy; rle and huffman are fastest.')
+        parser.add_argument('--webp-quality', type=int,
+                            help='WebP quality from 1 to 100; 100 is lossless when a WebP method is set.')
+        parser.add_argument('--webp-method', type=int,
+                            help='WebP compression method from 0 (fastest) to 6 (smallest).')
+        parser.add_argument('--full-decode', action='store_true',
+                            help='Always decode images at full resolution, even for detection.')
+        parser.add_argument('-w', '--workers', type=int,
+                            help='Number of worker processes (default: CPU count), '
+                                 'or of detection threads in pipeline mode (default: 1).')
+        parser.add_argument('--pipeline', action='store_true',
+                            help='Process images in a single process through decode, detect, blur and encode '
+                                 'stages so disk I/O overlaps with detection. --workers sets the detection threads.')
+        parser.add_argument('--io-workers', type=int, default=2,
+                            help='Number of decode and of encode threads in pipeline mode (default: 2).')
+        parser.add_argument('--queue-size', type=int, default=8,
+                            help='Maximum number of images waiting in front of each pipeline stage (default: 8).')
+        parser.add_argument('--detect-batch-size', type=int, default=1,
+                            help='Maximum number of images run through MTCNN as one batch in pipeline mode (default: 1).')
+        parser.add_argument('--keyframe-interval', type=int, default=10,
+                            help='Run face detection on every Nth video frame and track faces in between; '
+                                 '1 detects on every frame (default: 10).')
+        parser.add_argument('--tracker-dilation', type=float, default=0.15,
+                            help='Fraction of the box size added on every side of tracked video boxes (default: 0.15).')
+        parser.add_argument('--detection-cache', action='store_true',
+                            help='Reuse the faces detected in earlier runs, so re-running with a new blur skips '
+                                 f'detection (cache database: {DetectionCache.default_path()}).')
+        parser.add_argument('--detection-cache-path',
+                            help='Path of the detection cache database; implies --detection-cache.')
+        parser.add_argument('--detection-cache-size', type=int, default=100000,
+                            help='Maximum number of images kept in the detection cache (default: 100000).')
+        parser.add_argument('--force', action='store_true',
+                            help='Process every image again, even if the manifest in the output folder '
+                                 'records it as already processed with the same settings.')
+        parser.add_argument('--content-hash', action='store_true',
+                            help='Record a content hash in the manifest, so touched but unchanged images are still skipped.')
+        parser.add_argument('--trace',
+                            help='Write a Chrome trace-event JSON file of every image and stage to this path; '
+                                 'open it in Perfetto (ui.perfetto.dev) or chrome://tracing.')
+        parser.add_argument('--metrics-port', type=int,
+                            help='Serve Prometheus metrics over HTTP on this port while processing.')
+        parser.add_argument('--metrics-address', default='127.0.0.1',
+                            help='Address the metrics endpoint binds to (default: 127.0.0.1).')
+        parser.add_argument('--metrics-textfile',
+                            help='Write Prometheus metrics to this .prom file every 15 seconds and at the end, '
+                                 'for the node exporter textfile collector.')
+        parser.add_argument('--timings', action='store_true',
+                            help='Print how long each processing stage took, slowest stage first.')
+        parser.add_argument('-v', '--verbose', action='count', default=0,
+                            help='Log a line per image; repeat (-vv) to log every processing step.')
+        return parser
+
+    @staticmethod
+    def log_level(verbose):
+        """
+        Returns the logging level for the number of times --verbose was given.
 
         Args:
-            input_folder (str): The folder containing the images to process.
+            verbose (int): 0 logs warnings only, 1 a summary line per image and 2 every processing step.
+
+        Returns:
+            int: The logging level.
+        """
+        return (logging.WARNING, logging.INFO)[verbose] if verbose < 2 else logging.DEBUG
+
+    @staticmethod
+    def processor_settings(args):
+        """
+        Builds the ImageProcessor settings from the parsed arguments.
+
+        Args:
+            args (Namespace): The parsed command-line arguments.
+
+        Returns:
+            dict: The processing settings.
+        """
+        return {
+            'max_image_size': args.max_size,
+            'reduced_decode': not args.full_decode,
+            'zero_face_output': args.zero_face_output,
+            'detection_cache_path': args.detection_cache_path or (DetectionCache.default_path() if args.detection_cache else None),
+            'detection_cache_size': args.detection_cache_size,
+            'merge_method': args.merge_method,
+            'merge_threshold': args.merge_threshold,
+            'tile_size': args.tile_size,
+            'tile_overlap': args.tile_overlap,
+            'tile_workers': args.tile_workers,
+            'blur_engine': args.blur_engine,
+            'blur_scale': args.blur_scale,
+            'blur_downscale': args.blur_downscale,
+            'blur_mask': args.blur_mask,
+            'output_format': args.output_format,
+            'encoder_options': CommandLineInterface.encoder_options(args),
+            'input_root': DirectoryManager.input_root(args.inputs),
+        }
+
+    @staticmethod
+    def encoder_options(args):
+        """
+        Builds the output encoder options from the preset and the encoder arguments.
+
+        Args:
+            args (Namespace): The parsed command-line arguments.
+
+        Returns:
+            dict: The encoder options.
+        """
+        overrides = {option: getattr(args, option) for option in OutputEncoder.OPTIONS}
+        if args.encoder_preset:
+            return OutputEncoder.preset(args.encoder_preset, **overrides)
+        return {option: value for option, value in overrides.items() if value is not None}
+
+    @staticmethod
+    def build_benchmark_parser():
+        """
+        Builds the argument parser for the benchmark command.
+
+        Returns:
+            ArgumentParser: The configured parser.
+        """
+        parser = argparse.ArgumentParser(
+            prog='obscurrra benchmark',
+            description='Measure throughput, latency and memory for each model combination and worker count. '
+                        'Results are written as JSON to standard output and as a table to standard error.')
+        parser.add_argument('inputs', nargs='*', default=[Benchmark.DEFAULT_CORPUS],
+                            help='Image files or folders to benchmark (default: the bundled tests/00000 corpus).')
+        parser.add_argument('-m', '--models', nargs='+',
+                            help='Model combinations to benchmark, joined with "+", e.g. mtcnn frontalface+profileface '
+                                 '(default: every combination).')
+        parser.add_argument('-w', '--workers', nargs='+', type=int, default=[1, os.cpu_count() or 1],
+                            help='Worker counts to benchmark (default: 1 and the CPU count).')
+        parser.add_argument('-n', '--limit', type=int,
+                            help='Benchmark only the first N images.')
+        parser.add_argument('-b', '--blur', type=int, default=50,
+                            help='Blur effect intensity (default: 50).')
+        parser.add_argument('-s', '--max-size', type=int, default=ImageProcessor._MAX_IMAGE_SIZE,
+                            help=f'Maximum image size in pixels used for detection (default: {ImageProcessor._MAX_IMAGE_SIZE}).')
+        parser.add_argument('--json',
+                            help='Write the JSON results to this file instead of standard output.')
+        parser.add_argument('-v', '--verbose', action='count', default=0,
+                            help='Log a line per image; repeat (-vv) to log every processing step.')
+        return parser
+
+    def run_benchmark(self, argv):
+        """
+        Parses the benchmark arguments and runs the benchmark.
+
+        Args:
+            argv (list): The arguments following "benchmark".
+
+        Returns:
+            int: The process exit code.
+        """
+        parser = self.build_benchmark_parser()
+        args = parser.parse_args(argv)
+        model_sets = None
+        if args.models:
+            model_sets = [combination.split('+') for combination in args.models]
+            unknown = {model for models in model_sets for model in models} - set(self.MODELS)
+            if unknown:
+                parser.error(f"Unknown models: {', '.join(sorted(unknown))}. Choose from {', '.join(self.MODELS)}.")
+        if any(workers < 1 for workers in args.workers):
+            parser.error("Number of workers must be greater than 0.")
+        if args.limit is not None and args.limit < 1:
+            parser.error("Image limit must be greater than 0.")
+        if args.blur < 1:
+            parser.error("Blur effect intensity must be greater than 0.")
+        if args.max_size < 1:
+            parser.error("Maximum image size must be greater than 0.")
+
+        logging.basicConfig(level=CommandLineInterface.log_level(args.verbose),
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+        image_files = DirectoryManager.list_image_files(args.inputs)[:args.limit]
+        if not image_files:
+            logging.error("No images found to benchmark.")
+            return 1
+
+        benchmark = Benchmark(image_files, model_sets, sorted(set(args.workers)), (args.blur, args.blur),
+                              {'max_image_size': args.max_size})
+        results = benchmark.run(progress_callback=lambda case: print(
+            f"Benchmarked {'+'.join(case['models'])} with {case['workers']} worker(s).", file=sys.stderr))
+        print(Benchmark.format_table(results), file=sys.stderr)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
+        return 1 if any('error' in case or case['errors'] for case in results['cases']) else 0
+
+    def run(self, argv=None):
+        """
+        Parses the arguments and processes the images.
+
+        An argument list starting with "benchmark" runs the benchmark instead.
+
+        Args:
+            argv (list): Command-line arguments. Defaults to sys.argv.
+
+        Returns:
+            int: The process exit code.
+        """
+        argv = sys.argv[1:] if argv is None else list(argv)
+        if argv and argv[0] == 'benchmark':
+            return self.run_benchmark(argv[1:])
+        parser = self.build_parser()
+        args = parser.parse_args(argv)
+        if args.blur < 1:
+            parser.error("Blur effect intensity must be greater than 0.")
+        if args.max_size < 1:
+            parser.error("Maximum image size must be greater than 0.")
+        if args.workers is None:
+            args.workers = 1 if args.pipeline else os.cpu_count() or 1
+        if args.workers < 1:
+            parser.error("Number of workers must be greater than 0.")
+        if args.io_workers < 1:
+            parser.error("Number of I/O workers must be greater than 0.")
+        if args.queue_size < 1:
+            parser.error("Queue size must be greater than 0.")
+        if args.detect_batch_size < 1:
+            parser.error("Detection batch size must be greater than 0.")
+        try:
+            OutputEncoder(options=self.encoder_options(args))
+        except ValueError as e:
+            parser.error(str(e).replace("Error, ", ""))
+        if args.blur_scale is not None and args.blur_scale <= 0:
+            parser.error("Blur scale must be greater than 0.")
+        if args.tile_size is not None and args.tile_size < 1:
+            parser.error("Tile size must be greater than 0.")
+        if args.tile_size is not None and not 0 <= args.tile_overlap < args.tile_size:
+            parser.error("Tile overlap must be at least 0 and smaller than the tile size.")
+        if args.tile_workers < 1:
+            parser.error("Number of tile workers must be greater than 0.")
+        if args.metrics_port is not None and not 0 <= args.metrics_port <= 65535:
+            parser.error("Metrics port must be between 0 and 65535.")
+        if args.keyframe_interval < 1:
+            parser.error("Keyframe interval must be greater than 0.")
+        if args.tracker_dilation < 0:
+            parser.error("Tracker dilation must not be negative.")
+        if args.detection_cache_size < 1:
+            parser.error("Detection cache size must be greater than 0.")
+        if not 0 < args.merge_threshold <= 1:
+            parser.error("Merge threshold must be greater than 0 and at most 1.")
+
+        logging.basicConfig(level=CommandLineInterface.log_level(args.verbose),
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+
+        output_folder = args.output
+        if not output_folder:
+            first_input = args.inputs[0]
+            input_folder = first_input if os.path.isdir(first_input) else os.path.dirname(os.path.abspath(first_input))
+            output_folder = os.path.join(input_folder, CommandLineInterface.OUTPUT_FOLDER_NAME)
+
+        # Images are walked lazily, so processing starts before a large tree has been read.
+        # Videos are listed after the images are done, so the tree is not walked twice up front.
+        walk_options = {'recursive': args.recursive, 'include': args.include, 'exclude': args.exclude,
+                        'skip_dirs': [output_folder]}
+        image_files = DirectoryManager.walk_image_files(args.inputs, **walk_options)
+        first_image = next(image_files, None)
+        video_files = None
+        if first_image is None:
+            video_files = DirectoryManager.list_video_files(args.inputs, **walk_options)
+            if not video_files:
+                logging.error("No images or videos found to process.")
+                return 1
+        DirectoryManager.create_output_directory(output_folder)
+
+        settings = self.processor_settings(args)
+        if args.trace:
+            Tracer.enable()
+        metrics = None
+        if args.metrics_port is not None or args.metrics_textfile:
+            metrics = Metrics()
+            if args.metrics_port is not None:
+                metrics.serve(args.metrics_port, args.metrics_address)
+            if args.metrics_textfile:
+                metrics.start_textfile_writer(args.metrics_textfile)
+        exit_code = 0
+        try:
+            if first_image is not None:
+                exit_code = self.process_images(args, itertools.chain([first_image], image_files), output_folder,
+                                                settings, metrics)
+                video_files = DirectoryManager.list_video_files(args.inputs, **walk_options)
+            if video_files:
+                exit_code = self.process_videos(args, video_files, output_folder, settings) or exit_code
+        finally:
+            if args.trace:
+                try:
+                    Tracer.write(args.trace)
+                    print(f"Trace written to {args.trace}.")
+                finally:
+                    Tracer.disable()
+            if metrics is not None:
+                if args.metrics_textfile:
+                    metrics.write_textfile(args.metrics_textfile)
+                metrics.close()
+        return exit_code
+
+    @staticmethod
+    def process_images(args, image_files, output_folder, settings, metrics=None):
+        """
+        Processes images in a process pool or the streaming pipeline.
+
+        Args:
+            args (Namespace): The parsed command-line arguments.
+            image_files (iterable): Paths of the images to process.
             output_folder (str): The folder to save the processed images.
-            models (list): List of face detection models to use.
+            settings (dict): The ImageProcessor settings.
+            metrics (Metrics): The metrics to update, or None.
+
+        Returns:
+            int: The process exit code.
         """
+        manifest = ProcessingManifest(output_folder,
+                                      dict(ImageProcessor.output_settings(settings), models=sorted(args.models),
+                                           blur_effect=[args.blur, args.blur]),
+                                      use_content_hash=args.content_hash)
+        if not args.force:
+            image_files = manifest.pending(image_files)
+
+        def report_progress(image_file, result, error):
+            if result is None:
+                return
+            manifest.record(image_file, result['output_path'])
+            if args.verbose:
+                print(f"Processed {os.path.basename(image_file)}, found {result['faces']} faces.")
+
+        if args.pipeline:
+            ModelRegistry.warm_up(args.models, background=True)
+            image_processor = ImageProcessor()
+            image_processor.apply_settings(settings)
+            batch_processor = StreamingPipeline(image_processor, decode_workers=args.io_workers,
+                                                detect_workers=args.workers, encode_workers=args.io_workers,
+                                                queue_size=args.queue_size,
+                                                detect_batch_size=args.detect_batch_size, metrics=metrics)
+        else:
+            batch_processor = BatchProcessor(workers=args.workers, max_image_size=args.max_size, settings=settings,
+                                             metrics=metrics)
         try:
-            start_time = time.time()
-            total_faces = 0
-            total_images = 0
-            with ThreadPoolExecutor() as executor:
-                futures = []
-                for extension in self.IMAGE_EXTENSIONS:
-                    for filename in glob.glob(os.path.join(input_folder, extension)):
-                        futures.append(executor.submit(self.process_single_image, filename, output_folder, models, blur_effect))
-                for future in futures:
-                    result = future.result()
-                    total_faces += result['faces']
-                    total_images += 1
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            logging.info(f"Face blurring complete. Time taken: {elapsed_time} seconds.")
-            logging.info(f"Total images processed: {total_images}")
-            logging.info(f"Total faces found: {total_faces}")
-            logging.info(f"Total images without faces: {total_images - total_faces}")
-        except Exception as e:
-            logging.error(f"Error processing all images: {e}")
-            raise e
+            summary = batch_processor.run(image_files, output_folder, args.models, (args.blur, args.blur),
+                                          progress_callback=report_progress)
+        finally:
+            manifest.close()
+
+        print(f"Processing complete. Total images processed: {summary['images']}, "
+              f"Total faces detected: {summary['faces']}, "
+              f"Total images without faces: {summary['no_faces']}, "
+              f"Skipped unchanged images: {manifest.skipped}, "
+              f"Errors: {summary['errors']}, "
+              f"Time taken: {summary['elapsed_time']:.2f} seconds, "
+              f"Throughput: {summary['images_per_second']:.2f} images/sec.")
+        if args.timings and summary['stage_timings']:
+            print(TimingHistogram.format_table(summary['stage_timings']))
+        return 1 if summary['errors'] else 0
+
+    @staticmethod
+    def process_videos(args, video_files, output_folder, settings):
+        """
+        Processes videos one after another, streaming their frames.
+
+        The first Ctrl+C stops after the current frame and skips the remaining
+        videos; a second one interrupts immediately.
+
+        Args:
+            args (Namespace): The parsed command-line arguments.
+            video_files (list): Paths of the videos to process.
+            output_folder (str): The folder to save the processed videos.
+            settings (dict): The ImageProcessor settings.
 
+        Returns:
+            int: The process exit code.
+        """
+        image_processor = ImageProcessor()
+        image_processor.apply_settings(dict(settings, detection_cache_path=None))
+        video_processor = VideoProcessor(image_processor, window=args.queue_size,
+                                         keyframe_interval=args.keyframe_interval,
+                                         tracker_dilation=args.tracker_dilation)
+
+        def cancel(signum, frame):
+            logging.warning("Cancelling after the current frame. Press Ctrl+C again to stop immediately.")
+            video_processor.cancel_flag = True
+            signal.signal(signal.SIGINT, previous_handler)
+
+        previous_handler = signal.signal(signal.SIGINT, cancel)
+        exit_code = 0
+        try:
+            for video_file in video_files:
+                if video_processor.cancel_flag:
+                    break
+                try:
+                    result = video_processor.process_video(video_file, output_folder, args.models, (args.blur, args.blur))
+                except Exception as e:
+                    logging.error(f"Error processing video {video_file}: {e}")
+                    exit_code = 1
+                    continue
+                if result['cancelled']:
+                    print(f"Cancelled video {os.path.basename(video_file)}. "
+                          f"{result['output_path']} holds the first {result['frames']} frames only.")
+                    break
+                print(f"Processed video {os.path.basename(video_file)}. Frames: {result['frames']}, "
+                      f"Faces detected: {result['faces']}, "
+                      f"Detector calls: {result['detector_calls']}, "
+                      f"Time taken: {result['elapsed_time']:.2f} seconds, "
+                      f"Throughput: {result['frames_per_second']:.2f} frames/sec.")
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+        if video_processor.cancel_flag:
+            print("Video processing cancelled.")
+            # The conventional exit code of a process stopped by SIGINT
+            return 130
+        return exit_code
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(CommandLineInterface().run(sys.argv[1:]))
     try:
         logging.info("Starting Obscurrra GUI application.")
         app = ObscurrraGUI()
@@ -0,0 +1,833 @@
+"""Behaviour tests for the parts of Obscurrra that do not need a face detection model."""
+import hashlib
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from Obscurrra import (BoxMerger, DetectionCache, DirectoryManager, FaceBlurrer, FaceDetection, FaceTracker, ImageProcessor,
+                       Metrics, ModelRegistry, OutputEncoder, Preprocessor, ProcessingManifest, StageTimer, StreamingPipeline, TimingHistogram,
+                       VideoProcessor)
+
+
+def write_image(path, seed=0, size=(64, 64)):
+    """Writes a random image whose format follows the extension of path and returns it."""
+    image = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    assert cv2.imwrite(path, image)
+    return image
+
+
+def file_md5(path):
+    with open(path, 'rb') as file:
+        return hashlib.md5(file.read()).hexdigest()
+
+
+class StubStagesProcessor(ImageProcessor):
+    """An ImageProcessor whose stages only pass job dictionaries along."""
+
+    def __init__(self, faces_per_image=1, failing=()):
+        super().__init__()
+        self.faces_per_image = faces_per_image
+        self.failing = set(failing)
+        self.encoded = []
+        self.detect_batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def decode_stage(self, image_path, output_folder, models=None):
+        self.decode_models = models
+        if image_path in self.failing:
+            raise ValueError(f"Failed to load image {image_path}")
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return {'image_path': image_path, 'output_folder': output_folder, 'image': None, 'faces': [], 'timings': {},
+                'stages': ['decode']}
+
+    def detect_stage(self, job, models):
+        job['faces'] = [(0, 0, 10, 10)] * self.faces_per_image
+        job['stages'].append('detect')
+        return job
+
+    def detect_batch_stage(self, jobs, models, batch_size=16):
+        self.detect_batches.append(len(jobs))
+        return [self.detect_stage(job, models) for job in jobs]
+
+    def blur_stage(self, job, blur_effect):
+        job['stages'].append('blur')
+        return job
+
+    def encode_stage(self, job):
+        job['stages'].append('encode')
+        with self._lock:
+            self.in_flight -= 1
+            self.encoded.append(job)
+        return {'faces': len(job['faces']), 'output_path': job['image_path'] + '.out', 'timings': job['timings']}
+
+
+class TestStreamingPipeline:
+    IMAGES = [f'image_{number}.jpg' for number in range(50)]
+
+    def test_every_image_passes_through_every_stage(self):
+        processor = StubStagesProcessor(faces_per_image=2)
+        totals = StreamingPipeline(processor, queue_size=2).run(self.IMAGES, 'out', ['mtcnn'], (50, 50))
+        assert totals['images'] == 50 and totals['faces'] == 100 and totals['errors'] == 0
+        assert sorted(job['image_path'] for job in processor.encoded) == sorted(self.IMAGES)
+        assert all(job['stages'] == ['decode', 'detect', 'blur', 'encode'] for job in processor.encoded)
+
+    def test_decode_gets_the_models_for_the_detection_cache(self):
+        processor = StubStagesProcessor()
+        StreamingPipeline(processor).run(self.IMAGES, 'out', ['mtcnn'], (50, 50))
+        assert processor.decode_models == ['mtcnn']
+
+    def test_failed_images_are_reported_and_the_rest_continue(self):
+        processor = StubStagesProcessor(faces_per_image=0, failing=['image_3.jpg'])
+        failures = []
+        totals = StreamingPipeline(processor).run(
+            self.IMAGES, 'out', ['mtcnn'], (50, 50),
+            progress_callback=lambda image_file, result, error: error is not None and failures.append(image_file))
+        assert failures == ['image_3.jpg']
+        assert totals['errors'] == 1 and totals['images'] == 49 and totals['no_faces'] == 49
+
+    def test_decoded_images_in_memory_are_capped(self):
+        processor = StubStagesProcessor()
+        StreamingPipeline(processor, queue_size=4, max_frames=3).run(self.IMAGES, 'out', ['mtcnn'], (50, 50))
+        assert len(processor.encoded) == 50
+        assert processor.max_in_flight <= 3
+
+    def test_detection_takes_batches_of_waiting_images(self):
+        processor = StubStagesProcessor()
+        totals = StreamingPipeline(processor, queue_size=8, detect_batch_size=4).run(self.IMAGES, 'out', ['mtcnn'], (50, 50))
+        assert totals['images'] == 50
+        assert sum(processor.detect_batches) == 50 and max(processor.detect_batches) <= 4
+
+    def test_every_image_is_timed_end_to_end(self):
+        metrics = Metrics()
+        results = []
+        StreamingPipeline(StubStagesProcessor(), metrics=metrics).run(
+            self.IMAGES, 'out', ['mtcnn'], (50, 50),
+            progress_callback=lambda image_file, result, error: results.append(result))
+        assert len(results) == 50 and all(result['elapsed_time'] >= 0 for result in results)
+        assert 'obscurrra_image_duration_seconds_count 50' in metrics.render().splitlines()
+
+    def test_cancel_stops_reading_new_images(self):
+        pipeline = StreamingPipeline(StubStagesProcessor(), queue_size=1)
+
+        def cancel(image_file, result, error):
+            pipeline.cancel_flag = True
+
+        image_files = (f'image_{number}.jpg' for number in range(10000))
+        totals = pipeline.run(image_files, 'out', ['mtcnn'], (50, 50), progress_callback=cancel)
+        assert 0 < totals['images'] < 100
+
+
+class TestReducedDecode:
+    def test_large_jpegs_are_decoded_at_the_smallest_sufficient_scale(self, tmp_path):
+        image_path = str(tmp_path / 'large.jpg')
+        write_image(image_path, size=(1600, 800))
+        image, original_dimension = Preprocessor.read_image_reduced(image_path, 400)
+        assert image.shape == (200, 400, 3)
+        assert original_dimension == 1600
+
+    def test_images_too_small_to_reduce_are_not_decoded(self, tmp_path):
+        image_path = str(tmp_path / 'small.jpg')
+        write_image(image_path, size=(1600, 800))
+        assert Preprocessor.read_image_reduced(image_path, 1000) is None
+
+    def test_only_jpegs_are_decoded_at_reduced_resolution(self, tmp_path):
+        image_path = str(tmp_path / 'large.png')
+        write_image(image_path, size=(1600, 800))
+        assert Preprocessor.read_image_reduced(image_path, 200) is None
+
+    def test_unreadable_files_are_not_decoded(self, tmp_path):
+        image_path = tmp_path / 'broken.jpg'
+        image_path.write_bytes(b'not a jpeg')
+        assert Preprocessor.read_image_reduced(str(image_path), 200) is None
+
+
+class TestOutputWrites:
+    def test_copy_keeps_the_original_bytes(self, tmp_path):
+        input_path = str(tmp_path / 'in.jpg')
+        output_path = str(tmp_path / 'out' / 'in_obs.jpg')
+        write_image(input_path)
+        os.makedirs(os.path.dirname(output_path))
+        assert ImageProcessor.copy_original(input_path, output_path) == 'copy'
+        assert file_md5(output_path) == file_md5(input_path)
+
+    def test_writing_over_a_linked_output_keeps_the_input(self, tmp_path):
+        input_path = str(tmp_path / 'in.png')
+        output_path = str(tmp_path / 'out' / 'in_obs.png')
+        write_image(input_path)
+        os.makedirs(os.path.dirname(output_path))
+        input_md5 = file_md5(input_path)
+
+        assert ImageProcessor.copy_original(input_path, output_path, link=True) in ('reflink', 'hardlink', 'copy')
+        assert OutputEncoder().encode(np.zeros((64, 64, 3), dtype=np.uint8), output_path)
+
+        assert file_md5(input_path) == input_md5
+        assert not os.path.samefile(input_path, output_path)
+        assert os.listdir(os.path.dirname(output_path)) == ['in_obs.png']
+
+    def test_encode_stage_does_not_write_through_a_linked_output(self, tmp_path):
+        input_path = str(tmp_path / 'in.png')
+        image = write_image(input_path)
+        input_md5 = file_md5(input_path)
+        processor = ImageProcessor()
+        processor.zero_face_output = 'link'
+        output_folder = str(tmp_path / 'out')
+        os.makedirs(output_folder)
+
+        processor.encode_stage({'image_path': input_path, 'output_folder': output_folder, 'image': None, 'faces': []})
+        result = processor.encode_stage({'image_path': input_path, 'output_folder': output_folder,
+                                         'image': np.zeros_like(image), 'faces': [(0, 0, 10, 10)]})
+
+        assert file_md5(input_path) == input_md5
+        assert not os.path.samefile(input_path, result['output_path'])
+
+
+class TestProcessingManifest:
+    SETTINGS = {'max_image_size': 500, 'models': ['mtcnn'], 'blur_effect': [50, 50]}
+
+    def record(self, tmp_path, settings, use_content_hash=False):
+        image_path = str(tmp_path / 'in' / 'a.png')
+        output_path = str(tmp_path / 'out' / 'a_obs.png')
+        write_image(image_path)
+        write_image(output_path)
+        manifest = ProcessingManifest(str(tmp_path / 'out'), settings, use_content_hash=use_content_hash)
+        manifest.record(image_path, output_path)
+        manifest.close()
+        return image_path, output_path
+
+    def test_recorded_images_are_skipped(self, tmp_path):
+        image_path, _ = self.record(tmp_path, self.SETTINGS)
+        manifest = ProcessingManifest(str(tmp_path / 'out'), self.SETTINGS)
+        assert list(manifest.pending([image_path, str(tmp_path / 'in' / 'new.png')])) == [str(tmp_path / 'in' / 'new.png')]
+        assert manifest.skipped == 1
+        manifest.close()
+
+    def test_changed_settings_reprocess(self, tmp_path):
+        image_path, _ = self.record(tmp_path, self.SETTINGS)
+        manifest = ProcessingManifest(str(tmp_path / 'out'), dict(self.SETTINGS, blur_effect=[20, 20]))
+        assert list(manifest.pending([image_path])) == [image_path]
+        manifest.close()
+
+    def test_changed_input_reprocesses(self, tmp_path):
+        image_path, _ = self.record(tmp_path, self.SETTINGS)
+        write_image(image_path, seed=1)
+        os.utime(image_path, ns=(0, 0))
+        manifest = ProcessingManifest(str(tmp_path / 'out'), self.SETTINGS)
+        assert not manifest.is_done(image_path)
+        manifest.close()
+
+    def test_touched_input_with_the_same_content_is_skipped_by_hash(self, tmp_path):
+        image_path, _ = self.record(tmp_path, self.SETTINGS, use_content_hash=True)
+        os.utime(image_path, ns=(0, 0))
+        manifest = ProcessingManifest(str(tmp_path / 'out'), self.SETTINGS, use_content_hash=True)
+        assert manifest.is_done(image_path)
+        manifest.close()
+
+    def test_missing_output_reprocesses(self, tmp_path):
+        image_path, output_path = self.record(tmp_path, self.SETTINGS)
+        os.remove(output_path)
+        manifest = ProcessingManifest(str(tmp_path / 'out'), self.SETTINGS)
+        assert not manifest.is_done(image_path)
+        manifest.close()
+
+    def test_superseded_entries_are_compacted_on_load(self, tmp_path):
+        for blur in (10, 20, 50):
+            image_path, _ = self.record(tmp_path, dict(self.SETTINGS, blur_effect=[blur, blur]))
+        manifest_path = tmp_path / 'out' / ProcessingManifest.FILE_NAME
+        with open(manifest_path, 'a', encoding='utf-8') as file:
+            file.write('not json\n')
+        manifest = ProcessingManifest(str(tmp_path / 'out'), self.SETTINGS)
+        assert manifest.is_done(image_path)
+        manifest.close()
+        assert len(manifest_path.read_text(encoding='utf-8').splitlines()) == 1
+        assert [name for name in os.listdir(tmp_path / 'out') if name.endswith('.tmp')] == []
+
+
+class TestDetectionCache:
+    def test_get_returns_stored_faces(self, tmp_path):
+        cache = DetectionCache(str(tmp_path / 'cache.sqlite'))
+        cache.put('a', [(1, 2, 3, 4)])
+        assert cache.get('a') == [(1, 2, 3, 4)]
+        assert cache.get('b') is None
+        cache.close()
+
+    def test_close_evicts_least_recently_used_entries(self, tmp_path):
+        path = str(tmp_path / 'cache.sqlite')
+        cache = DetectionCache(path, max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, [])
+        cache.get('a')
+        cache.close()
+
+        cache = DetectionCache(path, max_entries=2)
+        assert cache.get('b') is None
+        assert cache.get('a') == [] and cache.get('c') == []
+        cache.close()
+
+    def test_key_depends_on_models_and_parameters(self):
+        key = DetectionCache.make_key('hash', ['mtcnn'], {'max_image_size': 500})
+        assert key == DetectionCache.make_key('hash', ['mtcnn'], {'max_image_size': 500})
+        assert key != DetectionCache.make_key('hash', ['mtcnn', 'frontalface'], {'max_image_size': 500})
+        assert key != DetectionCache.make_key('hash', ['mtcnn'], {'max_image_size': 1000})
+
+    def test_default_path_is_per_user(self, tmp_path, monkeypatch):
+        monkeypatch.delenv('LOCALAPPDATA', raising=False)
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        assert DetectionCache.default_path() == os.path.join(str(tmp_path), 'Obscurrra', DetectionCache.FILE_NAME)
+
+    def test_decode_stage_does_not_hash_inputs_without_a_cache(self, tmp_path, monkeypatch):
+        def hash_file(path, chunk_size=1 << 20):
+            raise AssertionError("hashed without a detection cache")
+
+        monkeypatch.setattr(ProcessingManifest, 'hash_file', staticmethod(hash_file))
+        image_path = str(tmp_path / 'a.png')
+        write_image(image_path)
+        job = ImageProcessor().decode_stage(image_path, str(tmp_path), ['mtcnn'])
+        assert job['image'] is not None and 'cache_key' not in job
+
+    def test_decode_stage_uses_cached_faces_without_decoding(self, tmp_path, monkeypatch):
+        image_path = str(tmp_path / 'a.png')
+        write_image(image_path)
+        processor = ImageProcessor()
+        processor.detection_cache_path = str(tmp_path / 'cache' / 'cache.sqlite')
+        processor.detection_cache.put(processor._detection_cache_key(image_path, ['mtcnn']), [(1, 2, 3, 4)])
+
+        monkeypatch.setattr(Preprocessor, 'read_image', staticmethod(lambda path: pytest.fail("decoded a cached image")))
+        job = processor.decode_stage(image_path, str(tmp_path), ['mtcnn'])
+        processor.close_detection_cache()
+        assert job['cached'] and job['faces'] == [(1, 2, 3, 4)]
+
+    def test_cache_settings_do_not_change_the_manifest_fingerprint(self):
+        processor = ImageProcessor()
+        other = ImageProcessor()
+        other.apply_settings({'detection_cache_path': '/tmp/cache.sqlite', 'detection_cache_size': 5000,
+                              'tile_workers': 4, 'input_root': '/data'})
+        assert (ProcessingManifest.settings_fingerprint(ImageProcessor.output_settings(processor.get_settings())) ==
+                ProcessingManifest.settings_fingerprint(ImageProcessor.output_settings(other.get_settings())))
+        other.max_image_size = 2000
+        assert (ProcessingManifest.settings_fingerprint(ImageProcessor.output_settings(processor.get_settings())) !=
+                ProcessingManifest.settings_fingerprint(ImageProcessor.output_settings(other.get_settings())))
+
+
+class TestBoxMerger:
+    def test_iou_matrix(self):
+        iou = BoxMerger.iou_matrix(BoxMerger.to_array([(0, 0, 10, 10)]),
+                                   BoxMerger.to_array([(0, 0, 10, 10), (5, 0, 10, 10), (20, 20, 5, 5)]))
+        assert iou[0] == pytest.approx([1.0, 50 / 150, 0.0])
+
+    def test_nms_keeps_highest_scoring_box_of_each_face(self):
+        boxes = [(0, 0, 10, 10), (1, 1, 10, 10), (50, 50, 10, 10)]
+        merged = BoxMerger.merge(boxes, scores=[0.5, 0.9, 0.7], iou_threshold=0.3, method='nms')
+        assert sorted(merged) == [(1, 1, 10, 10), (50, 50, 10, 10)]
+
+    def test_wbf_fuses_overlapping_boxes_by_score(self):
+        merged = BoxMerger.merge([(0, 0, 10, 10), (2, 0, 10, 10)], scores=[1.0, 1.0], iou_threshold=0.3, method='wbf')
+        assert merged == [(1, 0, 10, 10)]
+
+    def test_boxes_below_the_threshold_are_kept(self):
+        boxes = [(0, 0, 10, 10), (8, 0, 10, 10)]
+        assert len(BoxMerger.merge(boxes, iou_threshold=0.5)) == 2
+
+    def test_unknown_method(self):
+        with pytest.raises(ValueError):
+            BoxMerger.merge([(0, 0, 10, 10)], method='average')
+
+    def test_union_overlapping_leaves_no_overlap(self):
+        regions = BoxMerger.union_overlapping([(0, 0, 10, 10), (5, 5, 10, 10), (30, 30, 5, 5)], (100, 100, 3))
+        assert sorted(regions) == [(0, 0, 15, 15), (30, 30, 5, 5)]
+
+    def test_union_overlapping_clips_to_the_image(self):
+        assert BoxMerger.union_overlapping([(-5, -5, 10, 10)], (20, 20, 3)) == [(0, 0, 5, 5)]
+
+
+class FixedFaceProcessor(ImageProcessor):
+    """An ImageProcessor that finds one face at the same place in every image."""
+    FACE = (8, 8, 24, 24)
+
+    def detect_stage(self, job, models):
+        job['faces'] = [self.FACE]
+        return job
+
+
+def write_video(path, frame_count, size=(64, 48)):
+    """Writes a short clip of random frames."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, size)
+    assert writer.isOpened()
+    rng = np.random.default_rng(0)
+    for _ in range(frame_count):
+        writer.write(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    writer.release()
+
+
+def count_frames(path):
+    capture = cv2.VideoCapture(path)
+    frames = 0
+    while capture.read()[0]:
+        frames += 1
+    capture.release()
+    return frames
+
+
+class TestVideoProcessor:
+    def test_every_frame_is_redacted_and_written(self, tmp_path):
+        video_path = str(tmp_path / 'clip.mp4')
+        write_video(video_path, 12)
+        progress = []
+        result = VideoProcessor(FixedFaceProcessor(), window=2).process_video(
+            video_path, str(tmp_path), ['mtcnn'], (15, 15),
+            progress_callback=lambda frame_index, frame_count: progress.append((frame_index, frame_count)))
+        assert result['frames'] == 12 and result['faces'] == 12
+        assert result['output_path'] == os.path.join(str(tmp_path), 'clip_obs.mp4')
+        assert count_frames(result['output_path']) == 12
+        assert progress[-1] == (12, 12)
+
+    def test_cancel_stops_after_the_current_frame(self, tmp_path):
+        video_path = str(tmp_path / 'clip.mp4')
+        write_video(video_path, 12)
+        video_processor = VideoProcessor(FixedFaceProcessor(), window=2)
+
+        def cancel_after_three(frame_index, frame_count):
+            if frame_index == 3:
+                video_processor.cancel_flag = True
+
+        result = video_processor.process_video(video_path, str(tmp_path), ['mtcnn'], (15, 15),
+                                               progress_callback=cancel_after_three)
+        assert result['cancelled'] and result['frames'] == 3
+        assert count_frames(result['output_path']) == 3
+
+    def test_unreadable_videos_raise(self, tmp_path):
+        video_path = tmp_path / 'broken.mp4'
+        video_path.write_bytes(b'not a video')
+        with pytest.raises(ValueError):
+            VideoProcessor(FixedFaceProcessor()).process_video(str(video_path), str(tmp_path), ['mtcnn'], (15, 15))
+
+    def test_window_must_be_positive(self):
+        with pytest.raises(ValueError):
+            VideoProcessor(FixedFaceProcessor(), window=0)
+
+
+class TestFaceTracker:
+    @staticmethod
+    def textured_frame(offset=(0, 0)):
+        """Returns a dark frame with a textured 40x40 patch at (60, 40) shifted by offset."""
+        frame = np.zeros((180, 320, 3), dtype=np.uint8)
+        patch = np.random.default_rng(0).integers(0, 256, (40, 40, 3), dtype=np.uint8)
+        x, y = 60 + offset[0], 40 + offset[1]
+        frame[y:y + 40, x:x + 40] = patch
+        return frame
+
+    def test_associate_keeps_a_missed_track_for_max_misses_keyframes(self):
+        tracker = FaceTracker(max_misses=1)
+        tracker._associate(BoxMerger.to_array([(0, 0, 10, 10), (50, 50, 10, 10)]))
+        tracker._associate(BoxMerger.to_array([(1, 1, 10, 10)]))
+        assert sorted(BoxMerger.to_tuples(tracker._tracks)) == [(1, 1, 10, 10), (50, 50, 10, 10)]
+        tracker._associate(BoxMerger.to_array([(1, 1, 10, 10)]))
+        assert BoxMerger.to_tuples(tracker._tracks) == [(1, 1, 10, 10)]
+
+    def test_dilated_boxes_grow_on_every_side_and_clip_to_the_frame(self):
+        tracker = FaceTracker(dilation=0.5)
+        tracker._associate(BoxMerger.to_array([(20, 20, 10, 10), (0, 0, 10, 10)]))
+        assert tracker._dilated_boxes((100, 100, 3)) == [(15, 15, 20, 20), (0, 0, 15, 15)]
+
+    def test_detector_runs_on_keyframes_only(self):
+        tracker = FaceTracker(keyframe_interval=4, dilation=0)
+        calls = []
+
+        def detect(frame):
+            calls.append(tracker.frames)
+            return [(60, 40, 40, 40)]
+
+        for _ in range(9):
+            tracker.update(self.textured_frame(), detect)
+        assert calls == [1, 5, 9]
+
+    def test_scene_changes_force_a_keyframe(self):
+        tracker = FaceTracker(keyframe_interval=100)
+        calls = []
+        tracker.update(self.textured_frame(), lambda frame: calls.append(frame) or [])
+        tracker.update(np.full((180, 320, 3), 255, dtype=np.uint8), lambda frame: calls.append(frame) or [])
+        assert len(calls) == 2
+
+    def test_boxes_follow_the_face_between_keyframes(self):
+        tracker = FaceTracker(keyframe_interval=100, dilation=0)
+        tracker.update(self.textured_frame(), lambda frame: [(60, 40, 40, 40)])
+        boxes = tracker.update(self.textured_frame(offset=(4, 3)), lambda frame: pytest.fail("detector ran"))
+        (x, y, w, h), = boxes
+        assert abs(x - 64) <= 1 and abs(y - 43) <= 1
+        assert abs(w - 40) <= 2 and abs(h - 40) <= 2
+
+    def test_invalid_settings(self):
+        with pytest.raises(ValueError):
+            FaceTracker(keyframe_interval=0)
+        with pytest.raises(ValueError):
+            FaceTracker(dilation=-0.1)
+
+
+class TestTileGrid:
+    def test_small_images_are_one_tile(self):
+        assert Preprocessor.tile_grid((600, 800, 3), 1000, 200) == [(0, 0, 800, 600)]
+
+    def test_tiles_are_spread_evenly_over_the_image(self):
+        tiles = Preprocessor.tile_grid((1000, 2500, 3), 1000, 200)
+        assert tiles == [(0, 0, 1000, 1000), (750, 0, 1000, 1000), (1500, 0, 1000, 1000)]
+
+    def test_every_face_up_to_the_overlap_lies_inside_one_tile(self):
+        shape = (3001, 4567, 3)
+        tiles = Preprocessor.tile_grid(shape, 1024, 256)
+        rng = np.random.default_rng(0)
+        for _ in range(500):
+            size = int(rng.integers(1, 257))
+            x = int(rng.integers(0, shape[1] - size + 1))
+            y = int(rng.integers(0, shape[0] - size + 1))
+            assert any(tx <= x and ty <= y and x + size <= tx + tw and y + size <= ty + th for tx, ty, tw, th in tiles)
+
+    def test_overlap_must_be_smaller_than_the_tile(self):
+        with pytest.raises(ValueError):
+            Preprocessor.tile_grid((2000, 2000, 3), 500, 500)
+
+    def test_tiled_images_are_decoded_once_at_full_resolution(self, tmp_path, monkeypatch):
+        image_path = str(tmp_path / 'large.jpg')
+        write_image(image_path, size=(640, 480))
+        processor = ImageProcessor()
+        processor.apply_settings({'max_image_size': 100, 'tile_size': 256, 'tile_overlap': 64})
+        monkeypatch.setattr(processor.face_detection, 'choose_model', lambda *args, **kwargs: [])
+        reads = []
+        read_image = processor.preprocessor.read_image
+        monkeypatch.setattr(processor.preprocessor, 'read_image', lambda path: reads.append(path) or read_image(path))
+
+        job = processor.decode_stage(image_path, str(tmp_path))
+        assert job['image'] is None and max(job['detection_source'].shape[:2]) == 160
+        job = processor.detect_stage(job, ['mtcnn'])
+        assert job['image'].shape == (480, 640, 3)
+        processor.load_full_image(job)
+        assert reads == [image_path]
+
+
+class TestFaceBlurrer:
+    FACE = (20, 10, 40, 30)
+
+    @staticmethod
+    def noise_image():
+        return np.random.default_rng(0).integers(0, 256, (80, 100, 3), dtype=np.uint8)
+
+    def redact(self, blurrer, blur_effect=(9, 9)):
+        original = self.noise_image()
+        redacted = blurrer.blur_faces(original.copy(), [self.FACE], blur_effect)
+        x, y, w, h = self.FACE
+        outside = np.ones(original.shape[:2], dtype=bool)
+        outside[y:y + h, x:x + w] = False
+        return original[y:y + h, x:x + w], redacted[y:y + h, x:x + w], (original[outside] == redacted[outside]).all()
+
+    @pytest.mark.parametrize('engine', ['box', 'gaussian', 'stack'])
+    @pytest.mark.parametrize('downscale', [False, True])
+    def test_blur_engines_only_smooth_the_face(self, engine, downscale):
+        if engine == 'stack' and not hasattr(cv2, 'stackBlur'):
+            pytest.skip("stack blur needs OpenCV 4.7 or newer")
+        before, after, outside_unchanged = self.redact(FaceBlurrer(engine, downscale=downscale), (16, 16))
+        assert outside_unchanged
+        assert after.std() < before.std() / 2
+
+    def test_pixelate_replaces_the_face_with_blocks(self):
+        _, after, outside_unchanged = self.redact(FaceBlurrer('pixelate'), (10, 10))
+        assert outside_unchanged
+        assert len(np.unique(after.reshape(-1, 3), axis=0)) <= 4 * 3
+
+    def test_fill_paints_the_face(self):
+        _, after, outside_unchanged = self.redact(FaceBlurrer('fill', fill_color=(1, 2, 3)))
+        assert outside_unchanged
+        assert (after == (1, 2, 3)).all()
+
+    def test_kernel_grows_with_the_face_when_scaled(self):
+        assert FaceBlurrer().kernel_size(100, 80, (9, 9)) == (9, 9)
+        assert FaceBlurrer(blur_scale=0.5).kernel_size(100, 80, (9, 9)) == (40, 40)
+        assert FaceBlurrer(blur_scale=0.05).kernel_size(100, 80, (9, 9)) == (9, 9)
+
+    def test_faces_outside_the_image_are_ignored(self):
+        image = self.noise_image()
+        assert (FaceBlurrer().blur_faces(image.copy(), [(200, 200, 10, 10)], (9, 9)) == image).all()
+
+    def test_invalid_settings(self):
+        with pytest.raises(ValueError):
+            FaceBlurrer('smudge')
+        with pytest.raises(ValueError):
+            FaceBlurrer(blur_scale=0)
+
+
+class TestMaskedRedaction:
+    FACES = [(10, 10, 20, 20), (20, 20, 20, 20), (150, 100, 30, 30)]
+
+    @staticmethod
+    def face_mask(shape, faces):
+        mask = np.zeros(shape[:2], dtype=bool)
+        for x, y, w, h in faces:
+            mask[max(y, 0):y + h, max(x, 0):x + w] = True
+        return mask
+
+    def test_rect_mask_redacts_exactly_the_faces(self):
+        image = np.random.default_rng(1).integers(0, 256, (200, 240, 3), dtype=np.uint8)
+        redacted = FaceBlurrer('box', mask_shape='rect').blur_faces(image.copy(), self.FACES, (9, 9))
+        mask = self.face_mask(image.shape, self.FACES)
+        assert (redacted[~mask] == image[~mask]).all()
+        assert (redacted[mask] != image[mask]).mean() > 0.9
+
+    def test_fill_matches_per_face_redaction(self):
+        image = np.random.default_rng(1).integers(0, 256, (200, 240, 3), dtype=np.uint8)
+        per_face = FaceBlurrer('fill').blur_faces(image.copy(), self.FACES, (9, 9))
+        masked = FaceBlurrer('fill', mask_shape='rect').blur_faces(image.copy(), self.FACES, (9, 9))
+        assert (per_face == masked).all()
+
+    def test_ellipse_mask_leaves_the_box_corners(self):
+        image = np.full((100, 100, 3), 200, dtype=np.uint8)
+        redacted = FaceBlurrer('fill', mask_shape='ellipse').blur_faces(image.copy(), [(20, 20, 40, 40)], (9, 9))
+        assert (redacted[40, 40] == 0).all()
+        assert (redacted[21, 21] == 200).all() and (redacted[58, 58] == 200).all()
+
+    def test_faces_are_clipped_to_the_image(self):
+        image = np.full((50, 50, 3), 200, dtype=np.uint8)
+        redacted = FaceBlurrer('fill', mask_shape='rect').blur_faces(image.copy(), [(-10, -10, 20, 20), (80, 80, 5, 5)], (9, 9))
+        assert (redacted[:10, :10] == 0).all()
+        assert (redacted[10:, :] == 200).all() and (redacted[:, 10:] == 200).all()
+
+    def test_unknown_mask_shape(self):
+        with pytest.raises(ValueError):
+            FaceBlurrer(mask_shape='circle')
+
+
+class TestOutputEncoder:
+    def test_presets_apply_their_options_and_overrides(self):
+        assert OutputEncoder.preset('archive') == OutputEncoder.PRESETS['archive']
+        options = OutputEncoder.preset('fast', jpeg_quality=80, png_compression=None)
+        assert options['jpeg_quality'] == 80
+        assert options['png_compression'] == OutputEncoder.PRESETS['fast']['png_compression']
+        with pytest.raises(ValueError):
+            OutputEncoder.preset('unknown')
+
+    def test_invalid_options(self):
+        with pytest.raises(ValueError):
+            OutputEncoder(options={'jpeg_quality': 101})
+        with pytest.raises(ValueError):
+            OutputEncoder(options={'gif_dither': True})
+        with pytest.raises(ValueError):
+            OutputEncoder(output_format='gif')
+
+    def test_output_format_sets_the_extension(self):
+        assert OutputEncoder().output_path('out/a_obs.png') == 'out/a_obs.png'
+        assert OutputEncoder('webp').output_path('out/a_obs.png') == 'out/a_obs.webp'
+
+    def test_jpeg_quality_is_applied(self, tmp_path):
+        image = np.random.default_rng(0).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        low, high = str(tmp_path / 'low.jpg'), str(tmp_path / 'high.jpg')
+        assert OutputEncoder(options={'jpeg_quality': 20}).encode(image, low)
+        assert OutputEncoder(options={'jpeg_quality': 98}).encode(image, high)
+        assert os.path.getsize(low) < os.path.getsize(high)
+        assert sorted(os.listdir(tmp_path)) == ['high.jpg', 'low.jpg']
+
+
+class TestTimingHistogram:
+    def test_stage_timer_adds_up_repeated_stages(self):
+        timings = {}
+        with StageTimer(timings, 'read'):
+            pass
+        first = timings['read']
+        with StageTimer(timings, 'read'):
+            time.sleep(0.001)
+        assert timings['read'] >= first + 0.001
+        with StageTimer(None, 'read'):
+            pass
+
+    def test_counts_totals_and_maximum(self):
+        histogram = TimingHistogram()
+        histogram.add({'read': 0.01, 'detect': 0.1})
+        histogram.add({'read': 0.03})
+        stages = histogram.to_dict()
+        assert stages['read']['count'] == 2 and stages['detect']['count'] == 1
+        assert stages['read']['total'] == pytest.approx(0.04)
+        assert stages['read']['mean'] == pytest.approx(0.02)
+        assert stages['read']['max'] == 0.03
+        assert sum(stages['read']['buckets'].values()) == 2 and '+Inf' in stages['read']['buckets']
+
+    def test_percentiles_fall_inside_the_bucket_holding_them(self):
+        histogram = TimingHistogram()
+        for _ in range(90):
+            histogram.add({'detect': 0.003})
+        for _ in range(10):
+            histogram.add({'detect': 0.3})
+        assert 0.002 < histogram.percentile('detect', 50) <= 0.005
+        assert 0.2 < histogram.percentile('detect', 99) <= 0.3
+        assert histogram.percentile('detect', 100) == pytest.approx(0.3)
+
+    def test_percentiles_never_exceed_the_maximum(self):
+        histogram = TimingHistogram()
+        histogram.add({'encode': 0.0123})
+        assert histogram.percentile('encode', 99) <= 0.0123
+        assert histogram.percentile('encode', 100) == pytest.approx(0.0123)
+
+    def test_table_lists_the_slowest_stage_first(self):
+        histogram = TimingHistogram()
+        histogram.add({'read': 0.01, 'detect': 0.5, 'encode': 0.02})
+        lines = TimingHistogram.format_table(histogram.to_dict()).splitlines()
+        assert lines[0].split()[0] == 'stage'
+        assert [line.split()[0] for line in lines[2:]] == ['detect', 'encode', 'read']
+
+
+class TestThumbnail:
+    def test_keeps_the_aspect_ratio_within_the_size(self):
+        image = np.zeros((300, 1200, 3), dtype=np.uint8)
+        assert Preprocessor.thumbnail(image, 400).shape == (100, 400, 3)
+
+    def test_small_images_are_copied_unscaled(self):
+        image = np.zeros((30, 40, 3), dtype=np.uint8)
+        thumbnail = Preprocessor.thumbnail(image, 400)
+        assert thumbnail.shape == image.shape and thumbnail is not image
+
+
+class TestMetrics:
+    @staticmethod
+    def samples(text):
+        """Parses the sample lines of a Prometheus exposition into a dict of series to value."""
+        return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+                for line in text.splitlines() if line and not line.startswith('#')}
+
+    def test_counters_follow_observed_results(self):
+        metrics = Metrics()
+        metrics.observe({'faces': 2, 'timings': {'detect': 0.01}})
+        metrics.observe({'faces': 0, 'timings': {'detect': 0.02}})
+        metrics.observe_error()
+        samples = self.samples(metrics.render())
+        assert samples['obscurrra_images_total'] == 2
+        assert samples['obscurrra_faces_total'] == 2
+        assert samples['obscurrra_images_without_faces_total'] == 1
+        assert samples['obscurrra_errors_total'] == 1
+        assert 'obscurrra_last_image_time_seconds' in samples
+
+    def test_every_series_has_help_and_type(self):
+        metrics = Metrics()
+        metrics.observe({'faces': 1, 'timings': {'read': 0.001}, 'elapsed_time': 0.01})
+        lines = metrics.render().splitlines()
+        names = {line.split()[2] for line in lines if line.startswith('# TYPE')}
+        assert {'obscurrra_images_total', 'obscurrra_stage_duration_seconds', 'obscurrra_image_duration_seconds'} <= names
+        for line in lines:
+            if not line.startswith('#'):
+                name = line.split('{')[0].split()[0]
+                assert any(name == base or name.startswith(base + '_') for base in names)
+
+    def test_histograms_are_cumulative_and_end_at_the_count(self):
+        metrics = Metrics()
+        for duration in (0.003, 0.003, 0.3):
+            metrics.observe({'faces': 1, 'timings': {'detect': duration}, 'elapsed_time': duration})
+        samples = self.samples(metrics.render())
+        buckets = [value for series, value in samples.items()
+                   if series.startswith('obscurrra_stage_duration_seconds_bucket{stage="detect"')]
+        assert buckets == sorted(buckets) and buckets[-1] == 3
+        assert samples['obscurrra_stage_duration_seconds_bucket{stage="detect",le="+Inf"}'] == 3
+        assert samples['obscurrra_stage_duration_seconds_count{stage="detect"}'] == 3
+        assert samples['obscurrra_stage_duration_seconds_sum{stage="detect"}'] == pytest.approx(0.306)
+        assert samples['obscurrra_image_duration_seconds_count'] == 3
+
+    def test_gauges_with_labels_and_gauge_functions(self):
+        metrics = Metrics()
+        metrics.set_gauge('custom', 1, 'A gauge.', labels={'name': 'a "quoted"\nvalue'})
+        metrics.set_gauge_function('queue_depth', lambda: {'detect': 4}, 'Queue depth.', label='stage')
+        metrics.set_gauge_function('broken', lambda: 1 / 0, 'Fails.')
+        text = metrics.render()
+        samples = self.samples(text)
+        assert samples['obscurrra_custom{name="a \\"quoted\\"\\nvalue"}'] == 1
+        assert samples['obscurrra_queue_depth{stage="detect"}'] == 4
+        assert 'obscurrra_broken' not in text
+        metrics.remove_gauge_function('queue_depth')
+        assert 'obscurrra_queue_depth' not in metrics.render()
+
+    def test_textfile_is_replaced_with_the_current_values(self, tmp_path):
+        metrics = Metrics()
+        path = str(tmp_path / 'obscurrra.prom')
+        metrics.write_textfile(path)
+        metrics.observe({'faces': 1, 'timings': {}})
+        metrics.write_textfile(path)
+        with open(path, encoding='utf-8') as file:
+            assert self.samples(file.read())['obscurrra_images_total'] == 1
+        assert os.listdir(tmp_path) == ['obscurrra.prom']
+
+
+class TestDirectoryWalker:
+    @pytest.fixture
+    def tree(self, tmp_path):
+        for relative_path in ('top.png', '2020/01/a.png', '2020/02/a.png', '2020/02/notes.txt',
+                              'thumbnails/t.png', 'out/old_obs.png'):
+            path = tmp_path / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'')
+        return tmp_path
+
+    def relative(self, root, paths):
+        return sorted(os.path.relpath(path, root).replace(os.sep, '/') for path in paths)
+
+    def test_top_level_only_by_default(self, tree):
+        assert self.relative(tree, DirectoryManager.walk_image_files([str(tree)])) == ['top.png']
+
+    def test_recursive_walk_skips_the_output_folder(self, tree):
+        paths = DirectoryManager.walk_image_files([str(tree)], recursive=True, skip_dirs=[str(tree / 'out')])
+        assert self.relative(tree, paths) == ['2020/01/a.png', '2020/02/a.png', 'thumbnails/t.png', 'top.png']
+
+    def test_include_and_exclude_globs(self, tree):
+        paths = DirectoryManager.walk_image_files([str(tree)], recursive=True, include=['2020/*'],
+                                                  exclude=['thumbnails', '*/02/*'])
+        assert self.relative(tree, paths) == ['2020/01/a.png']
+
+    def test_output_paths_mirror_the_input_tree(self, tree):
+        output_folder = str(tree / 'out')
+        paths = {os.path.relpath(ImageProcessor.get_output_path(str(tree / relative_path), output_folder, str(tree)),
+                                 output_folder).replace(os.sep, '/')
+                 for relative_path in ('2020/01/a.png', '2020/02/a.png', 'top.png')}
+        assert paths == {'2020/01/a_obs.png', '2020/02/a_obs.png', 'top_obs.png'}
+
+    def test_folders_starting_with_dots_are_mirrored(self, tree):
+        output_path = ImageProcessor.get_output_path(str(tree / '..2020' / 'a.png'), str(tree / 'out'), str(tree))
+        assert output_path == os.path.join(str(tree / 'out'), '..2020', 'a_obs.png')
+
+    def test_images_outside_the_input_root_are_flat(self, tree):
+        output_path = ImageProcessor.get_output_path(str(tree / '2020' / 'a.png'), str(tree / 'out'), str(tree / '2021'))
+        assert output_path == os.path.join(str(tree / 'out'), 'a_obs.png')
+
+    def test_output_paths_are_flat_without_an_input_root(self, tree):
+        output_path = ImageProcessor.get_output_path(str(tree / '2020' / '01' / 'a.png'), str(tree / 'out'))
+        assert output_path == os.path.join(str(tree / 'out'), 'a_obs.png')
+
+    def test_input_root_is_the_common_folder(self, tree):
+        root = DirectoryManager.input_root([str(tree / '2020' / '01'), str(tree / '2020' / '02' / 'a.png')])
+        assert root == str(tree / '2020')
+
+
+class TestModelRegistry:
+    @pytest.fixture(autouse=True)
+    def empty_registry(self, monkeypatch):
+        monkeypatch.setattr(ModelRegistry, '_models', {})
+
+    def test_failed_loads_are_retried(self, monkeypatch):
+        results = [None, 'model']
+        monkeypatch.setattr(ModelRegistry, '_load', staticmethod(lambda name: results.pop(0)))
+        assert ModelRegistry.get('frontalface') is None
+        assert not ModelRegistry.is_loaded('frontalface')
+        assert ModelRegistry.get('frontalface') == 'model'
+        assert ModelRegistry.is_loaded('frontalface')
+
+    @pytest.mark.skipif(not hasattr(cv2, 'CascadeClassifier'), reason='OpenCV is built without objdetect')
+    def test_cascades_load_from_any_working_directory(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        assert ModelRegistry.get('frontalface') is not None
+        assert ModelRegistry.get('profileface') is not None
+
+    def test_a_missing_selected_model_is_an_error(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(FaceDetection, 'MODEL_DIR', str(tmp_path))
+        gray = np.zeros((64, 64), dtype=np.uint8)
+        with pytest.raises(IOError):
+            ModelRegistry.require(['profileface'])
+        with pytest.raises(IOError):
+            FaceDetection().choose_model(['profileface'], cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), gray)